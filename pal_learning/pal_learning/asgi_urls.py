@@ -0,0 +1,13 @@
+"""
+The project's URLs as routed under ASGI: the same as pal_learning.urls, with
+the async twins of the student read views.
+"""
+from django.contrib import admin
+from django.urls import path, include
+
+from pal_learning_app.urls import asgi_urlpatterns
+
+urlpatterns = [
+    path('admin/', admin.site.urls),
+    path('', include(asgi_urlpatterns)),
+]
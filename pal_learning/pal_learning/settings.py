@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -41,7 +42,21 @@ INSTALLED_APPS = [
 ]
 AUTH_USER_MODEL = 'pal_learning_app.CustomUser'
 
+# PAL_CACHED_AUTH=1 reads sessions through the cache and rebuilds
+# request.user from a cached snapshot, two queries fewer per page. Turn it
+# on only with a cache every worker shares (file or redis), so that
+# invalidations reach all of them.
+CACHED_AUTH = os.environ.get('PAL_CACHED_AUTH') == '1'
+# both backends check passwords on the hashing pool (see below) when
+# signing in through aauthenticate()
+AUTHENTICATION_BACKENDS = ['pal_learning_app.backends.HashingPoolBackend']
+if CACHED_AUTH:
+    SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+    AUTHENTICATION_BACKENDS = ['pal_learning_app.backends.CachedModelBackend']
+
 MIDDLEWARE = [
+    'pal_learning_app.middleware.metrics_middleware',
+    'pal_learning_app.middleware.asgi_urlconf_middleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -52,6 +67,8 @@ MIDDLEWARE = [
 ]
 
 ROOT_URLCONF = 'pal_learning.urls'
+# under ASGI the read views run as async views; under WSGI the sync ones do
+ASGI_URLCONF = 'pal_learning.asgi_urls'
 
 TEMPLATES = [
     {
@@ -69,6 +86,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'pal_learning.wsgi.application'
+ASGI_APPLICATION = 'pal_learning.asgi.application'
 
 
 # Database
@@ -82,6 +100,31 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# PAL_CACHE_BACKEND selects local memory (default), file or redis; for file
+# and redis PAL_CACHE_LOCATION is the directory or server URL.
+
+CACHE_BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'file':   'django.core.cache.backends.filebased.FileBasedCache',
+    'redis':  'django.core.cache.backends.redis.RedisCache',
+}
+CACHE_LOCATIONS = {
+    'locmem': 'pal-learning',
+    'file':   '/var/tmp/pal_learning_cache',
+    'redis':  'redis://127.0.0.1:6379',
+}
+CACHE_BACKEND = os.environ.get('PAL_CACHE_BACKEND', 'locmem')
+
+CACHES = {
+    'default': {
+        'BACKEND':  CACHE_BACKENDS[CACHE_BACKEND],
+        'LOCATION': os.environ.get('PAL_CACHE_LOCATION', CACHE_LOCATIONS[CACHE_BACKEND]),
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -101,6 +144,15 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Password hashing runs on a small pool of threads so that a burst of
+# sign-ins cannot hold every worker. A sign-in that finds
+# PASSWORD_HASH_QUEUE others already waiting, or gets no result within
+# PASSWORD_HASH_TIMEOUT seconds, is asked to retry (HTTP 503).
+PASSWORD_HASH_WORKERS = 2
+PASSWORD_HASH_QUEUE = 32
+PASSWORD_HASH_TIMEOUT = 5
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.2/topics/i18n/
 
@@ -126,3 +178,32 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 LOGIN_URL = '/login/'
 LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = '/login/'
+
+# Course catalog search
+# SEARCH_BACKEND may point at any pal_learning_app.search.SearchBackend
+# subclass; by default SQLite uses the FTS5 index and other databases fall
+# back to a portable LIKE search.
+SEARCH_BACKEND = None
+
+# Lesson progress heartbeats are buffered in-process and written in bulk
+# every PROGRESS_FLUSH_INTERVAL seconds (0 writes each event immediately).
+PROGRESS_FLUSH_INTERVAL = 5
+
+# Live updates
+# Open discussion threads receive new comments over server-sent events,
+# which need the ASGI application. PAL_PUBSUB_BACKEND is 'local' for a
+# single process or 'redis' to fan out across workers through any
+# Redis-compatible server at PAL_PUBSUB_LOCATION (redis:// or unix:// URL).
+PUBSUB_BACKEND = os.environ.get('PAL_PUBSUB_BACKEND', 'local')
+PUBSUB_LOCATION = os.environ.get('PAL_PUBSUB_LOCATION', 'redis://127.0.0.1:6379/0')
+
+# Request metrics
+# Every worker keeps per-view latency, SQL and response-size metrics; with
+# PAL_METRICS_DIR set (a directory all workers can write to) /metrics
+# reports all of them, labelled by worker pid; workers that haven't written
+# for METRICS_STALE_AFTER seconds are dropped. /metrics answers staff users
+# and scrapers sending "Authorization: Bearer <PAL_METRICS_TOKEN>".
+METRICS_DIR = os.environ.get('PAL_METRICS_DIR') or None
+METRICS_FLUSH_INTERVAL = 10
+METRICS_STALE_AFTER = 6 * METRICS_FLUSH_INTERVAL
+METRICS_TOKEN = os.environ.get('PAL_METRICS_TOKEN') or None
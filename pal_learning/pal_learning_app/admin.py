@@ -1,14 +1,21 @@
 from django.contrib import admin
+from django.db import transaction
 from .models import (
     CustomUser, Course, Module, Lesson, Quiz, Question, Choice,
     Enrollment, Progress, QuizSubmission, DiscussionThread, Comment
 )
+from .backends import invalidate_user_snapshots
+from .course_io import clone_course
+from .exports import export_response
+from .grading import schedule_regrade
 
 # 1) Admin action to approve instructors
 @admin.action(description="Approve selected instructors")
 def approve_instructors(modeladmin, request, queryset):
     to_approve = queryset.filter(role=CustomUser.INSTRUCTOR, is_approved=False)
-    count = to_approve.update(is_approved=True, is_active=True)
+    user_ids = list(to_approve.values_list('id', flat=True))
+    count = CustomUser.objects.filter(pk__in=user_ids).update(is_approved=True, is_active=True)
+    invalidate_user_snapshots(user_ids)
     modeladmin.message_user(request, f"{count} instructor account(s) approved.")
 
 # 2) CustomUser admin
@@ -29,12 +36,34 @@ class LessonInline(admin.TabularInline):
     extra = 1
 
 # 3) Course admin
+@admin.action(description="Duplicate selected courses")
+def duplicate_courses(modeladmin, request, queryset):
+    courses = list(queryset.select_related('instructor'))
+    with transaction.atomic():
+        for course in courses:
+            clone_course(course)
+    modeladmin.message_user(request, f"{len(courses)} course(s) duplicated.")
+
+def _export_action(kind, description):
+    @admin.action(description=description)
+    def action(modeladmin, request, queryset):
+        course_ids = list(queryset.values_list('id', flat=True))
+        return export_response(request, kind, course_ids, compress=True)
+    action.__name__ = f"export_{kind.replace('-', '_')}"
+    return action
+
 @admin.register(Course)
 class CourseAdmin(admin.ModelAdmin):
     list_display   = ('title', 'instructor', 'difficulty', 'created_at')
     list_filter    = ('difficulty', 'instructor')
     search_fields  = ('title', 'topic')
     inlines        = [ModuleInline]
+    actions        = [
+        duplicate_courses,
+        _export_action('enrollments', "Export enrollments (CSV, gzipped)"),
+        _export_action('progress', "Export lesson progress (CSV, gzipped)"),
+        _export_action('quiz-submissions', "Export quiz scores (CSV, gzipped)"),
+    ]
 
 # 4) Module admin
 @admin.register(Module)
@@ -51,11 +80,18 @@ class LessonAdmin(admin.ModelAdmin):
     search_fields  = ('title', 'body')
 
 # 6) Quiz + related
+@admin.action(description="Regrade submissions against the current answer key")
+def regrade_submissions(modeladmin, request, queryset):
+    for quiz in queryset:
+        schedule_regrade(quiz.pk)
+    modeladmin.message_user(request, f"Regrading {queryset.count()} quiz(zes) in the background.")
+
 @admin.register(Quiz)
 class QuizAdmin(admin.ModelAdmin):
     list_display  = ('title', 'lesson')
     list_filter   = ('lesson',)
     search_fields = ('title',)
+    actions       = [regrade_submissions]
 
 @admin.register(Question)
 class QuestionAdmin(admin.ModelAdmin):
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class PalLearningAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'pal_learning_app'
+
+    def ready(self):
+        from . import metrics, signals  # noqa: F401
@@ -0,0 +1,106 @@
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+from django.db import transaction
+
+from . import hashing
+from .models import CustomUser
+
+USER_SNAPSHOT_TIMEOUT = 60 * 60
+# everything the app reads from request.user; anything else loads lazily
+SNAPSHOT_FIELDS = {
+    'id', 'email', 'first_name', 'role', 'is_approved',
+    'is_active', 'is_staff', 'is_superuser',
+}
+SNAPSHOT_ATTNAMES = [
+    field.attname for field in CustomUser._meta.concrete_fields
+    if field.attname in SNAPSHOT_FIELDS
+]
+
+
+def _cache_key(user_id):
+    return f'user-snapshot:{user_id}'
+
+
+def _snapshot(user):
+    # the session hash stands in for the password it is derived from, which
+    # never goes into the cache
+    return {
+        'values': [getattr(user, attname) for attname in SNAPSHOT_ATTNAMES],
+        'session_hash': user.get_session_auth_hash(),
+    }
+
+
+def _from_snapshot(snapshot):
+    user = CustomUser.from_db('default', SNAPSHOT_ATTNAMES, snapshot['values'])
+    user._session_auth_hash = snapshot['session_hash']
+    return user
+
+
+def _load(user_id):
+    return (
+        CustomUser._default_manager
+                  .only(*SNAPSHOT_ATTNAMES, 'password')
+                  .filter(pk=user_id)
+    )
+
+
+class HashingPoolBackend(ModelBackend):
+    """
+    ModelBackend whose async authentication checks, and when the hasher
+    changed upgrades, the password on the hashing pool. Raises
+    hashing.PoolBusy when the pool can't take the job.
+    """
+
+    async def aauthenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(CustomUser.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        try:
+            user = await CustomUser._default_manager.aget_by_natural_key(username)
+        except CustomUser.DoesNotExist:
+            user = None
+        # an unknown account still costs one hash
+        if not await hashing.acheck_password(password, user.password if user else None):
+            return None
+        if hashing.must_update(user.password):
+            user.password = await hashing.amake_password(password)
+            await user.asave(update_fields=['password'])
+        return user if self.user_can_authenticate(user) else None
+
+
+class CachedModelBackend(HashingPoolBackend):
+    """
+    ModelBackend whose per-request user lookup is served from a cached
+    snapshot of the few fields the app reads.
+    """
+
+    def get_user(self, user_id):
+        snapshot = cache.get(_cache_key(user_id))
+        if snapshot is not None:
+            user = _from_snapshot(snapshot)
+        else:
+            user = _load(user_id).first()
+            if user is None:
+                return None
+            cache.set(_cache_key(user_id), _snapshot(user), USER_SNAPSHOT_TIMEOUT)
+        return user if self.user_can_authenticate(user) else None
+
+    async def aget_user(self, user_id):
+        snapshot = await cache.aget(_cache_key(user_id))
+        if snapshot is not None:
+            user = _from_snapshot(snapshot)
+        else:
+            user = await _load(user_id).afirst()
+            if user is None:
+                return None
+            await cache.aset(_cache_key(user_id), _snapshot(user), USER_SNAPSHOT_TIMEOUT)
+        return user if self.user_can_authenticate(user) else None
+
+
+def invalidate_user_snapshots(user_ids):
+    keys = [_cache_key(user_id) for user_id in user_ids]
+    cache.delete_many(keys)
+    # and again once the change is visible, in case a concurrent request
+    # cached the old row in between
+    transaction.on_commit(lambda: cache.delete_many(keys))
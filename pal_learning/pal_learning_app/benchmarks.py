@@ -0,0 +1,132 @@
+"""
+Load helpers for the benchmark management commands.
+
+Requests go through Django's full handler stack (middleware, views,
+templates) in-process, without a network server in front, so the numbers
+compare code paths rather than deployments. Each handler runs the views it
+is routed to in production: the Client's WSGI handler the sync views, the
+AsyncClient's ASGI handler their async twins (settings.ASGI_URLCONF).
+"""
+import asyncio
+import itertools
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+
+
+def _allow_test_host():
+    # the test clients send Host: testserver
+    return override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'])
+
+
+def percentile(values, pct):
+    # nearest-rank percentile of an already sorted list
+    if not values:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(values)))
+    return values[rank - 1]
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 2) if seconds is not None else None
+
+
+def summarize(latencies, elapsed, errors=0, queries=None):
+    latencies = sorted(latencies)
+    summary = {
+        'requests': len(latencies),
+        'errors': errors,
+        'seconds': round(elapsed, 3),
+        'rps': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'mean_ms': _ms(sum(latencies) / len(latencies)) if latencies else None,
+        'p50_ms': _ms(percentile(latencies, 50)),
+        'p95_ms': _ms(percentile(latencies, 95)),
+        'p99_ms': _ms(percentile(latencies, 99)),
+    }
+    if queries:
+        summary['mean_queries'] = round(sum(queries) / len(queries), 2)
+        summary['max_queries'] = max(queries)
+    return summary
+
+
+class QueryCounter:
+    """Execute wrapper counting the queries run on this thread's connection."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def run_wsgi(paths, user, concurrency, total, expect=(200,)):
+    """
+    Issue ``total`` requests cycling over ``paths`` from ``concurrency``
+    threads. A path may be a (method, path, data) tuple instead of a GET.
+    """
+    local = threading.local()
+    counter = itertools.count()
+    latencies, errors, queries = [], [], []
+
+    def client():
+        if not hasattr(local, 'client'):
+            # a failing view counts as an error instead of ending the run
+            local.client = Client(raise_request_exception=False)
+            local.client.force_login(user)
+        return local.client
+
+    def one(_):
+        item = paths[next(counter) % len(paths)]
+        method, path, data = item if isinstance(item, tuple) else ('get', item, None)
+        # the Client is a WSGI handler: this runs the sync views, on this thread
+        send = getattr(client(), method)
+        queries_run = QueryCounter()
+        with connection.execute_wrapper(queries_run):
+            start = time.perf_counter()
+            response = send(path, data)
+            latencies.append(time.perf_counter() - start)
+        queries.append(queries_run.count)
+        if response.status_code not in expect:
+            errors.append(path)
+
+    # log every worker in before the clock starts
+    with _allow_test_host(), ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(lambda _: client(), range(concurrency)))
+        start = time.perf_counter()
+        list(pool.map(one, range(total)))
+        elapsed = time.perf_counter() - start
+    return summarize(latencies, elapsed, len(errors), queries)
+
+
+def run_asgi(paths, user, concurrency, total):
+    """Issue ``total`` GETs cycling over ``paths`` from ``concurrency`` tasks."""
+    latencies, errors = [], []
+
+    async def worker(client, jobs):
+        for n in jobs:
+            path = paths[n % len(paths)]
+            start = time.perf_counter()
+            response = await client.get(path)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                errors.append(path)
+
+    async def main():
+        clients = [AsyncClient() for _ in range(concurrency)]
+        for client in clients:
+            await client.aforce_login(user)
+        jobs = iter(range(total))
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client, jobs) for client in clients))
+        return time.perf_counter() - start
+
+    with _allow_test_host():
+        elapsed = asyncio.run(main())
+    return summarize(latencies, elapsed, len(errors))
@@ -0,0 +1,236 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Max, Sum
+from django.utils import timezone
+
+from .models import (
+    Comment, Course, CourseDailyEnrollment, CourseStats, DiscussionThread, Enrollment, Lesson, Progress,
+    QuizSubmission,
+)
+from .utils import conflict_target
+
+RECOUNT_BATCH_SIZE = 1000
+
+
+def recount_enrollments(enrollments):
+    """
+    Recompute the dashboard counters of ``enrollments`` from the raw tables,
+    with one grouped query per counter for the whole batch.
+    """
+    enrollments = list(enrollments)
+    if not enrollments:
+        return 0
+    course_ids = {e.course_id for e in enrollments}
+    student_ids = {e.student_id for e in enrollments}
+
+    total = dict(
+        Lesson.objects.filter(module__course_id__in=course_ids)
+                      .values_list('module__course_id')
+                      .annotate(n=Count('id'))
+    )
+    completed = {
+        (student_id, course_id): n
+        for student_id, course_id, n in
+        Progress.objects.filter(student_id__in=student_ids,
+                                lesson__module__course_id__in=course_ids,
+                                completed_at__isnull=False)
+                        .values_list('student_id', 'lesson__module__course_id')
+                        .annotate(n=Count('id'))
+    }
+    quizzes = {
+        (student_id, course_id): (n, score)
+        for student_id, course_id, n, score in
+        QuizSubmission.objects.filter(student_id__in=student_ids,
+                                      quiz__lesson__module__course_id__in=course_ids)
+                              .values_list('student_id', 'quiz__lesson__module__course_id')
+                              .annotate(n=Count('id'), score=Sum('score'))
+    }
+
+    for enrollment in enrollments:
+        key = (enrollment.student_id, enrollment.course_id)
+        enrollment.total_lessons = total.get(enrollment.course_id, 0)
+        enrollment.completed_lessons = completed.get(key, 0)
+        enrollment.quizzes_taken, enrollment.quiz_score_total = quizzes.get(key, (0, 0))
+    Enrollment.objects.bulk_update(
+        enrollments,
+        ['total_lessons', 'completed_lessons', 'quizzes_taken', 'quiz_score_total'],
+        batch_size=RECOUNT_BATCH_SIZE,
+    )
+    return len(enrollments)
+
+
+def lesson_added(course_id):
+    Enrollment.objects.filter(course_id=course_id).update(total_lessons=F('total_lessons') + 1)
+
+
+def lesson_removed(lesson, course_id):
+    # students who completed it lose that completion along with the lesson
+    completed_by = (
+        Progress.objects.filter(lesson=lesson, completed_at__isnull=False)
+                        .values('student_id')
+    )
+    Enrollment.objects.filter(course_id=course_id, student_id__in=completed_by).update(
+        completed_lessons=F('completed_lessons') - 1
+    )
+    Enrollment.objects.filter(course_id=course_id, total_lessons__gt=0).update(
+        total_lessons=F('total_lessons') - 1
+    )
+
+
+def lessons_completed(counts):
+    """``counts`` maps (student id, course id) -> newly completed lessons."""
+    for (student_id, course_id), n in counts.items():
+        Enrollment.objects.filter(student_id=student_id, course_id=course_id).update(
+            completed_lessons=F('completed_lessons') + n
+        )
+
+
+def comment_added(thread_id, created_at):
+    DiscussionThread.objects.filter(pk=thread_id).update(
+        comment_count=F('comment_count') + 1,
+        last_activity_at=created_at,
+    )
+
+
+def comment_removed(thread_id):
+    DiscussionThread.objects.filter(pk=thread_id, comment_count__gt=0).update(
+        comment_count=F('comment_count') - 1
+    )
+
+
+def recount_threads(threads):
+    """Recompute comment_count and last_activity_at of ``threads``."""
+    threads = list(threads)
+    activity = {
+        thread_id: (n, last)
+        for thread_id, n, last in
+        Comment.objects.filter(thread__in=threads)
+                       .values_list('thread_id')
+                       .annotate(n=Count('id'), last=Max('created_at'))
+    }
+    for thread in threads:
+        thread.comment_count, last = activity.get(thread.pk, (0, None))
+        thread.last_activity_at = max(last, thread.created_at) if last else thread.created_at
+    DiscussionThread.objects.bulk_update(
+        threads, ['comment_count', 'last_activity_at'], batch_size=RECOUNT_BATCH_SIZE
+    )
+    return len(threads)
+
+
+def _bump(model, lookup, **deltas):
+    # add ``deltas`` to the row matching ``lookup``, creating it if needed
+    changes = {field: F(field) + delta for field, delta in deltas.items()}
+    if model.objects.filter(**lookup).update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**lookup, **deltas)
+    except IntegrityError:
+        # somebody else created the row in the meantime; if there is still
+        # no row, the insert broke a constraint and the delta would be lost
+        if not model.objects.filter(**lookup).update(**changes):
+            raise
+
+
+def enrollment_status_changed(course_id, old_status, new_status):
+    """Roll a status transition (``old_status`` None for a new enrollment) up."""
+    if old_status == new_status:
+        return
+    deltas = {new_status: 1}
+    if old_status is not None:
+        deltas[old_status] = -1
+    _bump(CourseStats, {'course_id': course_id}, **deltas)
+
+    today = timezone.localdate()
+    if new_status == Enrollment.DROPPED:
+        _bump(CourseDailyEnrollment, {'course_id': course_id, 'day': today}, drops=1)
+    elif new_status == Enrollment.IN_PROGRESS:
+        _bump(CourseDailyEnrollment, {'course_id': course_id, 'day': today}, enrollments=1)
+
+
+def quiz_attempt_recorded(student, course_id, score, previous_score=None):
+    # a retake replaces the earlier score instead of adding a new quiz
+    if previous_score is None:
+        deltas = {'quizzes_taken': 1, 'quiz_score_total': score}
+        _bump(CourseStats, {'course_id': course_id}, quiz_submissions=1, quiz_score_total=score)
+    else:
+        deltas = {'quiz_score_total': score - previous_score}
+        _bump(CourseStats, {'course_id': course_id}, quiz_score_total=score - previous_score)
+    Enrollment.objects.filter(student=student, course_id=course_id).update(
+        **{field: F(field) + delta for field, delta in deltas.items()}
+    )
+
+
+def _recount_students(course_id, student_ids):
+    student_ids = list(student_ids)
+    for start in range(0, len(student_ids), RECOUNT_BATCH_SIZE):
+        recount_enrollments(Enrollment.objects.filter(
+            course_id=course_id,
+            student_id__in=student_ids[start:start + RECOUNT_BATCH_SIZE],
+        ))
+
+
+def quiz_regraded(course_id, student_ids):
+    # a regrade rewrites stored scores in bulk: recount what depends on them
+    _recount_students(course_id, student_ids)
+    reconcile_course_stats([course_id])
+
+
+def rows_deleted(course_ids, student_ids=()):
+    """
+    Recount what a cascading delete took rows out from under: the rollups
+    of ``course_ids`` and the enrollment counters of ``student_ids`` in
+    them. Runs once the delete commits, for the courses still there.
+    """
+    course_ids, student_ids = set(course_ids), list(student_ids)
+
+    def recount():
+        with transaction.atomic():
+            remaining = list(Course.objects.filter(pk__in=course_ids).values_list('id', flat=True))
+            for course_id in remaining:
+                _recount_students(course_id, student_ids)
+            if remaining:
+                reconcile_course_stats(remaining)
+    transaction.on_commit(recount)
+
+
+def reconcile_course_stats(course_ids):
+    """Recompute the CourseStats rows of ``course_ids`` from the raw tables."""
+    stats = {course_id: CourseStats(course_id=course_id) for course_id in course_ids}
+    for course_id, status, n in (
+        Enrollment.objects.filter(course_id__in=course_ids)
+                          .values_list('course_id', 'status')
+                          .annotate(n=Count('id'))
+    ):
+        setattr(stats[course_id], status, n)
+    for course_id, n, score in (
+        QuizSubmission.objects.filter(quiz__lesson__module__course_id__in=course_ids)
+                              .values_list('quiz__lesson__module__course_id')
+                              .annotate(n=Count('id'), score=Sum('score'))
+    ):
+        stats[course_id].quiz_submissions = n
+        stats[course_id].quiz_score_total = score
+
+    CourseStats.objects.bulk_create(
+        stats.values(),
+        update_conflicts=True,
+        unique_fields=conflict_target('course'),
+        update_fields=['in_progress', 'completed', 'dropped', 'quiz_submissions', 'quiz_score_total'],
+    )
+    return len(stats)
+
+
+def rebuild_daily_enrollments(course_ids):
+    """
+    Regenerate the daily series of ``course_ids`` from Enrollment.enrolled_at.
+    Drops and re-enrollments are not dated in the raw tables, so they are lost.
+    """
+    CourseDailyEnrollment.objects.filter(course_id__in=course_ids).delete()
+    rows = (
+        Enrollment.objects.filter(course_id__in=course_ids)
+                          .values_list('course_id', 'enrolled_at__date')
+                          .annotate(n=Count('id'))
+    )
+    CourseDailyEnrollment.objects.bulk_create([
+        CourseDailyEnrollment(course_id=course_id, day=day, enrollments=n)
+        for course_id, day, n in rows
+    ])
@@ -0,0 +1,228 @@
+"""
+Course trees as a stream of flat records, for export, import and cloning.
+
+Every record is a dict with a ``type`` and, except for choices, a ``ref``
+that children use to point at their parent::
+
+    {"type": "course", "ref": 7, "title": "...", "difficulty": "beginner", ...}
+    {"type": "module", "ref": 31, "course": 7, "title": "...", "sort_order": 0}
+    {"type": "lesson", "ref": 112, "module": 31, ...}
+    {"type": "quiz", "ref": 9, "lesson": 112, "title": "..."}
+    {"type": "question", "ref": 40, "quiz": 9, ...}
+    {"type": "choice", "question": 40, "text": "...", "is_correct": true}
+
+Records come level by level (all courses, then all modules, and so on), so
+an import can insert each level with bulk_create while holding nothing but
+the ref -> id map of the levels above it. Backends whose bulk inserts hand
+back no ids (MySQL) get the rows that children point at one INSERT each.
+"""
+import json
+from collections import namedtuple
+
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, connection, transaction
+
+from . import rendering, search
+from .models import Choice, Course, Lesson, Module, Question, Quiz
+from .outline import invalidate_outlines
+
+BATCH_SIZE = 1000
+EXPORT_CHUNK_SIZE = 2000
+
+Level = namedtuple('Level', 'type model parent fields course_path')
+
+LEVELS = [
+    Level('course', Course, None, ['title', 'description', 'topic', 'difficulty'], 'id'),
+    Level('module', Module, 'course', ['title', 'sort_order'], 'course_id'),
+    Level('lesson', Lesson, 'module',
+          ['title', 'content_type', 'content_url', 'body', 'sort_order'], 'module__course_id'),
+    Level('quiz', Quiz, 'lesson', ['title'], 'lesson__module__course_id'),
+    Level('question', Question, 'quiz', ['text', 'question_type'], 'quiz__lesson__module__course_id'),
+    Level('choice', Choice, 'question', ['text', 'is_correct'], 'question__quiz__lesson__module__course_id'),
+]
+LEVEL_INDEX = {level.type: index for index, level in enumerate(LEVELS)}
+
+
+class CourseImportError(ValueError):
+    pass
+
+
+def iter_course_records(course_ids):
+    """Yield the records of the given courses, level by level, one query per level."""
+    for level in LEVELS:
+        columns = ['id', *([f'{level.parent}_id'] if level.parent else []), *level.fields]
+        rows = (
+            level.model.objects.filter(**{f'{level.course_path}__in': course_ids})
+                               .order_by('id')
+                               .values_list(*columns)
+                               .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+        )
+        for row in rows:
+            record = {'type': level.type, 'ref': row[0]}
+            values = row[1:]
+            if level.parent:
+                record[level.parent] = values[0]
+                values = values[1:]
+            record.update(zip(level.fields, values))
+            yield record
+
+
+def write_records(records, fp, fmt='jsonl'):
+    if fmt == 'jsonl':
+        for record in records:
+            fp.write(json.dumps(record) + '\n')
+        return
+    fp.write('[')
+    for index, record in enumerate(records):
+        fp.write(',\n' if index else '\n')
+        fp.write(json.dumps(record))
+    fp.write('\n]\n')
+
+
+def read_records(fp, chunk_size=64 * 1024):
+    """
+    Yield records from a JSONL stream or a JSON array, without reading the
+    whole input into memory.
+    """
+    decoder = json.JSONDecoder()
+    buffer, position, started, line = '', 0, False, 1
+
+    while True:
+        # skip whitespace, and the array punctuation when reading JSON
+        while position < len(buffer) and buffer[position] in ' \t\r\n,[]':
+            if buffer[position] == '\n':
+                line += 1
+            position += 1
+        if position >= len(buffer) or not started:
+            chunk = fp.read(chunk_size)
+            if not chunk and position >= len(buffer):
+                return
+            buffer, position, started = buffer[position:] + chunk, 0, True
+            continue
+        try:
+            record, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError as exc:
+            chunk = fp.read(chunk_size)
+            if not chunk:
+                raise CourseImportError(f"line {line}: {exc.msg}") from None
+            buffer, position = buffer[position:] + chunk, 0
+            continue
+        if not isinstance(record, dict):
+            raise CourseImportError(f"line {line}: expected an object")
+        line += buffer.count('\n', position, end)
+        position = end
+        yield record
+
+
+def _build(level, record, ids, seen, instructor):
+    values = {field: record[field] for field in level.fields if field in record}
+    obj = level.model(**values)
+    exclude = []
+    if level.parent:
+        parent_id = ids[level.parent].get(record.get(level.parent))
+        if parent_id is None:
+            raise CourseImportError(f"{level.type} points at unknown {level.parent} {record.get(level.parent)!r}")
+        setattr(obj, f'{level.parent}_id', parent_id)
+        exclude.append(level.parent)
+    else:
+        obj.instructor = instructor
+
+    ref = record.get('ref')
+    if ref is not None:
+        if ref in seen[level.type]:
+            raise CourseImportError(f"duplicate {level.type} ref {ref!r}")
+        seen[level.type].add(ref)
+
+    try:
+        obj.full_clean(exclude=exclude, validate_unique=False, validate_constraints=False)
+    except ValidationError as exc:
+        raise CourseImportError(f"{level.type} {ref!r}: {exc.message_dict}") from None
+    if level.model is Lesson:
+        # bulk_create skips Lesson.save, which renders the stored HTML
+        rendering.render_lesson(obj)
+    return ref, obj
+
+
+def import_course_records(records, instructor, progress=None):
+    """
+    Create the course trees described by ``records`` for ``instructor`` in
+    one transaction, with one bulk insert per level and batch. Calls
+    ``progress(type, count)`` after each batch. Returns the new course ids.
+    """
+    ids = {level.type: {} for level in LEVELS}
+    seen = {level.type: set() for level in LEVELS}
+    counts = dict.fromkeys(LEVEL_INDEX, 0)
+    pending = []
+    current = None
+
+    def flush():
+        level = LEVELS[LEVEL_INDEX[current]]
+        objs = [obj for _, obj in pending]
+        referenced = any(ref is not None for ref, _ in pending)
+        if referenced and not connection.features.can_return_rows_from_bulk_insert:
+            for obj in objs:
+                obj.save(force_insert=True)
+        else:
+            level.model.objects.bulk_create(objs)
+        for (ref, _), obj in zip(pending, objs):
+            if ref is not None:
+                ids[current][ref] = obj.pk
+        counts[current] += len(objs)
+        pending.clear()
+        if progress:
+            progress(current, counts[current])
+
+    try:
+        with transaction.atomic():
+            for number, record in enumerate(records, 1):
+                kind = record.get('type')
+                if kind not in LEVEL_INDEX:
+                    raise CourseImportError(f"record {number}: unknown type {kind!r}")
+                if kind != current:
+                    if current is not None and LEVEL_INDEX[kind] < LEVEL_INDEX[current]:
+                        raise CourseImportError(
+                            f"record {number}: {kind} records must come before {current} records"
+                        )
+                    if pending:
+                        flush()
+                    current = kind
+                try:
+                    pending.append(_build(LEVELS[LEVEL_INDEX[kind]], record, ids, seen, instructor))
+                except CourseImportError as exc:
+                    raise CourseImportError(f"record {number}: {exc}") from None
+                if len(pending) >= BATCH_SIZE:
+                    flush()
+            if pending:
+                flush()
+
+            course_ids = list(ids['course'].values())
+            # bulk_create sends no signals: refresh what they would have
+            transaction.on_commit(lambda: _refresh(course_ids))
+    except IntegrityError as exc:
+        raise CourseImportError(str(exc)) from None
+    return course_ids
+
+
+def _refresh(course_ids):
+    invalidate_outlines(course_ids)
+    backend = search.get_backend()
+    for course_id in course_ids:
+        backend.index_course(course_id)
+
+
+def clone_course(course, instructor=None, title=None):
+    """
+    Copy ``course`` with all its modules, lessons, quizzes, questions and
+    choices in one transaction. Enrollments, progress and submissions stay
+    behind. Returns the id of the copy.
+    """
+    title = title or f"Copy of {course.title}"
+    title = title[:Course._meta.get_field('title').max_length]
+
+    def records():
+        for record in iter_course_records([course.pk]):
+            if record['type'] == 'course':
+                record['title'] = title
+            yield record
+
+    return import_course_records(records(), instructor or course.instructor)[0]
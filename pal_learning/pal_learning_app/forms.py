@@ -1,5 +1,5 @@
 from django import forms
-from .models import Course,Module,Lesson,Quiz,Question, Choice
+from .models import Course,Module,Lesson,Quiz,Question, Choice, DiscussionThread, Comment
 from django.forms import inlineformset_factory
 class CourseForm(forms.ModelForm):
     class Meta:
@@ -24,6 +24,17 @@ class QuestionForm(forms.ModelForm):
         model = Question
         fields = ['text', 'question_type']
 
+class ThreadForm(forms.ModelForm):
+    class Meta:
+        model = DiscussionThread
+        fields = ['title']
+
+class CommentForm(forms.ModelForm):
+    class Meta:
+        model = Comment
+        fields = ['body']
+        widgets = {'body': forms.Textarea(attrs={'rows': 3})}
+
 ChoiceFormSet = inlineformset_factory(
     Question,
     Choice,
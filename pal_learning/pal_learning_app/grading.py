@@ -0,0 +1,300 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+
+from . import counters
+from .item_analysis import QuizStatsBuilder
+from .models import Choice, Question, Quiz, QuizSubmission
+from .utils import conflict_target
+
+logger = logging.getLogger(__name__)
+
+ANSWER_KEY_TIMEOUT = 60 * 60 * 24
+REGRADE_BATCH_SIZE = 2000
+
+
+def _cache_key(quiz):
+    # the version moves whenever a question or choice of the quiz changes,
+    # so a key compiled from stale rows is never read again
+    return f'quiz-answer-key:{quiz.pk}:{quiz.key_version}'
+
+
+def compile_answer_key(quiz):
+    """
+    Map question id -> (question type, frozenset of correct choice ids,
+    frozenset of all its choice ids).
+    """
+    choices, correct = {}, {}
+    for question_id, choice_id, is_correct in (
+        Choice.objects.filter(question__quiz=quiz)
+                      .values_list('question_id', 'id', 'is_correct')
+    ):
+        choices.setdefault(question_id, set()).add(choice_id)
+        if is_correct:
+            correct.setdefault(question_id, set()).add(choice_id)
+
+    return {
+        question_id: (
+            question_type,
+            frozenset(correct.get(question_id, ())),
+            frozenset(choices.get(question_id, ())),
+        )
+        for question_id, question_type in quiz.questions.values_list('id', 'question_type')
+    }
+
+
+def get_answer_key(quiz):
+    key = _cache_key(quiz)
+    answer_key = cache.get(key)
+    if answer_key is None:
+        answer_key = compile_answer_key(quiz)
+        cache.set(key, answer_key, ANSWER_KEY_TIMEOUT)
+    return answer_key
+
+
+def selected_choices(answer_key, data):
+    # question id -> set of submitted choice ids; ids that are not choices
+    # of that question are dropped
+    selections = {}
+    for question_id, (_, _, choice_ids) in answer_key.items():
+        values = data.getlist(f'question_{question_id}')
+        selections[question_id] = {int(v) for v in values if v.isdigit()} & choice_ids
+    return selections
+
+
+def correct_questions(answer_key, selections):
+    """Ids of the questions that ``selections`` answers correctly."""
+    correct = set()
+    for question_id, (question_type, correct_ids, _) in answer_key.items():
+        selected_ids = selections.get(question_id, set())
+        if question_type == Question.SINGLE:
+            if len(selected_ids) == 1 and selected_ids <= correct_ids:
+                correct.add(question_id)
+        elif selected_ids == correct_ids:
+            correct.add(question_id)
+    return correct
+
+
+def grade(answer_key, selections):
+    """Return (number of correct answers, score out of 100); no queries."""
+    correct_count = len(correct_questions(answer_key, selections))
+    total = len(answer_key)
+    score = Decimal(correct_count * 100) / total if total else Decimal(0)
+    return correct_count, score.quantize(Decimal('0.01'))
+
+
+def encode_choices(choice_ids):
+    """
+    Pack choice ids as LEB128 varints of the gaps between the sorted ids.
+    Choices of one quiz are close together, so most ids take a single byte.
+    Also used for sets of question ids.
+    """
+    out = bytearray()
+    previous = 0
+    for choice_id in sorted(choice_ids):
+        gap = choice_id - previous
+        previous = choice_id
+        while gap >= 0x80:
+            out.append((gap & 0x7F) | 0x80)
+            gap >>= 7
+        out.append(gap)
+    return bytes(out)
+
+
+def decode_choices(data):
+    choice_ids = set()
+    value = shift = previous = 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        previous += value
+        choice_ids.add(previous)
+        value = shift = 0
+    return choice_ids
+
+
+def previous_attempt(student, quiz, answer_key):
+    """
+    The stored attempt of ``student`` as (correct question ids, selected
+    choice ids, score), locked for update, or None if there is none. The
+    first two are None for attempts that predate stored answers.
+    """
+    row = (
+        QuizSubmission.objects.select_for_update()
+                              .filter(student=student, quiz=quiz)
+                              .values_list('answers', 'correct', 'score')
+                              .first()
+    )
+    if row is None:
+        return None
+    answers, correct, score = row
+    if answers is None:
+        return None, None, score
+    choice_ids = decode_choices(answers)
+    if correct is not None:
+        # exactly what the item statistics counted, whatever the key was then
+        return decode_choices(correct), choice_ids, score
+    selections = group_by_question(choice_ids, question_index(answer_key))
+    return correct_questions(answer_key, selections), choice_ids, score
+
+
+def save_submission(student, quiz, score, selections, correct):
+    # one INSERT ... ON CONFLICT instead of update_or_create's select + write
+    choice_ids = set().union(*selections.values())
+    QuizSubmission.objects.bulk_create(
+        [QuizSubmission(student=student, quiz=quiz, score=score,
+                        answers=encode_choices(choice_ids), correct=encode_choices(correct))],
+        update_conflicts=True,
+        unique_fields=conflict_target('student', 'quiz'),
+        update_fields=['score', 'answers', 'correct'],
+    )
+
+
+def question_index(answer_key):
+    # choice id -> question id
+    return {
+        choice_id: question_id
+        for question_id, (_, _, choice_ids) in answer_key.items()
+        for choice_id in choice_ids
+    }
+
+
+def group_by_question(choice_ids, question_of):
+    selections = {}
+    for choice_id in choice_ids:
+        question_id = question_of.get(choice_id)
+        if question_id is not None:
+            selections.setdefault(question_id, set()).add(choice_id)
+    return selections
+
+
+def _rescore(quiz, answer_key):
+    # chunk by chunk, each under a row lock and with the answers re-read
+    # inside it: a retake stored meanwhile is scored on its own answers
+    # and never overwritten with the score of the ones it replaced
+    question_of = question_index(answer_key)
+    course_id = quiz.lesson.module.course_id
+    changed_count, last_id = 0, 0
+    regraded_students = set()
+    while True:
+        with transaction.atomic():
+            batch = list(
+                QuizSubmission.objects.select_for_update()
+                                      .filter(quiz=quiz, answers__isnull=False, id__gt=last_id)
+                                      .order_by('id')
+                                      .only('id', 'student_id', 'score', 'answers')
+                                      [:REGRADE_BATCH_SIZE]
+            )
+            if not batch:
+                break
+            last_id = batch[-1].id
+            changed = []
+            for submission in batch:
+                selections = group_by_question(decode_choices(submission.answers), question_of)
+                _, score = grade(answer_key, selections)
+                if submission.score != score:
+                    submission.score = score
+                    changed.append(submission)
+            QuizSubmission.objects.bulk_update(changed, ['score'])
+        regraded_students.update(submission.student_id for submission in changed)
+        changed_count += len(changed)
+        if len(batch) < REGRADE_BATCH_SIZE:
+            break
+    # once for the whole quiz: the course rollup is a full recount
+    if regraded_students:
+        with transaction.atomic():
+            counters.quiz_regraded(course_id, regraded_students)
+    return changed_count
+
+
+def _rebuild_stats(quiz):
+    with transaction.atomic():
+        answer_key = compile_answer_key(quiz)
+        question_of = question_index(answer_key)
+        stats = QuizStatsBuilder(answer_key)
+        # quiz submissions take these locks before their own rows, so while
+        # they are held no attempt of the quiz changes; attempts stored
+        # after them add to the new sums
+        stats.lock()
+        last_id = 0
+        while True:
+            batch = list(
+                QuizSubmission.objects.filter(quiz=quiz, answers__isnull=False, id__gt=last_id)
+                                      .order_by('id')
+                                      .values_list('id', 'answers', 'correct', 'score')
+                                      [:REGRADE_BATCH_SIZE]
+            )
+            if not batch:
+                break
+            last_id = batch[-1][0]
+            recounted = []
+            for submission_id, answers, stored, score in batch:
+                choice_ids = decode_choices(answers)
+                correct = correct_questions(answer_key, group_by_question(choice_ids, question_of))
+                stats.add(correct, choice_ids, score)
+                # what a retake will take back out of the new sums
+                encoded = encode_choices(correct)
+                if stored is None or bytes(stored) != encoded:
+                    recounted.append(QuizSubmission(pk=submission_id, correct=encoded))
+            QuizSubmission.objects.bulk_update(recounted, ['correct'])
+            if len(batch) < REGRADE_BATCH_SIZE:
+                break
+        stats.save()
+
+
+def regrade_quiz(quiz):
+    """
+    Rescore every stored attempt of ``quiz`` against its current answer key
+    and rebuild its item statistics. Returns the number of changed scores.
+    """
+    changed = _rescore(quiz, compile_answer_key(quiz))
+    _rebuild_stats(quiz)
+    return changed
+
+
+def rebuild_item_stats(quiz):
+    """Recompute the item statistics of ``quiz`` from its stored attempts."""
+    _rebuild_stats(quiz)
+
+
+# background regrades run one at a time; repeated requests for a quiz that
+# is still waiting collapse into a single run
+_regrade_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='regrade')
+_regrade_pending = set()
+_regrade_lock = threading.Lock()
+
+
+def _run_regrade(quiz_id):
+    with _regrade_lock:
+        _regrade_pending.discard(quiz_id)
+    try:
+        quiz = Quiz.objects.filter(pk=quiz_id).first()
+        if quiz is not None:
+            changed = regrade_quiz(quiz)
+            logger.info("Regraded quiz %s: %s score(s) changed", quiz_id, changed)
+    except Exception:
+        logger.exception("Regrading quiz %s failed", quiz_id)
+    finally:
+        connection.close()
+
+
+def schedule_regrade(quiz_id):
+    """Regrade ``quiz_id`` once the current transaction commits."""
+    def submit():
+        if not getattr(settings, 'REGRADE_IN_BACKGROUND', True):
+            _run_regrade(quiz_id)
+            return
+        with _regrade_lock:
+            if quiz_id in _regrade_pending:
+                return
+            _regrade_pending.add(quiz_id)
+        _regrade_executor.submit(_run_regrade, quiz_id)
+
+    transaction.on_commit(submit)
@@ -0,0 +1,116 @@
+"""
+Password hashing on a small, bounded pool of threads.
+
+PBKDF2 takes tens of milliseconds per call by design. Run on the request
+thread, a burst of sign-ins holds every worker (under ASGI, the one thread
+the ORM runs on) until the burst is over. Here at most
+PASSWORD_HASH_WORKERS hashes run at once, at most PASSWORD_HASH_QUEUE more
+wait, and nobody waits longer than PASSWORD_HASH_TIMEOUT seconds: callers
+beyond that get PoolBusy and can ask the user to retry.
+"""
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, get_hasher, identify_hasher, make_password
+
+
+class PoolBusy(Exception):
+    """The hashing pool could not take or finish the job in time."""
+
+
+class HashingPool:
+    def __init__(self, workers, queue, timeout):
+        self.workers = workers
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix='hashing')
+        self._slots = threading.BoundedSemaphore(workers + queue)
+        self._lock = threading.Lock()
+        self._stats = {
+            'waiting': 0, 'running': 0, 'completed': 0, 'rejected': 0, 'timed_out': 0,
+            'wait_seconds': 0.0, 'hash_seconds': 0.0, 'max_hash_seconds': 0.0,
+        }
+
+    def _count(self, **deltas):
+        with self._lock:
+            for name, delta in deltas.items():
+                self._stats[name] += delta
+
+    def _job(self, fn, args, enqueued):
+        started = time.monotonic()
+        self._count(waiting=-1, running=1, wait_seconds=started - enqueued)
+        try:
+            return fn(*args)
+        finally:
+            elapsed = time.monotonic() - started
+            with self._lock:
+                self._stats['running'] -= 1
+                self._stats['completed'] += 1
+                self._stats['hash_seconds'] += elapsed
+                self._stats['max_hash_seconds'] = max(self._stats['max_hash_seconds'], elapsed)
+
+    def _submit(self, fn, args):
+        if not self._slots.acquire(blocking=False):
+            self._count(rejected=1)
+            raise PoolBusy("Too many password checks are already waiting.")
+        self._count(waiting=1)
+        future = self._executor.submit(self._job, fn, args, time.monotonic())
+        # the slot is held until the job is done or cancelled, even if the
+        # caller gave up on it earlier
+        future.add_done_callback(lambda f: self._slots.release())
+        return future
+
+    def _give_up(self, future):
+        if future.cancel():
+            self._count(waiting=-1)
+        self._count(timed_out=1)
+        raise PoolBusy("Password check timed out.")
+
+    async def arun(self, fn, *args):
+        future = self._submit(fn, args)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except asyncio.TimeoutError:
+            self._give_up(future)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['workers'] = self.workers
+        return stats
+
+
+@lru_cache(maxsize=None)
+def get_pool():
+    return HashingPool(
+        getattr(settings, 'PASSWORD_HASH_WORKERS', 2),
+        getattr(settings, 'PASSWORD_HASH_QUEUE', 32),
+        getattr(settings, 'PASSWORD_HASH_TIMEOUT', 5),
+    )
+
+
+async def amake_password(password):
+    return await get_pool().arun(make_password, password)
+
+
+async def acheck_password(password, encoded):
+    """
+    Whether ``password`` matches ``encoded``. A missing hash still costs one
+    hash, so unknown accounts take as long as wrong passwords.
+    """
+    if not encoded:
+        await get_pool().arun(make_password, password)
+        return False
+    return await get_pool().arun(check_password, password, encoded)
+
+
+def must_update(encoded):
+    # as check_password(): rehash with the preferred hasher, or its settings
+    try:
+        hasher = identify_hasher(encoded)
+    except ValueError:
+        return False
+    return hasher.algorithm != get_hasher().algorithm or hasher.must_update(encoded)
@@ -0,0 +1,145 @@
+from collections import Counter
+
+from django.db.models import Case, F, FloatField, IntegerField, Value, When
+from django.db.models.functions import Greatest
+
+from .models import ChoiceStats, QuestionStats
+
+BATCH_SIZE = 500
+
+
+class QuizStatsBuilder:
+    """Collects item statistics over a full scan of a quiz's attempts."""
+
+    def __init__(self, answer_key):
+        self.question_ids = list(answer_key)
+        self.choice_ids = [
+            choice_id for _, _, choice_ids in answer_key.values() for choice_id in choice_ids
+        ]
+        self.attempts = 0
+        self.score_sum = 0.0
+        self.score_sq_sum = 0.0
+        self.correct = Counter()
+        self.correct_score_sum = Counter()
+        self.picks = Counter()
+
+    def add(self, correct, choice_ids, score):
+        score = float(score)
+        self.attempts += 1
+        self.score_sum += score
+        self.score_sq_sum += score * score
+        for question_id in correct:
+            self.correct[question_id] += 1
+            self.correct_score_sum[question_id] += score
+        self.picks.update(choice_ids)
+
+    def lock(self):
+        # make sure every row exists, then hold them until the transaction ends
+        lock_question_stats(self.question_ids)
+        ChoiceStats.objects.bulk_create(
+            [ChoiceStats(choice_id=choice_id) for choice_id in self.choice_ids],
+            ignore_conflicts=True,
+        )
+        list(ChoiceStats.objects.select_for_update()
+                                .filter(choice_id__in=self.choice_ids).values_list('pk'))
+
+    def save(self):
+        # overwrites the rows taken by lock() in place: deleting them would
+        # drop the updates of attempts waiting on the locks
+        QuestionStats.objects.bulk_update(
+            [
+                QuestionStats(
+                    question_id=question_id,
+                    attempts=self.attempts,
+                    correct=self.correct[question_id],
+                    score_sum=self.score_sum,
+                    score_sq_sum=self.score_sq_sum,
+                    correct_score_sum=self.correct_score_sum[question_id],
+                )
+                for question_id in self.question_ids
+            ],
+            ['attempts', 'correct', 'score_sum', 'score_sq_sum', 'correct_score_sum'],
+            batch_size=BATCH_SIZE,
+        )
+        ChoiceStats.objects.bulk_update(
+            [ChoiceStats(choice_id=choice_id, picks=self.picks[choice_id]) for choice_id in self.choice_ids],
+            ['picks'],
+            batch_size=BATCH_SIZE,
+        )
+
+
+def lock_question_stats(question_ids):
+    """
+    Create and lock the QuestionStats rows of ``question_ids``. Storing an
+    attempt takes this lock before the attempt's own row, and so does a
+    statistics rebuild, so the two never interleave.
+    """
+    QuestionStats.objects.bulk_create(
+        [QuestionStats(question_id=question_id) for question_id in question_ids],
+        ignore_conflicts=True,
+    )
+    list(QuestionStats.objects.select_for_update()
+                              .filter(question_id__in=question_ids).values_list('pk'))
+
+
+def record_attempt(answer_key, attempt, previous=None):
+    """
+    Fold one graded attempt into the running sums. ``attempt`` and
+    ``previous`` (the attempt it replaces, if any) are ``(correct question
+    ids, selected choice ids, score)``. Must run inside the transaction that
+    stores the attempt, after lock_question_stats; costs a fixed number of
+    queries.
+    """
+    question_ids = list(answer_key)
+    correct, choice_ids, score = attempt
+    score = float(score)
+    # an attempt stored without its answers was never counted here
+    if previous is None or previous[1] is None:
+        new_attempts, old_correct, old_choice_ids, old_score = 1, set(), set(), 0.0
+    else:
+        new_attempts = 0
+        old_correct, old_choice_ids, old_score = previous
+        old_score = float(old_score)
+
+    # questions fall in at most four groups by (correct now, correct before)
+    groups = {}
+    for question_id in question_ids:
+        groups.setdefault((question_id in correct, question_id in old_correct), []).append(question_id)
+    correct_delta, correct_score_delta = [], []
+    for (now, before), ids in groups.items():
+        if now != before:
+            correct_delta.append(When(question_id__in=ids, then=Value(int(now) - int(before))))
+        if score * now != old_score * before:
+            correct_score_delta.append(
+                When(question_id__in=ids, then=Value(score * now - old_score * before))
+            )
+
+    QuestionStats.objects.filter(question_id__in=question_ids).update(
+        attempts=F('attempts') + new_attempts,
+        # older attempts without a stored ``correct`` are recounted against
+        # the current key, which may take back what was never added
+        correct=Greatest(
+            F('correct') + Case(*correct_delta, default=Value(0), output_field=IntegerField()),
+            Value(0),
+        ),
+        score_sum=F('score_sum') + (score - old_score),
+        score_sq_sum=F('score_sq_sum') + (score * score - old_score * old_score),
+        correct_score_sum=F('correct_score_sum') + Case(
+            *correct_score_delta, default=Value(0.0), output_field=FloatField()
+        ),
+    )
+
+    added, removed = choice_ids - old_choice_ids, old_choice_ids - choice_ids
+    if added or removed:
+        ChoiceStats.objects.bulk_create(
+            [ChoiceStats(choice_id=choice_id) for choice_id in added],
+            ignore_conflicts=True,
+        )
+        ChoiceStats.objects.filter(choice_id__in=added | removed).update(
+            picks=F('picks') + Case(
+                When(choice_id__in=added, then=Value(1)),
+                When(choice_id__in=removed, then=Value(-1)),
+                default=Value(0),
+                output_field=IntegerField(),
+            )
+        )
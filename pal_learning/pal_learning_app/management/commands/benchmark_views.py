@@ -0,0 +1,64 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from pal_learning_app.benchmarks import run_asgi, run_wsgi
+from pal_learning_app.models import CustomUser, Quiz
+
+
+class Command(BaseCommand):
+    help = ("Compare requests/sec and latency of the student read views "
+            "under the WSGI handler (sync views) and the ASGI handler (their async "
+            "twins) at a given concurrency.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--email', help="User to browse as (default: the first student).")
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--requests', type=int, default=2000,
+                            help="Requests per handler.")
+        parser.add_argument('--json', action='store_true', help="Print the results as JSON.")
+
+    def handle(self, *args, **options):
+        users = CustomUser.objects.filter(is_active=True)
+        if options['email']:
+            user = users.filter(email=options['email']).first()
+        else:
+            user = users.filter(role=CustomUser.STUDENT).order_by('id').first()
+        if user is None:
+            raise CommandError("No user to browse as; pass --email or create a student.")
+
+        paths = self.paths()
+        results = {}
+        for name, run in (('wsgi', run_wsgi), ('asgi', run_asgi)):
+            results[name] = run(paths, user, options['concurrency'], options['requests'])
+
+        if options['json']:
+            self.stdout.write(json.dumps({
+                'paths': paths,
+                'concurrency': options['concurrency'],
+                'results': results,
+            }, indent=2))
+            return
+
+        self.stdout.write(f"{len(paths)} paths, concurrency {options['concurrency']}")
+        self.stdout.write(f"{'handler':8} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7}")
+        for name, result in results.items():
+            self.stdout.write(
+                f"{name:8} {result['rps']:>9} {result['p50_ms']:>9} "
+                f"{result['p99_ms']:>9} {result['errors']:>7}"
+            )
+
+    def paths(self):
+        # the catalog plus the first course that has a quiz, top to bottom
+        quiz = Quiz.objects.select_related('lesson__module__course').order_by('id').first()
+        if quiz is None:
+            raise CommandError("Benchmarking needs at least one course with a quiz.")
+        lesson = quiz.lesson
+        return [
+            reverse('course_list'),
+            reverse('course_detail', args=[lesson.module.course_id]),
+            reverse('module_detail', args=[lesson.module_id]),
+            reverse('lesson_detail', args=[lesson.id]),
+            reverse('quiz_detail', args=[quiz.id]),
+        ]
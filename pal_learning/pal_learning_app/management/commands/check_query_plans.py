@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from pal_learning_app.query_plans import HOT_QUERIES, explain, full_scans
+
+
+class Command(BaseCommand):
+    help = ("EXPLAIN the app's hot queries and fail if any of them reads a whole table. "
+            "PostgreSQL and MySQL plan from table statistics, so run it against a "
+            "database of realistic size; SQLite plans the same way whatever the data.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*',
+                            help="Queries to check (default: all of them).")
+
+    def handle(self, *args, **options):
+        names = options['names'] or list(HOT_QUERIES)
+        unknown = sorted(set(names) - set(HOT_QUERIES))
+        if unknown:
+            raise CommandError(f"Unknown query name(s): {', '.join(unknown)}. "
+                               f"Known: {', '.join(HOT_QUERIES)}")
+
+        failed = []
+        for name in names:
+            plan = explain(HOT_QUERIES[name]())
+            scanned = full_scans(plan)
+            if scanned:
+                failed.append(name)
+                self.stdout.write(self.style.ERROR(f"{name}: full scan of {', '.join(scanned)}"))
+            else:
+                self.stdout.write(f"{name}: ok")
+            if scanned or options['verbosity'] > 1:
+                self.stdout.write('\n'.join(f"    {line}" for line in plan.splitlines()))
+
+        if failed:
+            raise CommandError(f"{len(failed)} of {len(names)} hot queries fall back to a full scan.")
+        self.stdout.write(self.style.SUCCESS(f"All {len(names)} hot queries use an index."))
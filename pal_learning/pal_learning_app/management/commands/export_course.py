@@ -0,0 +1,34 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from pal_learning_app import course_io
+from pal_learning_app.models import Course
+
+
+class Command(BaseCommand):
+    help = "Export course trees (modules, lessons, quizzes, questions, choices) as JSONL or JSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument('course_ids', nargs='+', type=int, help="Courses to export.")
+        parser.add_argument('-o', '--output', default='-',
+                            help="File to write (default: standard output).")
+        parser.add_argument('--format', choices=['jsonl', 'json'], default='jsonl')
+
+    def handle(self, *args, **options):
+        course_ids = sorted(set(options['course_ids']))
+        missing = set(course_ids) - set(
+            Course.objects.filter(pk__in=course_ids).values_list('id', flat=True)
+        )
+        if missing:
+            raise CommandError(f"Unknown course id(s): {', '.join(map(str, sorted(missing)))}")
+
+        records = course_io.iter_course_records(course_ids)
+        if options['output'] == '-':
+            course_io.write_records(records, sys.stdout, options['format'])
+            return
+        with open(options['output'], 'w', encoding='utf-8') as fp:
+            course_io.write_records(records, fp, options['format'])
+        self.stderr.write(self.style.SUCCESS(
+            f"Exported {len(course_ids)} course(s) to {options['output']}."
+        ))
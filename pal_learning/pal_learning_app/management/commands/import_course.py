@@ -0,0 +1,42 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from pal_learning_app import course_io
+from pal_learning_app.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = "Import course trees written by export_course, in one transaction."
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help="JSONL or JSON file to read, or - for standard input.")
+        parser.add_argument('--instructor', required=True,
+                            help="Email of the instructor who will own the imported courses.")
+
+    def handle(self, *args, **options):
+        instructor = CustomUser.objects.filter(
+            email=options['instructor'], role=CustomUser.INSTRUCTOR
+        ).first()
+        if instructor is None:
+            raise CommandError(f"No instructor with email {options['instructor']}.")
+
+        def progress(kind, count):
+            self.stdout.write(f"  {kind}: {count}")
+
+        try:
+            if options['input'] == '-':
+                course_ids = course_io.import_course_records(
+                    course_io.read_records(sys.stdin), instructor, progress
+                )
+            else:
+                with open(options['input'], encoding='utf-8') as fp:
+                    course_ids = course_io.import_course_records(
+                        course_io.read_records(fp), instructor, progress
+                    )
+        except (OSError, course_io.CourseImportError) as exc:
+            raise CommandError(f"Import failed, nothing was saved: {exc}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {len(course_ids)} course(s): {', '.join(map(str, course_ids))}"
+        ))
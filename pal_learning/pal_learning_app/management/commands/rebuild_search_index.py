@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from pal_learning_app import search
+from pal_learning_app.models import Course
+
+
+class Command(BaseCommand):
+    help = "Rebuild the course catalog full-text search index from scratch."
+
+    def handle(self, *args, **options):
+        backend = search.get_backend()
+        backend.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {Course.objects.count()} course(s) with {type(backend).__name__}."
+        ))
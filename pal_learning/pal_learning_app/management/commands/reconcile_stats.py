@@ -0,0 +1,64 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from pal_learning_app import counters
+from pal_learning_app.models import Course, DiscussionThread, Enrollment
+
+
+def _pages(queryset, batch_size):
+    # by primary key rather than OFFSET: each page is an index range scan,
+    # and rows added or deleted meanwhile never shift the later pages
+    last_id = 0
+    while True:
+        page = list(queryset.filter(pk__gt=last_id).order_by('pk')[:batch_size])
+        if not page:
+            return
+        yield page
+        last_id = page[-1].pk
+
+
+class Command(BaseCommand):
+    help = "Recompute course stats rollups, enrollment and discussion counters from the raw tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument('course_ids', nargs='*', type=int,
+                            help="Courses to reconcile (default: all courses).")
+        parser.add_argument('--rebuild-history', action='store_true',
+                            help="Also regenerate the daily enrollment history from "
+                                 "enrollment dates. Dated drops and re-enrollments are lost.")
+
+    def handle(self, *args, **options):
+        course_ids = list(Course.objects.order_by('id').values_list('id', flat=True))
+        if options['course_ids']:
+            missing = set(options['course_ids']) - set(course_ids)
+            if missing:
+                raise CommandError(f"Unknown course id(s): {', '.join(map(str, sorted(missing)))}")
+            course_ids = sorted(options['course_ids'])
+
+        batch_size = counters.RECOUNT_BATCH_SIZE
+        for start in range(0, len(course_ids), batch_size):
+            batch = course_ids[start:start + batch_size]
+            with transaction.atomic():
+                counters.reconcile_course_stats(batch)
+                if options['rebuild_history']:
+                    counters.rebuild_daily_enrollments(batch)
+
+        enrollments = Enrollment.objects.all()
+        if options['course_ids']:
+            enrollments = enrollments.filter(course_id__in=course_ids)
+        recounted = 0
+        for page in _pages(enrollments, batch_size):
+            with transaction.atomic():
+                recounted += counters.recount_enrollments(page)
+
+        threads = DiscussionThread.objects.all()
+        if options['course_ids']:
+            threads = threads.filter(lesson__module__course_id__in=course_ids)
+        recounted_threads = 0
+        for page in _pages(threads, batch_size):
+            recounted_threads += counters.recount_threads(page)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Reconciled {len(course_ids)} course(s), {recounted} enrollment(s) "
+            f"and {recounted_threads} thread(s)."
+        ))
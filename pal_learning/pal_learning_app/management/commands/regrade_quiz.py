@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from pal_learning_app.grading import regrade_quiz
+from pal_learning_app.models import Quiz
+
+
+class Command(BaseCommand):
+    help = "Rescore stored quiz attempts against the current answer key and rebuild item statistics."
+
+    def add_arguments(self, parser):
+        parser.add_argument('quiz_ids', nargs='*', type=int,
+                            help="Quizzes to regrade (default: all quizzes).")
+
+    def handle(self, *args, **options):
+        quizzes = Quiz.objects.order_by('id')
+        if options['quiz_ids']:
+            quizzes = quizzes.filter(pk__in=options['quiz_ids'])
+            missing = set(options['quiz_ids']) - set(quizzes.values_list('id', flat=True))
+            if missing:
+                raise CommandError(f"Unknown quiz id(s): {', '.join(map(str, sorted(missing)))}")
+
+        for quiz in quizzes:
+            changed = regrade_quiz(quiz)
+            self.stdout.write(f"{quiz.title}: {changed} score(s) changed")
+        self.stdout.write(self.style.SUCCESS("Regrade finished."))
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from pal_learning_app import rendering, search
+from pal_learning_app.models import Lesson
+
+BATCH_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = "Render stored lesson HTML, embed URLs and excerpts, then rebuild the search index."
+
+    def add_arguments(self, parser):
+        parser.add_argument('lesson_ids', nargs='*', type=int,
+                            help="Lessons to render (default: all lessons).")
+
+    def handle(self, *args, **options):
+        lessons = Lesson.objects.order_by('id').only(
+            'id', 'content_type', 'content_url', 'body', *rendering.RENDERED_FIELDS
+        )
+        if options['lesson_ids']:
+            lessons = lessons.filter(pk__in=options['lesson_ids'])
+
+        rendered = 0
+        batch = []
+        for lesson in lessons.iterator(chunk_size=BATCH_SIZE):
+            rendering.render_lesson(lesson)
+            batch.append(lesson)
+            if len(batch) == BATCH_SIZE:
+                rendered += self.save(batch)
+                batch = []
+        rendered += self.save(batch)
+
+        # bulk_update skips the signals that keep the index in step
+        backend = search.get_backend()
+        if options['lesson_ids']:
+            course_ids = set(lessons.values_list('module__course_id', flat=True))
+            for course_id in course_ids:
+                backend.index_course(course_id)
+        else:
+            backend.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Rendered {rendered} lesson(s)."))
+
+    def save(self, batch):
+        with transaction.atomic():
+            Lesson.objects.bulk_update(batch, rendering.RENDERED_FIELDS)
+        return len(batch)
@@ -0,0 +1,138 @@
+import json
+import random
+import subprocess
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+from django.utils import timezone
+
+from pal_learning_app.benchmarks import run_wsgi
+from pal_learning_app.models import (
+    Choice, Course, CustomUser, Enrollment, Lesson, Quiz, QuizSubmission,
+)
+
+
+class Command(BaseCommand):
+    help = ("Run the standard request scenarios against the current database and "
+            "report throughput, latency percentiles and query counts as JSON.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--email', help="Student to browse as (default: the student "
+                                            "with the most enrollments among the first 100).")
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--requests', type=int, default=200, help="Requests per scenario.")
+        parser.add_argument('--sample', type=int, default=20,
+                            help="Distinct courses, lessons and quizzes to cycle through.")
+        parser.add_argument('--scenario', action='append',
+                            help="Run only these scenarios (repeatable).")
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('-o', '--output', help="Also write the JSON report to this file.")
+        parser.add_argument('--compare', help="Earlier JSON report to print a comparison against.")
+
+    def handle(self, *args, **options):
+        student = self.student(options['email'])
+        rng = random.Random(options['seed'])
+        scenarios = self.scenarios(student, rng, options['sample'])
+        if options['scenario']:
+            unknown = set(options['scenario']) - set(scenarios)
+            if unknown:
+                raise CommandError(f"Unknown scenario(s): {', '.join(sorted(unknown))}. "
+                                   f"Choose from {', '.join(scenarios)}.")
+            scenarios = {name: scenarios[name] for name in options['scenario']}
+
+        results = {}
+        for name, requests in scenarios.items():
+            self.stderr.write(f"{name}...")
+            results[name] = run_wsgi(requests, student, options['concurrency'], options['requests'])
+
+        report = {
+            'commit': self.commit(),
+            'created_at': timezone.now().isoformat(),
+            'user': student.email,
+            'concurrency': options['concurrency'],
+            'requests': options['requests'],
+            'dataset': {
+                model._meta.model_name: model.objects.count()
+                for model in (CustomUser, Course, Lesson, Quiz, Enrollment, QuizSubmission)
+            },
+            'scenarios': results,
+        }
+        text = json.dumps(report, indent=2)
+        if options['output']:
+            Path(options['output']).write_text(text + '\n')
+        self.stdout.write(text)
+        if options['compare']:
+            self.compare(json.loads(Path(options['compare']).read_text()), report)
+
+    def student(self, email):
+        students = CustomUser.objects.filter(role=CustomUser.STUDENT, is_active=True)
+        if email:
+            student = students.filter(email=email).first()
+        else:
+            # a student with enrollments makes home and course pages realistic
+            student = max(students.order_by('id')[:100],
+                          key=lambda s: s.enrollments.count(), default=None)
+        if student is None:
+            raise CommandError("No student to browse as; pass --email or run seed_data.")
+        return student
+
+    def scenarios(self, student, rng, sample):
+        enrolled = list(Enrollment.objects.filter(student=student).values_list('course_id', flat=True))
+        course_ids = enrolled or list(Course.objects.values_list('id', flat=True)[:1000])
+        courses = rng.sample(course_ids, min(sample, len(course_ids)))
+        lessons = list(Lesson.objects.filter(module__course_id__in=courses).values_list('id', flat=True))
+        quizzes = list(
+            Quiz.objects.filter(lesson__module__course_id__in=courses).values_list('id', flat=True)
+        )
+        if not (courses and lessons and quizzes):
+            raise CommandError("Benchmarking needs courses with lessons and quizzes; run seed_data.")
+        lessons = rng.sample(lessons, min(sample, len(lessons)))
+        quizzes = rng.sample(quizzes, min(sample, len(quizzes)))
+        words = [word for title in Course.objects.filter(pk__in=courses).values_list('title', flat=True)
+                 for word in title.split() if len(word) > 3] or ['course']
+
+        # one answer per question, right or wrong at random
+        answers = {}
+        for quiz_id, question_id, choice_id in (
+            Choice.objects.filter(question__quiz_id__in=quizzes)
+                          .values_list('question__quiz_id', 'question_id', 'id')
+        ):
+            answers.setdefault(quiz_id, {}).setdefault(f'question_{question_id}', []).append(choice_id)
+        posts = [
+            ('post', reverse('quiz_detail', args=[quiz_id]),
+             {field: rng.choice(choices) for field, choices in answers.get(quiz_id, {}).items()})
+            for quiz_id in quizzes
+        ]
+
+        return {
+            'home': [reverse('home')],
+            'course_list': [reverse('course_list')],
+            'course_list_search': [f"{reverse('course_list')}?q={rng.choice(words)}" for _ in range(sample)],
+            'course_detail': [reverse('course_detail', args=[course_id]) for course_id in courses],
+            'lesson_detail': [reverse('lesson_detail', args=[lesson_id]) for lesson_id in lessons],
+            'quiz_detail_get': [reverse('quiz_detail', args=[quiz_id]) for quiz_id in quizzes],
+            'quiz_detail_post': posts,
+        }
+
+    def commit(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def compare(self, before, after):
+        self.stderr.write(f"\n{'scenario':20} {'req/s':>16} {'p95 ms':>18} {'queries':>14}")
+        for name, result in after['scenarios'].items():
+            old = before.get('scenarios', {}).get(name)
+            if old is None:
+                continue
+            self.stderr.write(
+                f"{name:20} {old['rps']:>7} -> {result['rps']:<7} "
+                f"{old['p95_ms']:>8} -> {result['p95_ms']:<8} "
+                f"{old.get('mean_queries', '-'):>5} -> {result.get('mean_queries', '-'):<5}"
+            )
@@ -0,0 +1,189 @@
+import random
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from pal_learning_app import counters, course_io, ordering
+from pal_learning_app.models import (
+    Course, CustomUser, Enrollment, Lesson, Question, Quiz, QuizSubmission,
+)
+
+BATCH_SIZE = 5000
+TOPICS = ['Programming', 'Mathematics', 'Photography', 'Design', 'Languages',
+          'Data Science', 'Music', 'Business', 'Writing', 'Physics']
+WORDS = ('learn build practice review basics advanced project theory method example '
+         'guide concept skill tool pattern system model data design test').split()
+
+
+class Command(BaseCommand):
+    help = ("Fill the database with synthetic users, courses, enrollments and quiz "
+            "submissions for load testing, e.g. --students 100000 --courses 5000 "
+            "--enrollments 1000000.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--students', type=int, default=1000)
+        parser.add_argument('--instructors', type=int, default=50)
+        parser.add_argument('--courses', type=int, default=100)
+        parser.add_argument('--modules', type=int, default=4, help="Modules per course.")
+        parser.add_argument('--lessons', type=int, default=5, help="Lessons per module.")
+        parser.add_argument('--quiz-share', type=float, default=0.5,
+                            help="Share of lessons that get a quiz.")
+        parser.add_argument('--questions', type=int, default=5, help="Questions per quiz.")
+        parser.add_argument('--choices', type=int, default=4, help="Choices per question.")
+        parser.add_argument('--enrollments', type=int, default=5000)
+        parser.add_argument('--submission-share', type=float, default=0.5,
+                            help="Share of a student's course quizzes they have submitted.")
+        parser.add_argument('--prefix', default='seed',
+                            help="Email prefix of the generated accounts.")
+        parser.add_argument('--password', default='seed-password',
+                            help="Password shared by all generated accounts.")
+        parser.add_argument('--seed', type=int, default=1, help="Random seed.")
+
+    def handle(self, *args, **options):
+        if options['students'] and -(-options['enrollments'] // options['students']) > options['courses']:
+            raise CommandError("Students would need more enrollments than there are courses.")
+        self.prefix = options['prefix']
+        if CustomUser.objects.filter(email__startswith=f'{self.prefix}-').exists():
+            raise CommandError(f"Accounts named {self.prefix}-* already exist; pick another --prefix.")
+        self.rng = random.Random(options['seed'])
+        started = time.monotonic()
+
+        instructors = self.create_users(CustomUser.INSTRUCTOR, options['instructors'], options['password'])
+        students = self.create_users(CustomUser.STUDENT, options['students'], options['password'])
+        course_ids = self.create_courses(instructors, options)
+        self.create_enrollments(students, course_ids, options['enrollments'],
+                                options['submission_share'], options['modules'] * options['lessons'])
+
+        # the importer already indexed the courses for search
+        self.stdout.write("Computing course stats...")
+        for start in range(0, len(course_ids), counters.RECOUNT_BATCH_SIZE):
+            batch = course_ids[start:start + counters.RECOUNT_BATCH_SIZE]
+            with transaction.atomic():
+                counters.reconcile_course_stats(batch)
+                counters.rebuild_daily_enrollments(batch)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded in {time.monotonic() - started:.1f}s. Sign in as "
+            f"{self.prefix}-student-0@example.com or {self.prefix}-instructor-0@example.com "
+            f"with password {options['password']!r}."
+        ))
+
+    def words(self, count):
+        return ' '.join(self.rng.choice(WORDS) for _ in range(count))
+
+    def create_users(self, role, count, password):
+        # one hash for everyone: hashing each would dominate the run
+        encoded = make_password(password)
+        for start in range(0, count, BATCH_SIZE):
+            CustomUser.objects.bulk_create([
+                CustomUser(
+                    email=f'{self.prefix}-{role}-{n}@example.com',
+                    username=f'{self.prefix}-{role}-{n}@example.com',
+                    password=encoded,
+                    first_name=f'{role.title()}{n}', last_name='Seed',
+                    role=role, is_approved=True, is_active=True,
+                )
+                for n in range(start, min(start + BATCH_SIZE, count))
+            ])
+        self.stdout.write(f"  {role}s: {count}")
+        return list(
+            CustomUser.objects.filter(email__startswith=f'{self.prefix}-{role}-')
+                              .order_by('id').values_list('id', flat=True)
+        )
+
+    def course_records(self, count, options):
+        # the same records export_course writes, so the importer does the inserts
+        refs = {level.type: 0 for level in course_io.LEVELS}
+        tree = []
+        for _ in range(count):
+            refs['course'] += 1
+            course = {'type': 'course', 'ref': refs['course'], 'title': self.words(3).title(),
+                      'description': self.words(20), 'topic': self.rng.choice(TOPICS),
+                      'difficulty': self.rng.choice([c for c, _ in Course.DIFFICULTY_CHOICES])}
+            tree.append(course)
+        levels = {'course': tree, 'module': [], 'lesson': [], 'quiz': [], 'question': [], 'choice': []}
+        for course in tree:
+            for m in range(options['modules']):
+                refs['module'] += 1
+                levels['module'].append({'type': 'module', 'ref': refs['module'], 'course': course['ref'],
+                                         'title': f"Module {m + 1}: {self.words(2)}",
+                                         'sort_order': (m + 1) * ordering.GAP})
+                for n in range(options['lessons']):
+                    refs['lesson'] += 1
+                    levels['lesson'].append({'type': 'lesson', 'ref': refs['lesson'], 'module': refs['module'],
+                                             'title': self.words(4).capitalize(), 'content_type': Lesson.TEXT,
+                                             'body': '\n\n'.join(self.words(40) for _ in range(3)),
+                                             'sort_order': (n + 1) * ordering.GAP})
+                    if self.rng.random() >= options['quiz_share']:
+                        continue
+                    refs['quiz'] += 1
+                    levels['quiz'].append({'type': 'quiz', 'ref': refs['quiz'], 'lesson': refs['lesson'],
+                                           'title': f"Quiz: {self.words(2)}"})
+                    for _ in range(options['questions']):
+                        refs['question'] += 1
+                        levels['question'].append({'type': 'question', 'ref': refs['question'],
+                                                   'quiz': refs['quiz'], 'text': self.words(8) + '?',
+                                                   'question_type': Question.SINGLE})
+                        correct = self.rng.randrange(options['choices'])
+                        levels['choice'] += [
+                            {'type': 'choice', 'question': refs['question'], 'text': self.words(3),
+                             'is_correct': c == correct}
+                            for c in range(options['choices'])
+                        ]
+        for level in course_io.LEVELS:
+            yield from levels[level.type]
+
+    def create_courses(self, instructors, options):
+        per_instructor = -(-options['courses'] // len(instructors)) if instructors else 0
+        if options['courses'] and not instructors:
+            raise CommandError("Courses need at least one instructor.")
+        course_ids, remaining = [], options['courses']
+        for instructor_id in instructors:
+            if remaining <= 0:
+                break
+            count = min(per_instructor, remaining)
+            remaining -= count
+            instructor = CustomUser(pk=instructor_id, role=CustomUser.INSTRUCTOR)
+            course_ids += course_io.import_course_records(
+                self.course_records(count, options), instructor
+            )
+        self.stdout.write(f"  courses: {len(course_ids)}")
+        return course_ids
+
+    def create_enrollments(self, students, course_ids, total, submission_share, lessons_per_course):
+        if not total:
+            return
+        quizzes = {}
+        for quiz_id, course_id in Quiz.objects.filter(lesson__module__course_id__in=course_ids) \
+                                              .values_list('id', 'lesson__module__course_id'):
+            quizzes.setdefault(course_id, []).append(quiz_id)
+        statuses = [Enrollment.IN_PROGRESS] * 7 + [Enrollment.COMPLETED] * 2 + [Enrollment.DROPPED]
+
+        # spread enrollments evenly over students, courses picked at random
+        per_student, extra = divmod(total, len(students))
+        enrollments, submissions, created = [], [], 0
+        for index, student_id in enumerate(students):
+            count = per_student + (1 if index < extra else 0)
+            for course_id in self.rng.sample(course_ids, count):
+                taken = [
+                    QuizSubmission(student_id=student_id, quiz_id=quiz_id,
+                                   score=self.rng.choice(range(0, 101, 20)))
+                    for quiz_id in quizzes.get(course_id, ())
+                    if self.rng.random() < submission_share
+                ]
+                submissions += taken
+                # counters filled in here rather than recounted afterwards
+                enrollments.append(Enrollment(
+                    student_id=student_id, course_id=course_id, status=self.rng.choice(statuses),
+                    total_lessons=lessons_per_course, quizzes_taken=len(taken),
+                    quiz_score_total=sum(s.score for s in taken),
+                ))
+            if len(enrollments) >= BATCH_SIZE or index == len(students) - 1:
+                with transaction.atomic():
+                    Enrollment.objects.bulk_create(enrollments, batch_size=BATCH_SIZE)
+                    QuizSubmission.objects.bulk_create(submissions, batch_size=BATCH_SIZE)
+                created += len(enrollments)
+                self.stdout.write(f"  enrollments: {created}")
+                enrollments, submissions = [], []
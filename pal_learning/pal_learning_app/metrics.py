@@ -0,0 +1,235 @@
+"""
+Per-view request metrics: latency, SQL query count and time, response size.
+
+Each process keeps its own totals in memory. When METRICS_DIR is set, it
+also writes them to METRICS_DIR/metrics-<pid>.json at most every
+METRICS_FLUSH_INTERVAL seconds, and /metrics reports the files of every
+worker, each series labelled with its worker's pid. A worker that exits
+stops counting, and one that restarts under a reused pid starts again from
+zero: Prometheus sees that as a counter reset rather than as totals that
+silently drop. Files not rewritten for METRICS_STALE_AFTER seconds belong
+to workers that are gone (or idle); they are left out and removed.
+"""
+import atexit
+import contextvars
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+from . import hashing
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+SIZE_BUCKETS = (1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+HISTOGRAMS = {
+    # name: (buckets, help)
+    'pal_http_request_duration_seconds': (DURATION_BUCKETS, "Time from request to response headers."),
+    'pal_db_queries': (QUERY_BUCKETS, "SQL queries run per request."),
+    'pal_http_response_bytes': (SIZE_BUCKETS, "Response body size (streaming responses excluded)."),
+}
+COUNTERS = {
+    'pal_db_query_seconds_total': "Time spent in SQL queries.",
+}
+HASHING_METRICS = {
+    # hashing pool stat: (metric, type, help)
+    'completed': ('pal_password_hashes_total', 'counter', "Password hashes finished."),
+    'rejected': ('pal_password_hash_rejected_total', 'counter', "Hashes refused because the queue was full."),
+    'timed_out': ('pal_password_hash_timeouts_total', 'counter', "Hashes given up on after PASSWORD_HASH_TIMEOUT."),
+    'wait_seconds': ('pal_password_hash_wait_seconds_total', 'counter', "Time hashes spent queued."),
+    'hash_seconds': ('pal_password_hash_seconds_total', 'counter', "Time spent hashing."),
+    'running': ('pal_password_hash_running', 'gauge', "Hashes running now."),
+    'waiting': ('pal_password_hash_waiting', 'gauge', "Hashes queued now."),
+}
+
+# [query count, seconds] for the request being served, if any; async views
+# run their queries in other threads, which inherit this context
+_sql = contextvars.ContextVar('pal_metrics_sql', default=None)
+
+# (view, method, status) -> {'name': [bucket counts..., +Inf], 'name_sum': total, ...}
+_series = {}
+_lock = threading.Lock()
+_last_flush = 0.0
+
+
+def _record_sql(execute, sql, params, many, context):
+    totals = _sql.get()
+    if totals is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        totals[0] += 1
+        totals[1] += time.perf_counter() - started
+
+
+@receiver(connection_created)
+def _watch_connection(sender, connection, **kwargs):
+    # installed once per connection rather than around each request, so
+    # queries run from sync_to_async threads are seen too
+    if _record_sql not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_sql)
+
+
+def start_request():
+    return _sql.set([0, 0.0])
+
+
+def finish_request(token):
+    totals = _sql.get()
+    _sql.reset(token)
+    return totals
+
+
+def _empty():
+    series = {}
+    for name, (buckets, _) in HISTOGRAMS.items():
+        series[name] = [0] * (len(buckets) + 1)
+        series[name + '_sum'] = 0
+    for name in COUNTERS:
+        series[name] = 0
+    return series
+
+
+def _observe(series, name, value):
+    buckets = HISTOGRAMS[name][0]
+    series[name][bisect_left(buckets, value)] += 1
+    series[name + '_sum'] += value
+
+
+def observe(view, method, status, duration, queries, sql_seconds, size=None):
+    key = (view, method, f'{status // 100}xx')
+    with _lock:
+        series = _series.get(key)
+        if series is None:
+            series = _series[key] = _empty()
+        _observe(series, 'pal_http_request_duration_seconds', duration)
+        _observe(series, 'pal_db_queries', queries)
+        series['pal_db_query_seconds_total'] += sql_seconds
+        if size is not None:
+            _observe(series, 'pal_http_response_bytes', size)
+    _maybe_flush()
+
+
+def snapshot():
+    with _lock:
+        series = [[list(key), {name: (list(v) if isinstance(v, list) else v) for name, v in s.items()}]
+                  for key, s in _series.items()]
+    return {'series': series, 'hashing': hashing.get_pool().stats()}
+
+
+def _metrics_dir():
+    return getattr(settings, 'METRICS_DIR', None)
+
+
+def flush():
+    directory = _metrics_dir()
+    if not directory:
+        return
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.metrics-', suffix='.tmp')
+    with os.fdopen(fd, 'w') as fp:
+        json.dump(snapshot(), fp)
+    os.replace(tmp, os.path.join(directory, f'metrics-{os.getpid()}.json'))
+
+
+def _maybe_flush():
+    global _last_flush
+    if not _metrics_dir():
+        return
+    now = time.monotonic()
+    if now - _last_flush < getattr(settings, 'METRICS_FLUSH_INTERVAL', 10):
+        return
+    _last_flush = now
+    flush()
+
+
+atexit.register(flush)
+
+
+WORKER_FILE = re.compile(r'metrics-(\d+)\.json')
+
+
+def _stale_after():
+    return getattr(settings, 'METRICS_STALE_AFTER', 6 * getattr(settings, 'METRICS_FLUSH_INTERVAL', 10))
+
+
+def _other_workers():
+    # (pid, snapshot) of every other worker that flushed recently
+    directory = _metrics_dir()
+    if not directory or not os.path.isdir(directory):
+        return
+    cutoff = time.time() - _stale_after()
+    for filename in os.listdir(directory):
+        match = WORKER_FILE.fullmatch(filename)
+        if not match or int(match[1]) == os.getpid():
+            continue
+        path = os.path.join(directory, filename)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                continue
+            with open(path) as fp:
+                yield match[1], json.load(fp)
+        except (OSError, ValueError):
+            continue  # being replaced or removed right now
+
+
+def collect():
+    """
+    Every live worker's totals: ({(pid, view, method, status): series},
+    {pid: hashing stats}).
+    """
+    snapshots = list(_other_workers())
+    snapshots.append((str(os.getpid()), snapshot()))  # this process, up to date
+
+    series, pool = {}, {}
+    for pid, snap in snapshots:
+        for key, values in snap['series']:
+            series[(pid, *key)] = values
+        pool[pid] = {name: snap['hashing'].get(name, 0) for name in HASHING_METRICS}
+    return series, pool
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(key, **extra):
+    pairs = dict(zip(('worker', 'view', 'method', 'status'), key), **extra)
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs.items()) + '}'
+
+
+def render():
+    """Everything collected, in the Prometheus text exposition format."""
+    series, pool = collect()
+    keys = sorted(series)
+    lines = []
+    for name, (buckets, help_text) in HISTOGRAMS.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+        for key in keys:
+            counts = series[key][name]
+            running = 0
+            for bound, count in zip(list(buckets) + ['+Inf'], counts):
+                running += count
+                lines.append(f'{name}_bucket{_labels(key, le=bound)} {running}')
+            lines.append(f'{name}_sum{_labels(key)} {series[key][name + "_sum"]}')
+            lines.append(f'{name}_count{_labels(key)} {running}')
+    for name, help_text in COUNTERS.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+        for key in keys:
+            lines.append(f'{name}{_labels(key)} {series[key][name]}')
+    for stat, (name, kind, help_text) in HASHING_METRICS.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+        for pid in sorted(pool):
+            lines.append(f'{name}{_labels((pid,))} {pool[pid][stat]}')
+    return '\n'.join(lines) + '\n'
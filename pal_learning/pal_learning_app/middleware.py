@@ -0,0 +1,59 @@
+import time
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.utils.decorators import sync_and_async_middleware
+
+from . import metrics
+
+KNOWN_METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+
+
+def _record(request, response, token, started):
+    duration = time.perf_counter() - started
+    queries, sql_seconds = metrics.finish_request(token)
+    match = getattr(request, 'resolver_match', None)
+    # label by route name, never by path, to keep the series count bounded
+    view = (match.view_name or match._func_path) if match else 'unmatched'
+    method = request.method if request.method in KNOWN_METHODS else 'other'
+    size = None if response.streaming else len(response.content)
+    metrics.observe(view, method, response.status_code, duration, queries, sql_seconds, size)
+
+
+@sync_and_async_middleware
+def metrics_middleware(get_response):
+    """Time every request and count its SQL queries, per resolved URL name."""
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            token, started = metrics.start_request(), time.perf_counter()
+            response = await get_response(request)
+            _record(request, response, token, started)
+            return response
+    else:
+        def middleware(request):
+            token, started = metrics.start_request(), time.perf_counter()
+            response = get_response(request)
+            _record(request, response, token, started)
+            return response
+    return middleware
+
+
+@sync_and_async_middleware
+def asgi_urlconf_middleware(get_response):
+    """Route ASGI requests through settings.ASGI_URLCONF.
+
+    Each handler then gets the views it runs natively: a sync view costs an
+    ASGI worker a thread hop, an async view costs a WSGI worker an event loop.
+    """
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            if isinstance(request, ASGIRequest):
+                request.urlconf = settings.ASGI_URLCONF
+            return await get_response(request)
+    else:
+        def middleware(request):
+            if isinstance(request, ASGIRequest):
+                request.urlconf = settings.ASGI_URLCONF
+            return get_response(request)
+    return middleware
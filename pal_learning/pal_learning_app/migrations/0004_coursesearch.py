@@ -0,0 +1,44 @@
+from django.db import migrations
+
+SEARCH_TABLE = 'pal_learning_app_coursesearch'
+
+
+def create_search_index(apps, schema_editor):
+    # the FTS5 index only exists on SQLite; other databases use the
+    # portable search backend and need no table
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} "
+        f"USING fts5(title, topic, description, outline, tokenize='unicode61 remove_diacritics 2')"
+    )
+    schema_editor.execute(f"""
+        INSERT INTO {SEARCH_TABLE} (rowid, title, topic, description, outline)
+        SELECT c.id, c.title, c.topic, c.description,
+               coalesce((SELECT group_concat(m.title, ' ')
+                           FROM pal_learning_app_module m
+                          WHERE m.course_id = c.id), '')
+               || ' ' ||
+               coalesce((SELECT group_concat(l.title, ' ')
+                           FROM pal_learning_app_lesson l
+                           JOIN pal_learning_app_module m ON m.id = l.module_id
+                          WHERE m.course_id = c.id), '')
+          FROM pal_learning_app_course c
+    """)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pal_learning_app', '0003_alter_customuser_managers_alter_customuser_email'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
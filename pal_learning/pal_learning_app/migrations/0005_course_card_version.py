@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pal_learning_app', '0004_coursesearch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='card_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pal_learning_app', '0005_course_card_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='quiz',
+            name='key_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
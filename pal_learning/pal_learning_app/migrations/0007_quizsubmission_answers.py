@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pal_learning_app', '0006_quiz_key_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='quizsubmission',
+            name='answers',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
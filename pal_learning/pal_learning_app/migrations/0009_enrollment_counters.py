@@ -0,0 +1,71 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:17
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def backfill_counters(apps, schema_editor):
+    Enrollment = apps.get_model('pal_learning_app', 'Enrollment')
+    Lesson = apps.get_model('pal_learning_app', 'Lesson')
+    Progress = apps.get_model('pal_learning_app', 'Progress')
+    QuizSubmission = apps.get_model('pal_learning_app', 'QuizSubmission')
+
+    total = dict(
+        Lesson.objects.values_list('module__course_id').annotate(n=Count('id'))
+    )
+    completed = {
+        (student_id, course_id): n
+        for student_id, course_id, n in
+        Progress.objects.filter(completed_at__isnull=False)
+                        .values_list('student_id', 'lesson__module__course_id')
+                        .annotate(n=Count('id'))
+    }
+    quizzes = {
+        (student_id, course_id): (n, score)
+        for student_id, course_id, n, score in
+        QuizSubmission.objects.values_list('student_id', 'quiz__lesson__module__course_id')
+                              .annotate(n=Count('id'), score=Sum('score'))
+    }
+
+    batch = []
+    for enrollment in Enrollment.objects.iterator(chunk_size=1000):
+        key = (enrollment.student_id, enrollment.course_id)
+        enrollment.total_lessons = total.get(enrollment.course_id, 0)
+        enrollment.completed_lessons = completed.get(key, 0)
+        enrollment.quizzes_taken, enrollment.quiz_score_total = quizzes.get(key, (0, 0))
+        batch.append(enrollment)
+        if len(batch) == 1000:
+            Enrollment.objects.bulk_update(batch, ['total_lessons', 'completed_lessons', 'quizzes_taken', 'quiz_score_total'])
+            batch = []
+    Enrollment.objects.bulk_update(batch, ['total_lessons', 'completed_lessons', 'quizzes_taken', 'quiz_score_total'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pal_learning_app', '0008_item_statistics'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='enrollment',
+            name='completed_lessons',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='enrollment',
+            name='quiz_score_total',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='enrollment',
+            name='quizzes_taken',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='enrollment',
+            name='total_lessons',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
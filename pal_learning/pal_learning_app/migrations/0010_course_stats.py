@@ -0,0 +1,70 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def backfill_stats(apps, schema_editor):
+    Course = apps.get_model('pal_learning_app', 'Course')
+    CourseStats = apps.get_model('pal_learning_app', 'CourseStats')
+    CourseDailyEnrollment = apps.get_model('pal_learning_app', 'CourseDailyEnrollment')
+    Enrollment = apps.get_model('pal_learning_app', 'Enrollment')
+    QuizSubmission = apps.get_model('pal_learning_app', 'QuizSubmission')
+
+    stats = {course_id: CourseStats(course_id=course_id)
+             for course_id in Course.objects.values_list('id', flat=True)}
+    for course_id, status, n in (
+        Enrollment.objects.values_list('course_id', 'status').annotate(n=Count('id'))
+    ):
+        setattr(stats[course_id], status, n)
+    for course_id, n, score in (
+        QuizSubmission.objects.values_list('quiz__lesson__module__course_id')
+                              .annotate(n=Count('id'), score=Sum('score'))
+    ):
+        stats[course_id].quiz_submissions = n
+        stats[course_id].quiz_score_total = score
+    CourseStats.objects.bulk_create(stats.values(), batch_size=1000)
+
+    # drops were never dated, so the history starts with enrollments only
+    CourseDailyEnrollment.objects.bulk_create([
+        CourseDailyEnrollment(course_id=course_id, day=day, enrollments=n)
+        for course_id, day, n in
+        Enrollment.objects.values_list('course_id', 'enrolled_at__date').annotate(n=Count('id'))
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pal_learning_app', '0009_enrollment_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CourseStats',
+            fields=[
+                ('course', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='pal_learning_app.course')),
+                ('in_progress', models.PositiveIntegerField(default=0)),
+                ('completed', models.PositiveIntegerField(default=0)),
+                ('dropped', models.PositiveIntegerField(default=0)),
+                ('quiz_submissions', models.PositiveIntegerField(default=0)),
+                ('quiz_score_total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CourseDailyEnrollment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('enrollments', models.PositiveIntegerField(default=0)),
+                ('drops', models.PositiveIntegerField(default=0)),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_enrollments', to='pal_learning_app.course')),
+            ],
+            options={
+                'ordering': ['day'],
+                'unique_together': {('course', 'day')},
+            },
+        ),
+        migrations.RunPython(backfill_stats, migrations.RunPython.noop),
+    ]
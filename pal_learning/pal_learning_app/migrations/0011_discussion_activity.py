@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:21
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def backfill_activity(apps, schema_editor):
+    Comment = apps.get_model('pal_learning_app', 'Comment')
+    DiscussionThread = apps.get_model('pal_learning_app', 'DiscussionThread')
+
+    activity = {
+        thread_id: (n, last)
+        for thread_id, n, last in
+        Comment.objects.values_list('thread_id').annotate(n=Count('id'), last=Max('created_at'))
+    }
+    threads = list(DiscussionThread.objects.all())
+    for thread in threads:
+        thread.comment_count, last = activity.get(thread.pk, (0, None))
+        thread.last_activity_at = max(last, thread.created_at) if last else thread.created_at
+    DiscussionThread.objects.bulk_update(threads, ['comment_count', 'last_activity_at'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pal_learning_app', '0010_course_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='discussionthread',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='discussionthread',
+            name='last_activity_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['thread', 'created_at', 'id'], name='comment_thread_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='discussionthread',
+            index=models.Index(fields=['lesson', '-last_activity_at', '-id'], name='thread_lesson_activity_idx'),
+        ),
+        migrations.RunPython(backfill_activity, migrations.RunPython.noop),
+    ]
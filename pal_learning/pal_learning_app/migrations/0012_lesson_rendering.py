@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:28
+
+from django.db import migrations, models
+
+from pal_learning_app.rendering import embed_url, excerpt, render_body
+
+BATCH_SIZE = 1000
+
+
+def backfill_rendering(apps, schema_editor):
+    Lesson = apps.get_model('pal_learning_app', 'Lesson')
+    fields = ['body_html', 'excerpt', 'embed_url']
+
+    batch = []
+    for lesson in Lesson.objects.only('body', 'content_url', 'content_type').iterator(chunk_size=BATCH_SIZE):
+        lesson.body_html = render_body(lesson.body)
+        lesson.excerpt = excerpt(lesson.body_html)
+        lesson.embed_url = embed_url(lesson.content_url) if lesson.content_type == 'video' else ''
+        batch.append(lesson)
+        if len(batch) == BATCH_SIZE:
+            Lesson.objects.bulk_update(batch, fields)
+            batch = []
+    Lesson.objects.bulk_update(batch, fields)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pal_learning_app', '0011_discussion_activity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lesson',
+            name='body_html',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='lesson',
+            name='embed_url',
+            field=models.URLField(blank=True, editable=False, max_length=500),
+        ),
+        migrations.AddField(
+            model_name='lesson',
+            name='excerpt',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.RunPython(backfill_rendering, migrations.RunPython.noop),
+    ]
@@ -1,8 +1,12 @@
+import math
 import re
 from django.conf import settings
 from django.contrib.auth.base_user import BaseUserManager
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.utils import timezone
+
+from . import rendering
 
 class UserManager(BaseUserManager):
     use_in_migrations = True
@@ -57,11 +61,15 @@ class UserManager(BaseUserManager):
         if not postData.get('email') or not postData.get('password'):
             errors["login"] = "Invalid email or password."
         return errors
-    def create_user(self, email, password=None, **extra_fields):
+    def build_user(self, email, **extra_fields):
+        # an unsaved user without a password, for callers that hash elsewhere
         if not email:
             raise ValueError('The Email field must be set')
         email = self.normalize_email(email)
-        user = self.model(email=email, username=email, **extra_fields)
+        return self.model(email=email, username=email, **extra_fields)
+
+    def create_user(self, email, password=None, **extra_fields):
+        user = self.build_user(email, **extra_fields)
         user.set_password(password)
         user.save(using=self._db)
         return user
@@ -107,10 +115,38 @@ class CustomUser(AbstractUser):
             # instructors must be approved manually
             self.is_active = self.is_approved
 
+        adding = self._state.adding
         super().save(*args, **kwargs)
 
+        # course cards show the instructor's name, so cached cards go stale
+        update_fields = kwargs.get('update_fields')
+        if not adding and (update_fields is None or 'first_name' in update_fields):
+            self.courses_taught.update(card_version=models.F('card_version') + 1)
+        if not adding:
+            from .backends import invalidate_user_snapshots
+            invalidate_user_snapshots([self.pk])
+
+    def get_session_auth_hash(self):
+        # users rebuilt from a cached snapshot carry the hash, not the
+        # password, until a password is set on them
+        cached = self.__dict__.get('_session_auth_hash')
+        if cached is not None and 'password' not in self.__dict__:
+            return cached
+        return super().get_session_auth_hash()
+
     def __str__(self):
         return f"{self.email} ({self.role})"
+class CourseQuerySet(models.QuerySet):
+    def with_enrollment_status(self, user):
+        # annotate each course with the user's enrollment status (or None)
+        # in the same query, instead of one lookup per course
+        status = Enrollment.objects.filter(
+            course=models.OuterRef('pk'),
+            student=user,
+        ).values('status')[:1]
+        return self.annotate(enrollment_status=models.Subquery(status))
+
+
 class Course(models.Model):
     BEGINNER     = 'beginner'
     INTERMEDIATE = 'intermediate'
@@ -128,6 +164,32 @@ class Course(models.Model):
     instructor   = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.PROTECT, related_name='courses_taught')
     created_at   = models.DateTimeField(auto_now_add=True)
     updated_at   = models.DateTimeField(auto_now=True)
+    # part of the cache key of the rendered course card
+    card_version = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = CourseQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # the catalog pages through courses newest first
+            models.Index(fields=['-created_at', '-id'], name='course_created_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        # bumped in the database, so concurrent saves never share a version
+        # (two saves that both wrote the n + 1 they read would leave cached
+        # cards of the first one in place); refresh_from_db reads it back
+        adding = self._state.adding
+        if adding:
+            self.card_version += 1
+        else:
+            self.card_version = models.F('card_version') + 1
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'card_version'}
+        super().save(*args, **kwargs)
+        if not adding:
+            self.refresh_from_db(fields=['card_version'])
 
     def __str__(self):
         return self.title
@@ -156,17 +218,41 @@ class Lesson(models.Model):
     content_url  = models.URLField(max_length=500, blank=True)
     body         = models.TextField(blank=True)
     sort_order   = models.PositiveIntegerField(default=0)
+    # rendered from the fields above on save, see pal_learning_app.rendering
+    body_html    = models.TextField(blank=True, editable=False)
+    excerpt      = models.TextField(blank=True, editable=False)
+    embed_url    = models.URLField(max_length=500, blank=True, editable=False)
 
     class Meta:
         ordering = ['sort_order']
 
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or rendering.SOURCE_FIELDS.intersection(update_fields):
+            rendering.render_lesson(self)
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, *rendering.RENDERED_FIELDS}
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return f"{self.module.title} — {self.title}"
 
 
 class Quiz(models.Model):
-    lesson = models.OneToOneField(Lesson, on_delete=models.CASCADE, related_name='quiz')
-    title  = models.CharField(max_length=255)
+    lesson      = models.OneToOneField(Lesson, on_delete=models.CASCADE, related_name='quiz')
+    title       = models.CharField(max_length=255)
+    # bumped whenever a question or choice changes; versions the answer key
+    key_version = models.PositiveIntegerField(default=0, editable=False)
+
+    def save(self, *args, **kwargs):
+        # key_version only moves through F('key_version') + 1; a save of a
+        # stale instance must not write an old version back
+        if not self._state.adding:
+            update_fields = kwargs.get('update_fields')
+            if update_fields is None:
+                update_fields = [f.name for f in self._meta.concrete_fields if not f.primary_key]
+            kwargs['update_fields'] = [name for name in update_fields if name != 'key_version']
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"Quiz: {self.title}"
@@ -194,6 +280,48 @@ class Choice(models.Model):
         return f"{self.text} ({'✓' if self.is_correct else '✗'})"
 
 
+class QuestionStats(models.Model):
+    """Running item-analysis sums for a question, one row per question."""
+    question          = models.OneToOneField(Question, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    attempts          = models.PositiveIntegerField(default=0)
+    correct           = models.PositiveIntegerField(default=0)
+    score_sum         = models.FloatField(default=0)
+    score_sq_sum      = models.FloatField(default=0)
+    # sum of the quiz scores of the attempts that got this question right
+    correct_score_sum = models.FloatField(default=0)
+
+    @property
+    def difficulty(self):
+        # classical p-value: share of attempts answering correctly
+        return self.correct / self.attempts if self.attempts else None
+
+    @property
+    def discrimination(self):
+        # point-biserial correlation between this item and the quiz score
+        n, n1 = self.attempts, self.correct
+        if n < 2 or n1 in (0, n):
+            return None
+        mean = self.score_sum / n
+        variance = self.score_sq_sum / n - mean ** 2
+        if variance <= 0:
+            return None
+        mean_correct = self.correct_score_sum / n1
+        mean_wrong = (self.score_sum - self.correct_score_sum) / (n - n1)
+        p = n1 / n
+        return (mean_correct - mean_wrong) / math.sqrt(variance) * math.sqrt(p * (1 - p))
+
+    def __str__(self):
+        return f"Stats for {self.question}"
+
+
+class ChoiceStats(models.Model):
+    choice = models.OneToOneField(Choice, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    picks  = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.choice}: {self.picks}"
+
+
 class Enrollment(models.Model):
     IN_PROGRESS = 'in_progress'
     COMPLETED   = 'completed'
@@ -209,13 +337,72 @@ class Enrollment(models.Model):
     enrolled_at = models.DateTimeField(auto_now_add=True)
     status      = models.CharField(max_length=20, choices=STATUS_CHOICES, default=IN_PROGRESS)
 
+    # denormalized dashboard counters, maintained by pal_learning_app.counters
+    completed_lessons = models.PositiveIntegerField(default=0, editable=False)
+    total_lessons     = models.PositiveIntegerField(default=0, editable=False)
+    quizzes_taken     = models.PositiveIntegerField(default=0, editable=False)
+    quiz_score_total  = models.DecimalField(max_digits=12, decimal_places=2, default=0, editable=False)
+
     class Meta:
         unique_together = ('student', 'course')
+        indexes = [
+            models.Index(fields=['student', 'status'], name='enrollment_student_status_idx'),
+            models.Index(fields=['course', 'status'], name='enrollment_course_status_idx'),
+        ]
+
+    @property
+    def percent_complete(self):
+        if not self.total_lessons:
+            return 0
+        return min(100, round(self.completed_lessons * 100 / self.total_lessons))
+
+    @property
+    def quiz_average(self):
+        if not self.quizzes_taken:
+            return None
+        return round(self.quiz_score_total / self.quizzes_taken, 2)
 
     def __str__(self):
         return f"{self.student} → {self.course}"
 
 
+class CourseStats(models.Model):
+    """Enrollment and quiz rollup per course, maintained by pal_learning_app.counters."""
+    course           = models.OneToOneField(Course, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    in_progress      = models.PositiveIntegerField(default=0)
+    completed        = models.PositiveIntegerField(default=0)
+    dropped          = models.PositiveIntegerField(default=0)
+    quiz_submissions = models.PositiveIntegerField(default=0)
+    quiz_score_total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    @property
+    def total(self):
+        return self.in_progress + self.completed + self.dropped
+
+    @property
+    def quiz_average(self):
+        if not self.quiz_submissions:
+            return None
+        return round(self.quiz_score_total / self.quiz_submissions, 2)
+
+    def __str__(self):
+        return f"Stats for {self.course}"
+
+
+class CourseDailyEnrollment(models.Model):
+    course      = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='daily_enrollments')
+    day         = models.DateField()
+    enrollments = models.PositiveIntegerField(default=0)
+    drops       = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('course', 'day')
+        ordering = ['day']
+
+    def __str__(self):
+        return f"{self.course} on {self.day}"
+
+
 class Progress(models.Model):
     student     = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='progress_records')
     lesson      = models.ForeignKey(Lesson, on_delete=models.CASCADE, related_name='progress_records')
@@ -224,6 +411,9 @@ class Progress(models.Model):
 
     class Meta:
         unique_together = ('student', 'lesson')
+        indexes = [
+            models.Index(fields=['student', 'completed_at'], name='progress_student_completed_idx'),
+        ]
 
     def __str__(self):
         return f"{self.student} — {self.lesson}"
@@ -234,9 +424,17 @@ class QuizSubmission(models.Model):
     quiz         = models.ForeignKey(Quiz, on_delete=models.CASCADE, related_name='submissions')
     submitted_at = models.DateTimeField(auto_now_add=True)
     score        = models.DecimalField(max_digits=5, decimal_places=2)
+    # selected choice ids, see grading.encode_choices; null for old attempts
+    answers      = models.BinaryField(null=True, blank=True, editable=False)
+    # ids of the questions this attempt counts as correct in the item
+    # statistics, encoded the same way; null for older attempts
+    correct      = models.BinaryField(null=True, blank=True, editable=False)
 
     class Meta:
         unique_together = ('student', 'quiz')
+        indexes = [
+            models.Index(fields=['quiz', 'score'], name='submission_quiz_score_idx'),
+        ]
 
     def __str__(self):
         return f"{self.student} scored {self.score} on {self.quiz}"
@@ -247,6 +445,14 @@ class DiscussionThread(models.Model):
     created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='threads_created')
     title      = models.CharField(max_length=255)
     created_at = models.DateTimeField(auto_now_add=True)
+    # maintained by pal_learning_app.counters as comments come and go
+    comment_count    = models.PositiveIntegerField(default=0, editable=False)
+    last_activity_at = models.DateTimeField(default=timezone.now, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['lesson', '-last_activity_at', '-id'], name='thread_lesson_activity_idx'),
+        ]
 
     def __str__(self):
         return self.title
@@ -258,5 +464,10 @@ class Comment(models.Model):
     body       = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['thread', 'created_at', 'id'], name='comment_thread_created_idx'),
+        ]
+
     def __str__(self):
         return f"{self.user}: {self.body[:30]}"
@@ -0,0 +1,129 @@
+"""
+Gap-based sort keys for modules and lessons.
+
+Keys are spread GAP apart, starting at GAP so that there is room before the
+first item too, so moving one item means giving it a key between its new
+neighbours: one row changes. A reorder keeps the largest set of
+items that are already in the right relative order (a longest increasing
+run of their keys) and rekeys only the rest, renumbering the whole list
+only when a gap has run out.
+"""
+from bisect import bisect_left
+
+from django.db import transaction
+from django.db.models import Max
+
+from .outline import invalidate_outline
+
+GAP = 1024
+
+
+class OrderConflict(Exception):
+    """The submitted order does not list exactly the current items."""
+
+
+def next_key(queryset):
+    """Key that puts a new item after everything in ``queryset``."""
+    last = queryset.aggregate(last=Max('sort_order'))['last']
+    return GAP if last is None else last + GAP
+
+
+def _keep(keys):
+    # indexes of a longest strictly increasing subsequence of keys
+    tails, tail_index, previous = [], [], [None] * len(keys)
+    for i, key in enumerate(keys):
+        pos = bisect_left(tails, key)
+        if pos == len(tails):
+            tails.append(key)
+            tail_index.append(i)
+        else:
+            tails[pos] = key
+            tail_index[pos] = i
+        previous[i] = tail_index[pos - 1] if pos else None
+    kept = set()
+    i = tail_index[-1] if tail_index else None
+    while i is not None:
+        kept.add(i)
+        i = previous[i]
+    return kept
+
+
+def plan(current, wanted):
+    """
+    New keys for putting items in the ``wanted`` order of ids, given
+    ``current`` (id, key) pairs. Returns {id: key} for the items that change.
+    """
+    keys = dict(current)
+    ordered = [keys[item_id] for item_id in wanted]
+    kept = _keep(ordered)
+
+    new_keys = list(ordered)
+    start = 0
+    while start < len(wanted):
+        if start in kept:
+            start += 1
+            continue
+        end = start
+        while end < len(wanted) and end not in kept:
+            end += 1
+        # wanted[start:end] go between the kept neighbours around them
+        low = new_keys[start - 1] if start else -1
+        high = ordered[end] if end < len(wanted) else None
+        count = end - start
+        if high is None:
+            for offset in range(count):
+                new_keys[start + offset] = low + GAP * (offset + 1)
+        elif high - low > count:
+            for offset in range(count):
+                new_keys[start + offset] = low + (high - low) * (offset + 1) // (count + 1)
+        else:
+            # no room left: spread everything out again
+            new_keys = [GAP * (index + 1) for index in range(len(wanted))]
+            break
+        start = end
+
+    return {
+        item_id: key
+        for item_id, key in zip(wanted, new_keys)
+        if keys[item_id] != key
+    }
+
+
+def reorder(siblings, wanted):
+    """
+    Put the items of ``siblings`` (a Module or Lesson queryset) in the
+    ``wanted`` order of ids. Call inside a transaction that holds a lock on
+    their parent. Returns the number of rows changed.
+    """
+    current = list(siblings.order_by('sort_order', 'id').values_list('id', 'sort_order'))
+    if len(wanted) != len(set(wanted)) or set(wanted) != {item_id for item_id, _ in current}:
+        raise OrderConflict("The list has changed since it was loaded.")
+
+    changes = plan(current, wanted)
+    if changes:
+        model = siblings.model
+        objs = [model(pk=item_id, sort_order=key) for item_id, key in changes.items()]
+        model.objects.bulk_update(objs, ['sort_order'])
+    return len(changes)
+
+
+def _lock(obj):
+    # concurrent reorders of the same list queue up behind this row lock
+    list(type(obj).objects.select_for_update().filter(pk=obj.pk).values_list('pk'))
+
+
+def reorder_modules(course, wanted):
+    with transaction.atomic():
+        _lock(course)
+        changed = reorder(course.modules.all(), wanted)
+        # bulk_update sends no signals
+        transaction.on_commit(lambda: invalidate_outline(course.pk))
+    return changed
+
+
+def reorder_lessons(module, wanted):
+    with transaction.atomic():
+        _lock(module)
+        changed = reorder(module.lessons.all(), wanted)
+        transaction.on_commit(lambda: invalidate_outline(module.course_id))
+    return changed
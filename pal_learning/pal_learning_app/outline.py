@@ -0,0 +1,129 @@
+from dataclasses import dataclass
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.http import Http404
+
+from .models import Course, Lesson
+
+OUTLINE_TIMEOUT = 60 * 60 * 24
+
+
+@dataclass(frozen=True)
+class LessonOutline:
+    id: int
+    title: str
+    content_type: str
+    content_type_display: str
+    quiz_id: int | None
+
+
+@dataclass(frozen=True)
+class ModuleOutline:
+    id: int
+    title: str
+    lessons: tuple
+
+
+@dataclass(frozen=True)
+class CourseOutline:
+    """Read-only snapshot of a course's navigation tree, in display order."""
+    id: int
+    title: str
+    description: str
+    topic: str
+    difficulty_display: str
+    instructor_id: int
+    instructor_name: str
+    modules: tuple
+
+    def module(self, module_id):
+        for module in self.modules:
+            if module.id == module_id:
+                return module
+        return None
+
+
+def _cache_key(course_id):
+    return f'course-outline:{course_id}'
+
+
+def build_outline(course_id):
+    # three queries whatever the size of the course
+    course = Course.objects.select_related('instructor').filter(pk=course_id).first()
+    if course is None:
+        return None
+
+    content_types = dict(Lesson.CONTENT_TYPE_CHOICES)
+    lessons_by_module = {}
+    lessons = (
+        Lesson.objects.filter(module__course_id=course_id)
+                      .order_by('sort_order', 'id')
+                      .values_list('id', 'module_id', 'title', 'content_type', 'quiz__id')
+    )
+    for lesson_id, module_id, title, content_type, quiz_id in lessons:
+        lessons_by_module.setdefault(module_id, []).append(LessonOutline(
+            id=lesson_id,
+            title=title,
+            content_type=content_type,
+            content_type_display=content_types.get(content_type, content_type),
+            quiz_id=quiz_id,
+        ))
+
+    modules = tuple(
+        ModuleOutline(id=module_id, title=title, lessons=tuple(lessons_by_module.get(module_id, ())))
+        for module_id, title in course.modules.order_by('sort_order', 'id').values_list('id', 'title')
+    )
+    return CourseOutline(
+        id=course.id,
+        title=course.title,
+        description=course.description,
+        topic=course.topic,
+        difficulty_display=course.get_difficulty_display(),
+        instructor_id=course.instructor_id,
+        instructor_name=course.instructor.first_name,
+        modules=modules,
+    )
+
+
+def get_outline(course_id):
+    key = _cache_key(course_id)
+    outline = cache.get(key)
+    if outline is None:
+        outline = build_outline(course_id)
+        if outline is not None:
+            cache.set(key, outline, OUTLINE_TIMEOUT)
+    return outline
+
+
+def get_outline_or_404(course_id):
+    outline = get_outline(course_id) if course_id is not None else None
+    if outline is None:
+        raise Http404("No course matches the given query.")
+    return outline
+
+
+async def aget_outline(course_id):
+    key = _cache_key(course_id)
+    outline = await cache.aget(key)
+    if outline is None:
+        # misses are rare and take three queries: build in one thread hop
+        outline = await sync_to_async(build_outline)(course_id)
+        if outline is not None:
+            await cache.aset(key, outline, OUTLINE_TIMEOUT)
+    return outline
+
+
+async def aget_outline_or_404(course_id):
+    outline = await aget_outline(course_id) if course_id is not None else None
+    if outline is None:
+        raise Http404("No course matches the given query.")
+    return outline
+
+
+def invalidate_outline(course_id):
+    cache.delete(_cache_key(course_id))
+
+
+def invalidate_outlines(course_ids):
+    cache.delete_many([_cache_key(course_id) for course_id in course_ids])
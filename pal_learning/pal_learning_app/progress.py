@@ -0,0 +1,145 @@
+import atexit
+import logging
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+
+from . import counters
+from .models import CustomUser, Lesson, Progress
+from .utils import conflict_target
+
+logger = logging.getLogger(__name__)
+
+# (student id, lesson id) -> completion time, or None for "started" only.
+# Heartbeats only touch this dict; the flusher turns it into at most one
+# write per student and lesson per interval.
+_pending = {}
+_lock = threading.Lock()
+_flusher = None
+
+
+def _flush_interval():
+    return getattr(settings, 'PROGRESS_FLUSH_INTERVAL', 5)
+
+
+def record(student_id, lesson_id, completed=False):
+    key = (student_id, lesson_id)
+    with _lock:
+        if completed:
+            # keep the first completion seen in this interval
+            _pending[key] = _pending.get(key) or timezone.now()
+        else:
+            _pending.setdefault(key, None)
+
+    if _flush_interval() <= 0:
+        flush()
+    else:
+        _start_flusher()
+
+
+def _write(events):
+    # lessons and students may have been deleted since the heartbeat was sent
+    course_of = dict(
+        Lesson.objects.filter(pk__in={lesson_id for _, lesson_id in events})
+                      .values_list('id', 'module__course_id')
+    )
+    students = set(
+        CustomUser.objects.filter(pk__in={student_id for student_id, _ in events})
+                          .values_list('id', flat=True)
+    )
+    started, completed = [], []
+    for (student_id, lesson_id), completed_at in events.items():
+        if lesson_id not in course_of or student_id not in students:
+            continue
+        row = Progress(student_id=student_id, lesson_id=lesson_id, completed_at=completed_at)
+        (completed if completed_at else started).append(row)
+
+    with transaction.atomic():
+        # completions already on record don't count twice on the dashboard
+        done_before = set(
+            Progress.objects.filter(student_id__in={p.student_id for p in completed},
+                                    lesson_id__in={p.lesson_id for p in completed},
+                                    completed_at__isnull=False)
+                            .values_list('student_id', 'lesson_id')
+        ) if completed else set()
+
+        # "started" never clears an earlier completion, and a completion
+        # never moves the time of the first one
+        completed = [p for p in completed if (p.student_id, p.lesson_id) not in done_before]
+        Progress.objects.bulk_create(started, ignore_conflicts=True)
+        Progress.objects.bulk_create(
+            completed,
+            update_conflicts=True,
+            unique_fields=conflict_target('student', 'lesson'),
+            update_fields=['completed_at'],
+        )
+
+        newly_completed = Counter((p.student_id, course_of[p.lesson_id]) for p in completed)
+        counters.lessons_completed(newly_completed)
+    return len(started) + len(completed)
+
+
+def _put_back(events):
+    # the next flush retries them
+    with _lock:
+        for key, completed_at in events.items():
+            if completed_at or key not in _pending:
+                _pending[key] = _pending.get(key) or completed_at
+
+
+def flush():
+    """Write every buffered event to Progress; returns the number of rows."""
+    global _pending
+    with _lock:
+        events, _pending = _pending, {}
+    if not events:
+        return 0
+
+    try:
+        return _write(events)
+    except IntegrityError:
+        logger.warning("Writing %s progress event(s) failed, retrying one by one", len(events))
+    except Exception:
+        _put_back(events)
+        raise
+
+    # one bad row must not hold back the others, or fail every later flush
+    written = 0
+    keys = list(events)
+    for index, key in enumerate(keys):
+        try:
+            written += _write({key: events[key]})
+        except IntegrityError:
+            logger.exception("Dropping progress event %s", key)
+        except Exception:
+            _put_back({k: events[k] for k in keys[index:]})
+            raise
+    return written
+
+
+def _run_flusher():
+    while True:
+        time.sleep(_flush_interval())
+        try:
+            flush()
+        except Exception:
+            logger.exception("Flushing lesson progress failed")
+        finally:
+            connection.close()
+
+
+def _start_flusher():
+    global _flusher
+    if _flusher is not None:
+        return
+    with _lock:
+        if _flusher is None:
+            _flusher = threading.Thread(target=_run_flusher, name='progress-flusher', daemon=True)
+            _flusher.start()
+
+
+atexit.register(lambda: _pending and flush())
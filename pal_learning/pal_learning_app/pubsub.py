@@ -0,0 +1,150 @@
+"""
+Publish/subscribe for live page updates.
+
+Publishing is synchronous so it can run from ``transaction.on_commit``;
+subscribers are asyncio queues owned by async views. Each subscriber costs
+one queue and nothing else while idle: delivery is pushed into its event
+loop, never polled.
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+
+from django.conf import settings
+from django.utils import dateformat, timezone
+
+logger = logging.getLogger(__name__)
+
+# a subscriber that falls this far behind starts losing messages instead of
+# growing without bound
+SUBSCRIBER_QUEUE_SIZE = 100
+RECONNECT_DELAY = 1
+
+
+def _offer(queue, message):
+    try:
+        queue.put_nowait(message)
+    except asyncio.QueueFull:
+        pass
+
+
+class LocalBroker:
+    """Fans messages out to subscribers in this process only."""
+
+    def __init__(self):
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def publish(self, channel, message):
+        self._deliver(channel, message)
+
+    def _deliver(self, channel, message):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(_offer, queue, message)
+            except RuntimeError:
+                # the subscriber's loop is already closed
+                pass
+
+    @contextmanager
+    def subscribe(self, channel):
+        """Yield an asyncio.Queue receiving the messages sent to ``channel``."""
+        entry = (asyncio.get_running_loop(), asyncio.Queue(SUBSCRIBER_QUEUE_SIZE))
+        with self._lock:
+            self._subscribers.setdefault(channel, set()).add(entry)
+        try:
+            yield entry[1]
+        finally:
+            with self._lock:
+                subscribers = self._subscribers.get(channel)
+                subscribers.discard(entry)
+                if not subscribers:
+                    del self._subscribers[channel]
+
+
+class RedisBroker(LocalBroker):
+    """
+    Relays messages through a Redis-compatible server so every worker sees
+    them. Each process keeps a single pattern subscription, read by a daemon
+    thread, and fans out to its own subscribers from there.
+    """
+    prefix = 'pal-learning:'
+
+    def __init__(self, url):
+        import redis
+
+        super().__init__()
+        self._client = redis.Redis.from_url(url)
+        self._listener = None
+
+    def publish(self, channel, message):
+        import redis
+
+        try:
+            self._client.publish(self.prefix + channel, json.dumps(message))
+        except redis.RedisError:
+            # the write already committed; open pages just miss the update
+            logger.warning("Could not publish to %s", channel, exc_info=True)
+
+    def _listen(self):
+        import redis
+
+        while True:
+            try:
+                pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(self.prefix + '*')
+                for item in pubsub.listen():
+                    self._relay(item)
+            except redis.ConnectionError:
+                # messages published meanwhile never reach open pages;
+                # they show up again on the next page load
+                logger.warning("Lost the pub/sub connection, retrying", exc_info=True)
+                time.sleep(RECONNECT_DELAY)
+
+    def _relay(self, item):
+        try:
+            channel = item['channel'].decode()[len(self.prefix):]
+            self._deliver(channel, json.loads(item['data']))
+        except (KeyError, UnicodeDecodeError, ValueError):
+            logger.exception("Dropping malformed pub/sub message")
+
+    @contextmanager
+    def subscribe(self, channel):
+        with self._lock:
+            if self._listener is None or not self._listener.is_alive():
+                self._listener = threading.Thread(
+                    target=self._listen, name='pubsub-listener', daemon=True
+                )
+                self._listener.start()
+        with super().subscribe(channel) as queue:
+            yield queue
+
+
+@lru_cache(maxsize=None)
+def get_broker():
+    if getattr(settings, 'PUBSUB_BACKEND', 'local') == 'redis':
+        return RedisBroker(settings.PUBSUB_LOCATION)
+    return LocalBroker()
+
+
+def thread_channel(thread_id):
+    return f'thread:{thread_id}'
+
+
+def comment_message(comment):
+    return {
+        'id': comment.pk,
+        'author': comment.user.first_name,
+        'body': comment.body,
+        'created_at': dateformat.format(timezone.localtime(comment.created_at), 'M j, Y H:i'),
+    }
+
+
+def publish_comment(comment):
+    get_broker().publish(thread_channel(comment.thread_id), comment_message(comment))
@@ -0,0 +1,131 @@
+"""
+The app's hot querysets and a check of how the database plans them.
+
+HOT_QUERIES mirrors the querysets behind the busiest pages and jobs; keep it
+in step with them. ``python manage.py check_query_plans`` runs EXPLAIN
+(EXPLAIN QUERY PLAN on SQLite) for each one and fails when a plan reads a
+whole table instead of going through an index.
+"""
+import datetime
+import re
+
+from django.db import connection
+from django.db.models import Count, Q, Sum
+
+from .models import (
+    Comment, Course, CourseDailyEnrollment, CustomUser, DiscussionThread, Enrollment, Lesson,
+    Module, Progress, QuizSubmission,
+)
+
+# plans don't depend on the values, so placeholders do
+ID = 1
+IDS = [1, 2, 3]
+MOMENT = datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc)
+PAGE = 25
+
+
+def _catalog():
+    return (
+        Course.objects.select_related('instructor')
+                      .with_enrollment_status(CustomUser(pk=ID))
+                      .order_by('-created_at', '-id')
+    )
+
+
+HOT_QUERIES = {
+    # home: a student's courses in progress, an instructor's own courses
+    'home_enrollments': lambda: (
+        Enrollment.objects.filter(student_id=ID, status=Enrollment.IN_PROGRESS)
+                          .select_related('course__instructor')
+    ),
+    'home_courses_taught': lambda: Course.objects.filter(instructor_id=ID).select_related('instructor'),
+
+    # catalog, first and later pages
+    'catalog_first_page': lambda: _catalog()[:PAGE],
+    'catalog_next_page': lambda: _catalog().filter(
+        Q(created_at__lt=MOMENT) | Q(created_at=MOMENT, id__lt=ID)
+    )[:PAGE],
+
+    # course outline and stats
+    'outline_lessons': lambda: (
+        Lesson.objects.filter(module__course_id=ID)
+                      .order_by('sort_order', 'id')
+                      .values_list('id', 'module_id', 'title', 'content_type', 'quiz__id')
+    ),
+    'outline_modules': lambda: (
+        Module.objects.filter(course_id=ID).order_by('sort_order', 'id').values_list('id', 'title')
+    ),
+    'course_daily_enrollments': lambda: (
+        CourseDailyEnrollment.objects.filter(course_id=ID, day__gte=MOMENT.date())
+    ),
+
+    # discussions
+    'lesson_threads': lambda: (
+        DiscussionThread.objects.filter(lesson_id=ID)
+                                .order_by('-last_activity_at', '-id')[:PAGE]
+    ),
+    'thread_comments': lambda: (
+        Comment.objects.filter(thread_id=ID).select_related('user').order_by('created_at', 'id')[:PAGE]
+    ),
+
+    # progress and counters
+    'progress_completed_before': lambda: (
+        Progress.objects.filter(student_id__in=IDS, lesson_id__in=IDS, completed_at__isnull=False)
+                        .values_list('student_id', 'lesson_id')
+    ),
+    'student_completed_lessons': lambda: (
+        Progress.objects.filter(student_id__in=IDS, lesson__module__course_id__in=IDS,
+                                completed_at__isnull=False)
+                        .values_list('student_id', 'lesson__module__course_id')
+                        .annotate(n=Count('id'))
+    ),
+    'course_enrollment_counts': lambda: (
+        Enrollment.objects.filter(course_id__in=IDS)
+                          .values_list('course_id', 'status')
+                          .annotate(n=Count('id'))
+    ),
+    'course_quiz_scores': lambda: (
+        QuizSubmission.objects.filter(quiz__lesson__module__course_id__in=IDS)
+                              .values_list('quiz__lesson__module__course_id')
+                              .annotate(n=Count('id'), score=Sum('score'))
+    ),
+
+    # quizzes: regrading and a quiz's submissions by score
+    'quiz_regrade': lambda: (
+        QuizSubmission.objects.filter(quiz_id=ID, answers__isnull=False)
+                              .only('id', 'student_id', 'score', 'answers')
+    ),
+    'quiz_top_scores': lambda: (
+        QuizSubmission.objects.filter(quiz_id=ID).order_by('-score')[:PAGE]
+    ),
+}
+
+# SQLite: "SCAN t" reads the whole table; "SCAN t USING [COVERING] INDEX i"
+# walks an index in order, which stops early under a LIMIT but not when the
+# rows are sorted again afterwards. Older versions say "SCAN TABLE t".
+SQLITE_SCAN = re.compile(
+    r'\bSCAN (?:TABLE )?(\w+)(?: AS \w+)?( USING (?:COVERING INDEX \w+|INDEX \w+|INTEGER PRIMARY KEY))?\s*$',
+    re.MULTILINE,
+)
+FULL_SCAN = {
+    'postgresql': re.compile(r'\bSeq Scan on (\w+)'),
+    'mysql': re.compile(r'\bTable scan on (\w+)'),
+}
+
+
+def explain(queryset):
+    """The database's plan for ``queryset``, as text."""
+    if connection.vendor == 'mysql':
+        return queryset.explain(format='tree')
+    return queryset.explain()
+
+
+def full_scans(plan, vendor=None):
+    """The tables ``plan`` reads in full."""
+    vendor = vendor or connection.vendor
+    if vendor == 'sqlite':
+        resorted = 'USE TEMP B-TREE FOR ORDER BY' in plan
+        return sorted({table for table, walk in SQLITE_SCAN.findall(plan) if not walk or resorted})
+    if vendor not in FULL_SCAN:
+        raise ValueError(f"Don't know how to read {vendor} query plans.")
+    return sorted(set(FULL_SCAN[vendor].findall(plan)))
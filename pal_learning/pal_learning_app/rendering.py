@@ -0,0 +1,71 @@
+"""
+Lesson rendering, done once when a lesson is saved so that pages only
+print stored fields.
+
+Bodies are plain text only: escaped, with blank lines starting paragraphs.
+Markdown and raw HTML are shown as typed.
+"""
+import re
+from html import unescape
+from urllib.parse import parse_qs, urlparse
+
+from django.utils.html import linebreaks, strip_tags
+from django.utils.text import Truncator
+
+EXCERPT_WORDS = 40
+
+# lesson fields read by render_lesson and the fields it writes
+SOURCE_FIELDS = {'body', 'content_url', 'content_type'}
+RENDERED_FIELDS = ['body_html', 'excerpt', 'embed_url']
+
+YOUTUBE_HOSTS = {'youtube.com', 'www.youtube.com', 'm.youtube.com', 'youtube-nocookie.com',
+                 'www.youtube-nocookie.com'}
+VIMEO_HOSTS = {'vimeo.com', 'www.vimeo.com', 'player.vimeo.com'}
+YOUTUBE_ID = re.compile(r'^[\w-]{6,}$')
+VIMEO_ID = re.compile(r'^\d+$')
+
+
+def render_body(text):
+    """Lesson body as escaped HTML paragraphs."""
+    if not text:
+        return ''
+    return linebreaks(text, autoescape=True)
+
+
+def excerpt(html):
+    """Plain-text opening of a rendered body, for search and listings."""
+    text = ' '.join(unescape(strip_tags(html)).split())
+    return Truncator(text).words(EXCERPT_WORDS)
+
+
+def embed_url(url):
+    """Player URL for a YouTube or Vimeo link, or '' for anything else."""
+    if not url:
+        return ''
+    parsed = urlparse(url)
+    host = (parsed.hostname or '').lower()
+    parts = [part for part in parsed.path.split('/') if part]
+
+    if host in YOUTUBE_HOSTS:
+        if parts[:1] in (['embed'], ['shorts'], ['live']) and len(parts) > 1:
+            video = parts[1]
+        else:
+            video = parse_qs(parsed.query).get('v', [''])[0]
+        if YOUTUBE_ID.match(video):
+            return f'https://www.youtube.com/embed/{video}'
+    elif host == 'youtu.be':
+        if parts and YOUTUBE_ID.match(parts[0]):
+            return f'https://www.youtube.com/embed/{parts[0]}'
+    elif host in VIMEO_HOSTS:
+        # vimeo.com/<id>, vimeo.com/channels/<name>/<id>, player.vimeo.com/video/<id>
+        video = next((part for part in reversed(parts) if VIMEO_ID.match(part)), '')
+        if video:
+            return f'https://player.vimeo.com/video/{video}'
+    return ''
+
+
+def render_lesson(lesson):
+    """Fill the stored rendering fields of ``lesson`` from its source fields."""
+    lesson.body_html = render_body(lesson.body)
+    lesson.excerpt = excerpt(lesson.body_html)
+    lesson.embed_url = embed_url(lesson.content_url) if lesson.content_type == lesson.VIDEO else ''
@@ -0,0 +1,135 @@
+import re
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils.module_loading import import_string
+
+from .models import Course
+
+SEARCH_TABLE = 'pal_learning_app_coursesearch'
+
+# one row per course: the searchable course fields plus the titles of its
+# modules and lessons, so module/lesson matches surface the parent course
+DOCUMENT_SQL = """
+    SELECT c.id, c.title, c.topic, c.description,
+           coalesce((SELECT group_concat(m.title, ' ')
+                       FROM pal_learning_app_module m
+                      WHERE m.course_id = c.id), '')
+           || ' ' ||
+           coalesce((SELECT group_concat(l.title || ' ' || l.excerpt, ' ')
+                       FROM pal_learning_app_lesson l
+                       JOIN pal_learning_app_module m ON m.id = l.module_id
+                      WHERE m.course_id = c.id), '')
+      FROM pal_learning_app_course c
+"""
+
+
+class SearchBackend:
+    """Interface used by the catalog; backends keep their own index in sync."""
+
+    def index_course(self, course_id):
+        pass
+
+    def remove_course(self, course_id):
+        pass
+
+    def rebuild(self):
+        pass
+
+    def search(self, query, limit, after=None):
+        """
+        Return up to ``limit`` ``(course_id, rank)`` pairs ordered by
+        ``(rank, course_id)``, starting after the ``(rank, course_id)`` key
+        ``after`` when given.
+        """
+        raise NotImplementedError
+
+
+class LikeSearchBackend(SearchBackend):
+    """Portable fallback for databases without a configured full-text index."""
+
+    def search(self, query, limit, after=None):
+        terms = Q()
+        for word in query.split():
+            terms &= (
+                Q(title__icontains=word) |
+                Q(topic__icontains=word) |
+                Q(description__icontains=word) |
+                Q(modules__title__icontains=word) |
+                Q(modules__lessons__title__icontains=word)
+            )
+        courses = Course.objects.filter(terms)
+        if after is not None:
+            courses = courses.filter(id__gt=after[1])
+        # no relevance score here: every match ranks equally, by id
+        ids = courses.order_by('id').values_list('id', flat=True).distinct()[:limit]
+        return [(course_id, 0) for course_id in ids]
+
+
+class SQLiteFTSBackend(SearchBackend):
+    """SQLite FTS5 index ranked with bm25 (title > topic > outline > description)."""
+
+    RANK = f'bm25({SEARCH_TABLE}, 10.0, 5.0, 1.0, 2.0)'
+
+    def index_course(self, course_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE rowid = %s', [course_id])
+            cursor.execute(
+                f'INSERT INTO {SEARCH_TABLE} (rowid, title, topic, description, outline) '
+                f'{DOCUMENT_SQL} WHERE c.id = %s',
+                [course_id]
+            )
+
+    def remove_course(self, course_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE rowid = %s', [course_id])
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+            cursor.execute(
+                f'INSERT INTO {SEARCH_TABLE} (rowid, title, topic, description, outline) '
+                f'{DOCUMENT_SQL}'
+            )
+
+    def search(self, query, limit, after=None):
+        match = to_match_expression(query)
+        if not match:
+            return []
+        where, params = '', [match]
+        if after is not None:
+            # keyset on (rank, rowid): later pages cost the same as the first
+            where = f' AND ({self.RANK} > %s OR ({self.RANK} = %s AND rowid > %s))'
+            params += [after[0], after[0], after[1]]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid, {self.RANK} FROM {SEARCH_TABLE} '
+                f'WHERE {SEARCH_TABLE} MATCH %s{where} '
+                f'ORDER BY {self.RANK}, rowid LIMIT %s',
+                params + [limit]
+            )
+            return cursor.fetchall()
+
+
+def to_match_expression(query):
+    # quote every word so user input can't inject FTS syntax, and prefix-match
+    # the words so partial input (search-as-you-type) already finds courses
+    words = re.findall(r'\w+', query)
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+@lru_cache(maxsize=None)
+def get_backend():
+    path = getattr(settings, 'SEARCH_BACKEND', None)
+    if path:
+        return import_string(path)()
+    if connection.vendor == 'sqlite':
+        return SQLiteFTSBackend()
+    return LikeSearchBackend()
+
+
+def search_courses(query, limit, after=None):
+    """Return ``(course_id, rank)`` pairs matching ``query``, best match first."""
+    return get_backend().search(query, limit, after)
@@ -0,0 +1,183 @@
+from django.db import transaction
+from django.db.models import F, QuerySet
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .models import (
+    Choice, Comment, Course, CustomUser, DiscussionThread, Enrollment, Lesson, Module, Question, Quiz,
+    QuizSubmission,
+)
+from . import counters, pubsub, search
+from .backends import invalidate_user_snapshots
+from .outline import invalidate_outline, invalidate_outlines
+
+
+def _deleted_with(origin, *models):
+    # whether a delete started at one of ``models``: a row it cascades to
+    # goes along with its parent, whose own handler covers it in one go
+    if origin is None:
+        return False
+    return issubclass(origin.model if isinstance(origin, QuerySet) else type(origin), models)
+
+
+def _refresh_course(course_id):
+    invalidate_outline(course_id)
+    if Course.objects.filter(pk=course_id).exists():
+        search.get_backend().index_course(course_id)
+    else:
+        search.get_backend().remove_course(course_id)
+
+
+def _refresh_module_course(module_id):
+    course_id = (
+        Module.objects.filter(pk=module_id)
+                      .values_list('course_id', flat=True)
+                      .first()
+    )
+    # a missing module means its course was changed too and refreshed already
+    if course_id is not None:
+        _refresh_course(course_id)
+
+
+def _refresh_lesson_course(lesson_id):
+    course_id = (
+        Lesson.objects.filter(pk=lesson_id)
+                      .values_list('module__course_id', flat=True)
+                      .first()
+    )
+    if course_id is not None:
+        _refresh_course(course_id)
+
+
+# search index and cached outlines: refresh after commit so rolled-back
+# edits never leak in
+@receiver(post_save, sender=Course)
+@receiver(post_delete, sender=Course)
+def course_changed(sender, instance, **kwargs):
+    course_id = instance.pk  # cleared on the instance once a delete finishes
+    transaction.on_commit(lambda: _refresh_course(course_id))
+
+
+@receiver(post_save, sender=Module)
+@receiver(post_delete, sender=Module)
+def module_changed(sender, instance, origin=None, **kwargs):
+    if not _deleted_with(origin, Course):
+        transaction.on_commit(lambda: _refresh_course(instance.course_id))
+
+
+@receiver(post_save, sender=Lesson)
+@receiver(post_delete, sender=Lesson)
+def lesson_changed(sender, instance, origin=None, **kwargs):
+    if not _deleted_with(origin, Module, Course):
+        transaction.on_commit(lambda: _refresh_module_course(instance.module_id))
+
+
+@receiver(post_save, sender=Quiz)
+@receiver(post_delete, sender=Quiz)
+def quiz_changed(sender, instance, origin=None, **kwargs):
+    if not _deleted_with(origin, Lesson, Module, Course):
+        transaction.on_commit(lambda: _refresh_lesson_course(instance.lesson_id))
+
+
+@receiver(post_save, sender=CustomUser)
+def instructor_changed(sender, instance, created, update_fields=None, **kwargs):
+    # outlines carry the instructor's name
+    if created or (update_fields is not None and 'first_name' not in update_fields):
+        return
+    course_ids = list(instance.courses_taught.values_list('id', flat=True))
+    if course_ids:
+        transaction.on_commit(lambda: invalidate_outlines(course_ids))
+
+
+@receiver(post_delete, sender=CustomUser)
+def user_deleted(sender, instance, **kwargs):
+    invalidate_user_snapshots([instance.pk])
+
+
+# answer keys: move the quiz to a new key version in the same transaction
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+def question_changed(sender, instance, origin=None, **kwargs):
+    if _deleted_with(origin, Quiz, Lesson, Module, Course):
+        return
+    Quiz.objects.filter(pk=instance.quiz_id).update(key_version=F('key_version') + 1)
+
+
+@receiver(post_save, sender=Choice)
+@receiver(post_delete, sender=Choice)
+def choice_changed(sender, instance, origin=None, **kwargs):
+    if _deleted_with(origin, Question, Quiz, Lesson, Module, Course):
+        return
+    Quiz.objects.filter(questions__id=instance.question_id).update(key_version=F('key_version') + 1)
+
+
+# enrollment counters: kept in step inside the same transaction
+@receiver(post_save, sender=Lesson)
+def lesson_added(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.lesson_added(instance.module.course_id)
+
+
+@receiver(pre_delete, sender=Lesson)
+def lesson_removed(sender, instance, origin=None, **kwargs):
+    if _deleted_with(origin, Module, Course):
+        return
+    course_id = (
+        Module.objects.filter(pk=instance.module_id)
+                      .values_list('course_id', flat=True)
+                      .first()
+    )
+    if course_id is not None:
+        counters.lesson_removed(instance, course_id)
+
+
+@receiver(pre_delete, sender=Module)
+def module_removed(sender, instance, origin=None, **kwargs):
+    # its lessons, their progress and quiz attempts: recount the course
+    if _deleted_with(origin, Course):
+        return
+    student_ids = list(Enrollment.objects.filter(course_id=instance.course_id)
+                                         .values_list('student_id', flat=True))
+    counters.rows_deleted([instance.course_id], student_ids)
+
+
+# attempts deleted along with their quiz (or its lesson)
+@receiver(pre_delete, sender=Quiz)
+def quiz_removed(sender, instance, origin=None, **kwargs):
+    if _deleted_with(origin, Module, Course):
+        return
+    course_id = (
+        Lesson.objects.filter(pk=instance.lesson_id)
+                      .values_list('module__course_id', flat=True)
+                      .first()
+    )
+    student_ids = list(QuizSubmission.objects.filter(quiz=instance).values_list('student_id', flat=True))
+    if course_id is not None and student_ids:
+        counters.rows_deleted([course_id], student_ids)
+
+
+# a deleted user takes their enrollments and attempts out of the rollups
+@receiver(pre_delete, sender=CustomUser)
+def user_removed(sender, instance, **kwargs):
+    course_ids = {
+        *Enrollment.objects.filter(student=instance).values_list('course_id', flat=True),
+        *QuizSubmission.objects.filter(student=instance)
+                               .values_list('quiz__lesson__module__course_id', flat=True),
+    }
+    if course_ids:
+        counters.rows_deleted(course_ids)
+
+
+# discussion counters
+@receiver(post_save, sender=Comment)
+def comment_added(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.comment_added(instance.thread_id, instance.created_at)
+        transaction.on_commit(lambda: pubsub.publish_comment(instance))
+
+
+@receiver(post_delete, sender=Comment)
+def comment_removed(sender, instance, origin=None, **kwargs):
+    if _deleted_with(origin, DiscussionThread, Lesson, Module, Course):
+        return
+    counters.comment_removed(instance.thread_id)
@@ -1,3 +1,1341 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import importlib
+import io
+import json
+import os
+import tempfile
+import time
+from collections import namedtuple
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.apps import apps as django_apps
+from django.contrib.auth import HASH_SESSION_KEY
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.signals import user_login_failed
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.test import AsyncClient, Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from . import backends, counters, course_io, exports, hashing, metrics, grading, ordering, progress, query_plans, rendering, search, urls, utils, views
+from .models import (
+    Choice, ChoiceStats, Comment, Course, CourseStats, CustomUser, DiscussionThread, Enrollment,
+    Lesson, Module, Progress, Question, QuestionStats, Quiz, QuizSubmission,
+)
+from .outline import get_outline
+
+# seed_data options per data size; 'threads' and 'comments' are added on
+# top. Both sizes stay under one insert batch, so cloning a course takes
+# the same number of statements at either size.
+SCALES = {
+    'small': dict(students=4, instructors=1, courses=2, modules=2, lessons=2,
+                  questions=2, choices=3, enrollments=4, threads=1, comments=3),
+    'large': dict(students=30, instructors=2, courses=8, modules=3, lessons=4,
+                  questions=5, choices=4, enrollments=120, threads=25, comments=80),
+}
+
+
+def seed(scale, threads, comments, **options):
+    call_command('seed_data', prefix=scale, quiz_share=1.0, seed=1,
+                 stdout=io.StringIO(), **options)
+    student = CustomUser.objects.get(email=f'{scale}-student-0@example.com')
+    course = (
+        Course.objects.filter(enrollments__student=student)
+                      .select_related('instructor').order_by('id').first()
+    )
+    quiz = (
+        Quiz.objects.filter(lesson__module__course=course)
+                    .select_related('lesson__module').order_by('id').first()
+    )
+    lesson = quiz.lesson
+    bare_lesson = Lesson.objects.create(module=lesson.module, title='No quiz yet', sort_order=999)
+
+    created = DiscussionThread.objects.bulk_create([
+        DiscussionThread(lesson=lesson, created_by=student, title=f'Thread {n}')
+        for n in range(threads)
+    ])
+    thread = created[-1]
+    Comment.objects.bulk_create([
+        Comment(thread=thread, user=student, body=f'Comment {n}') for n in range(comments)
+    ])
+    counters.recount_threads(created)
+
+    return SimpleNamespace(
+        student=student,
+        instructor=course.instructor,
+        course=course,
+        other_course=(
+            Course.objects.filter(instructor__email__startswith=f'{scale}-')
+                          .exclude(enrollments__student=student).order_by('id').first()
+        ),
+        module=lesson.module,
+        lesson=lesson,
+        bare_lesson=bare_lesson,
+        quiz=quiz,
+        question=quiz.questions.order_by('id').first(),
+        thread=thread,
+    )
+
+
+def _answers(f):
+    return {
+        f'question_{question.id}': str(question.choices.order_by('id').first().id)
+        for question in f.quiz.questions.all()
+    }
+
+
+def _json(data):
+    return {'data': json.dumps(data), 'content_type': 'application/json'}
+
+
+def _question_post(f, question=None):
+    # the question form plus its choice formset, editing the first two
+    # choices of ``question`` if given (each submitted choice costs a query)
+    choices = list(question.choices.order_by('id')[:2]) if question else []
+    data = {
+        'text': 'Which one?', 'question_type': Question.SINGLE,
+        'choices-TOTAL_FORMS': max(len(choices), 2), 'choices-INITIAL_FORMS': len(choices),
+        'choices-MIN_NUM_FORMS': 0, 'choices-MAX_NUM_FORMS': 1000,
+    }
+    for n in range(data['choices-TOTAL_FORMS']):
+        if n < len(choices):
+            # only the first one changes
+            choice = choices[n]
+            data.update({f'choices-{n}-id': choice.id, f'choices-{n}-question': question.id,
+                         f'choices-{n}-text': 'Changed' if n == 0 else choice.text})
+            if choice.is_correct:
+                data[f'choices-{n}-is_correct'] = 'on'
+        else:
+            data[f'choices-{n}-text'] = f'Choice {n}'
+            if n == 0:
+                data[f'choices-{n}-is_correct'] = 'on'
+    return data
+
+
+Case = namedtuple('Case', 'name role method args data status batched',
+                  defaults=((), None, None, False))
+
+SIGNUP = {'first_name': 'New', 'last_name': 'Person', 'email': 'new-person@example.com',
+          'address': 'Main Street 1', 'password': 'password1', 'confirm_pw': 'password1'}
+COURSE = {'title': 'Renamed', 'description': 'About', 'difficulty': Course.BEGINNER}
+LESSON = {'title': 'Renamed', 'content_type': Lesson.TEXT, 'body': 'Read this.', 'sort_order': 1}
+
+# every route of the app and each method it budgets, requested as the user
+# who would normally use it; 'status' is the response a successful POST
+# gives. A 'batched' delete cascades through rows that Django collects and
+# deletes 100 at a time, so it may run a few more queries on the large data
+# set, still within budget.
+CASES = [
+    Case('signup', None, 'get'),
+    Case('signup', None, 'post', data=lambda f: SIGNUP, status=302),
+    Case('login', None, 'get'),
+    Case('login', None, 'post', data=lambda f: {'email': f.student.email, 'password': 'seed-password'},
+         status=302),
+    Case('logout', 'student', 'get'),
+    Case('home', 'student', 'get'),
+    Case('home', 'instructor', 'get'),
+    Case('about', 'student', 'get'),
+    Case('metrics', None, 'get'),
+    Case('course_list', 'student', 'get'),
+    Case('course_list', 'student', 'get', data=lambda f: {'q': 'guide'}),
+    Case('course_search', 'student', 'get', data=lambda f: {'q': 'guide'}),
+    Case('course_detail', 'student', 'get', lambda f: [f.course.id]),
+    Case('course_detail', 'instructor', 'get', lambda f: [f.course.id]),
+    Case('course_create', 'instructor', 'get'),
+    Case('course_create', 'instructor', 'post', data=lambda f: COURSE, status=302),
+    Case('course_update', 'instructor', 'get', lambda f: [f.course.id]),
+    Case('course_update', 'instructor', 'post', lambda f: [f.course.id], lambda f: COURSE, 302),
+    Case('course_delete', 'instructor', 'post', lambda f: [f.course.id], status=302, batched=True),
+    Case('course_duplicate', 'instructor', 'post', lambda f: [f.course.id], status=302),
+    Case('course_stats', 'instructor', 'get', lambda f: [f.course.id]),
+    Case('course_export', 'instructor', 'get', lambda f: [f.course.id, 'enrollments']),
+    Case('course_export', 'instructor', 'get', lambda f: [f.course.id, 'quiz-submissions']),
+    Case('module_create', 'instructor', 'get', lambda f: [f.course.id]),
+    Case('module_create', 'instructor', 'post', lambda f: [f.course.id],
+         lambda f: {'title': 'New module', 'sort_order': 99}, 302),
+    Case('module_edit', 'instructor', 'get', lambda f: [f.course.id, f.module.id]),
+    Case('module_edit', 'instructor', 'post', lambda f: [f.course.id, f.module.id],
+         lambda f: {'title': 'Renamed', 'sort_order': 1}, 302),
+    Case('module_delete', 'instructor', 'post', lambda f: [f.course.id, f.module.id], status=302),
+    Case('module_reorder', 'instructor', 'post', lambda f: [f.course.id],
+         lambda f: _json({'order': list(f.course.modules.order_by('-sort_order', '-id')
+                                                       .values_list('id', flat=True))})),
+    Case('module_detail', 'student', 'get', lambda f: [f.module.id]),
+    Case('lesson_detail', 'student', 'get', lambda f: [f.lesson.id]),
+    Case('lesson_create', 'instructor', 'get', lambda f: [f.module.id]),
+    Case('lesson_create', 'instructor', 'post', lambda f: [f.module.id], lambda f: LESSON, 302),
+    Case('lesson_edit', 'instructor', 'get', lambda f: [f.lesson.id]),
+    Case('lesson_edit', 'instructor', 'post', lambda f: [f.lesson.id], lambda f: LESSON, 302),
+    Case('lesson_delete', 'instructor', 'post', lambda f: [f.lesson.id], status=302),
+    Case('lesson_progress', 'student', 'post', lambda f: [f.lesson.id],
+         lambda f: {'event': 'completed'}),
+    Case('lesson_reorder', 'instructor', 'post', lambda f: [f.module.id],
+         lambda f: _json({'order': list(f.module.lessons.order_by('-sort_order', '-id')
+                                                       .values_list('id', flat=True))})),
+    Case('lesson_threads', 'student', 'get', lambda f: [f.lesson.id]),
+    Case('lesson_threads', 'student', 'post', lambda f: [f.lesson.id],
+         lambda f: {'title': 'A question', 'body': 'How does this work?'}, 302),
+    Case('quiz_create', 'instructor', 'get', lambda f: [f.bare_lesson.id]),
+    Case('quiz_create', 'instructor', 'post', lambda f: [f.bare_lesson.id],
+         lambda f: {'title': 'New quiz'}, 302),
+    Case('quiz_edit', 'instructor', 'get', lambda f: [f.quiz.id]),
+    Case('quiz_edit', 'instructor', 'post', lambda f: [f.quiz.id], lambda f: {'title': 'Renamed'}, 302),
+    Case('quiz_delete', 'instructor', 'post', lambda f: [f.quiz.id], status=302),
+    Case('quiz_detail', 'student', 'get', lambda f: [f.quiz.id]),
+    Case('quiz_detail', 'instructor', 'get', lambda f: [f.quiz.id]),
+    Case('quiz_detail', 'student', 'post', lambda f: [f.quiz.id], _answers),
+    Case('quiz_stats', 'instructor', 'get', lambda f: [f.quiz.id]),
+    Case('question_create', 'instructor', 'get', lambda f: [f.quiz.id]),
+    Case('question_create', 'instructor', 'post', lambda f: [f.quiz.id], _question_post, 302),
+    Case('question_edit', 'instructor', 'get', lambda f: [f.question.id]),
+    Case('question_edit', 'instructor', 'post', lambda f: [f.question.id],
+         lambda f: _question_post(f, f.question), 302),
+    Case('question_delete', 'instructor', 'post', lambda f: [f.question.id], status=302),
+    Case('enroll_course', 'student', 'post', lambda f: [f.other_course.id]),
+    Case('drop_course', 'student', 'post', lambda f: [f.course.id]),
+    Case('thread_detail', 'student', 'get', lambda f: [f.thread.id]),
+    Case('thread_detail', 'student', 'get', lambda f: [f.thread.id], lambda f: {'last': '1'}),
+    Case('thread_detail', 'student', 'post', lambda f: [f.thread.id], lambda f: {'body': 'Me too'}, 302),
+    Case('thread_events', 'student', 'get', lambda f: [f.thread.id]),
+]
+
+
+def _budgets(patterns=urls.urlpatterns):
+    return {pattern.name: getattr(pattern.callback, 'query_budget', None)
+            for pattern in patterns}
+
+
+# the test client of each handler, and the routes it serves
+HANDLERS = {
+    'wsgi': (Client, urls.urlpatterns),
+    'asgi': (AsyncClient, urls.asgi_urlpatterns),
+}
+
+
+@override_settings(PROGRESS_FLUSH_INTERVAL=0)
+class QueryBudgetTests(TestCase):
+    """
+    Each view runs at most its @query_budget of queries, and no more on the
+    large data set than on the small one.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.fixtures = {scale: seed(scale, **options) for scale, options in SCALES.items()}
+        search.get_backend().rebuild()
+
+    def setUp(self):
+        cache.clear()
+
+    def request(self, case, f, handler='wsgi'):
+        client = HANDLERS[handler][0]()
+        if case.role:
+            client.force_login(getattr(f, case.role))
+        url = reverse(case.name, args=case.args(f) if case.args else ())
+        data = case.data(f) if case.data else {}
+        kwargs = data if 'content_type' in data and 'data' in data else {'data': data}
+        send = getattr(client, case.method)
+        if handler == 'asgi':
+            send = async_to_sync(send)
+
+        # start cold and leave nothing behind for the next request
+        cache.clear()
+        with transaction.atomic():
+            with CaptureQueriesContext(connection) as queries:
+                response = send(url, **kwargs)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+            transaction.set_rollback(True)
+        return response, [query['sql'] for query in queries.captured_queries]
+
+    def test_every_route_declares_a_budget(self):
+        for handler, (_, patterns) in HANDLERS.items():
+            missing = sorted(name for name, budget in _budgets(patterns).items() if not budget)
+            self.assertEqual(missing, [], f"{handler} views without a @query_budget")
+
+    def test_every_budget_has_a_case(self):
+        budgeted = {(name, method) for name, budget in _budgets().items() for method in budget or ()}
+        cases = {(case.name, case.method.upper()) for case in CASES}
+        self.assertEqual(sorted(budgeted - cases), [], "Budgets missing from CASES")
+        self.assertEqual(sorted(cases - budgeted), [], "CASES without a budget")
+
+    def test_query_counts_stay_within_budget(self):
+        for handler in HANDLERS:
+            self.check_budgets(handler)
+
+    def check_budgets(self, handler):
+        # under ASGI only the routes with an async twin run different code
+        patterns = HANDLERS[handler][1]
+        twinned = {p.name for p in urls.asgi_urlpatterns if p.callback in urls.ASYNC_VIEWS.values()}
+        budgets = _budgets(patterns)
+        for case in CASES:
+            if handler == 'asgi' and case.name not in twinned:
+                continue
+            label = f"{handler} {case.method.upper()} {case.name} as {case.role or 'anonymous'}"
+            if case.data:
+                label += f" {case.data(self.fixtures['small'])}"[:80]
+            with self.subTest(label):
+                counts = {}
+                for scale, f in self.fixtures.items():
+                    response, queries = self.request(case, f, handler)
+                    self.assertLess(response.status_code, 500, label)
+                    if case.status:
+                        self.assertEqual(response.status_code, case.status, label)
+                    counts[scale] = queries
+                small, large = counts['small'], counts['large']
+                budget = budgets[case.name][case.method.upper()]
+                if len(large) > budget or (len(large) > len(small) and not case.batched):
+                    listing = '\n'.join(f"  {n}. {sql}" for n, sql in enumerate(large, 1))
+                    self.fail(
+                        f"{label}: {len(small)} queries on the small data set, "
+                        f"{len(large)} on the large one, budget {budget}.\n"
+                        f"Queries on the large data set:\n{listing}"
+                    )
+
+
+class HandlerRoutingTests(TestCase):
+    def setUp(self):
+        self.student = make_user('s@example.com')
+
+    def test_each_handler_runs_its_own_views(self):
+        client, async_client = Client(), AsyncClient()
+        client.force_login(self.student)
+        async_client.force_login(self.student)
+        url = reverse('course_list')
+        self.assertIs(client.get(url).resolver_match.func, views.course_list)
+        self.assertIs(async_to_sync(async_client.get)(url).resolver_match.func, views.acourse_list)
+
+    def test_async_twins_keep_the_routes(self):
+        sync_routes = [(str(p.pattern), p.name) for p in urls.urlpatterns]
+        self.assertEqual([(str(p.pattern), p.name) for p in urls.asgi_urlpatterns], sync_routes)
+        for view in urls.ASYNC_VIEWS.values():
+            self.assertTrue(asyncio.iscoroutinefunction(view), view)
+        for view in urls.ASYNC_VIEWS:
+            self.assertFalse(asyncio.iscoroutinefunction(view), view)
+
+
+class QueryPlanTests(TestCase):
+    def test_hot_queries_use_an_index(self):
+        out = io.StringIO()
+        call_command('check_query_plans', stdout=out)
+        self.assertIn(f"All {len(query_plans.HOT_QUERIES)} hot queries use an index.", out.getvalue())
+
+    def test_unindexed_filter_is_a_full_scan(self):
+        plan = query_plans.explain(Course.objects.filter(topic='Music'))
+        self.assertEqual(query_plans.full_scans(plan), [Course._meta.db_table])
+
+
+def make_user(email, role=CustomUser.STUDENT, **extra):
+    extra.setdefault('is_approved', True)
+    return CustomUser.objects.create_user(email=email, password='pw', role=role,
+                                          first_name=email.split('@')[0], **extra)
+
+
+class CourseCardVersionTests(TestCase):
+    def test_concurrent_saves_get_distinct_versions(self):
+        instructor = make_user('teacher@example.com', CustomUser.INSTRUCTOR)
+        course = Course.objects.create(title='Course', instructor=instructor)
+        self.assertEqual(course.card_version, 1)
+
+        # two requests loaded the same row before either saved
+        first, second = Course.objects.get(pk=course.pk), Course.objects.get(pk=course.pk)
+        first.title = 'First'
+        first.save()
+        second.save(update_fields=['title'])
+
+        self.assertEqual((first.card_version, second.card_version), (2, 3))
+        course.refresh_from_db()
+        self.assertEqual(course.card_version, 3)
+
+
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.instructor = make_user('teacher@example.com', CustomUser.INSTRUCTOR)
+        self.student = make_user('student@example.com')
+        self.courses = [Course.objects.create(title=f'Course {n}', instructor=self.instructor)
+                        for n in range(3)]
+        self.module = Module.objects.create(course=self.courses[0], title='Module')
+        self.lesson = Lesson.objects.create(module=self.module, title='Lesson')
+
+    def catalog(self):
+        client = Client()
+        client.force_login(self.student)
+        return client.get(reverse('course_list')).content.decode()
+
+    def test_enrollment_badges(self):
+        Enrollment.objects.create(student=self.student, course=self.courses[0])
+        Enrollment.objects.create(student=self.student, course=self.courses[1], status=Enrollment.DROPPED)
+        Enrollment.objects.create(student=make_user('other@example.com'), course=self.courses[2])
+
+        statuses = dict(Course.objects.with_enrollment_status(self.student)
+                                      .values_list('title', 'enrollment_status'))
+        self.assertEqual(statuses, {'Course 0': Enrollment.IN_PROGRESS, 'Course 1': Enrollment.DROPPED,
+                                    'Course 2': None})
+        page = self.catalog()
+        self.assertEqual(page.count('badge bg-success">Enrolled'), 1)
+        self.assertEqual(page.count('badge bg-secondary">Dropped'), 1)
+        self.assertEqual(page.count('Re-enroll'), 1)
+
+    def test_cards_follow_course_and_instructor_changes(self):
+        self.assertIn('Course 0', self.catalog())
+        course = self.courses[0]
+        course.title = 'Renamed course'
+        course.save()
+        self.assertIn('Renamed course', self.catalog())
+
+        self.instructor.first_name = 'Ada'
+        self.instructor.save()
+        self.assertEqual(self.catalog().count('Ada'), 3)
+
+    def test_outlines_follow_course_module_lesson_and_instructor_changes(self):
+        def outline():
+            built = get_outline(self.courses[0].id)
+            return (built.title, built.instructor_name,
+                    [(m.title, [lesson.title for lesson in m.lessons]) for m in built.modules])
+
+        self.assertEqual(outline(), ('Course 0', 'teacher', [('Module', ['Lesson'])]))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.courses[0].title = 'Renamed course'
+            self.courses[0].save()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.module.title = 'Renamed module'
+            self.module.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.lesson.title = 'Renamed lesson'
+            self.lesson.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            Lesson.objects.create(module=self.module, title='Added', sort_order=1)
+        self.assertEqual(outline(), ('Renamed course', 'teacher',
+                                     [('Renamed module', ['Renamed lesson', 'Added'])]))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.instructor.first_name = 'Ada'
+            self.instructor.save(update_fields=['first_name'])
+        self.assertEqual(outline()[1], 'Ada')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.lesson.delete()
+        self.assertEqual(outline(), ('Renamed course', 'Ada', [('Renamed module', ['Added'])]))
+
+        # an update that leaves the name alone keeps the cached outline
+        with mock.patch('pal_learning_app.signals.invalidate_outlines') as invalidate:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.instructor.save(update_fields=['last_login'])
+        invalidate.assert_not_called()
+
+
+def make_quiz(instructor, questions=2, choices=3):
+    # the first choice of each question is the correct one
+    course = Course.objects.create(title='Course', instructor=instructor)
+    module = Module.objects.create(course=course, title='Module')
+    lesson = Lesson.objects.create(module=module, title='Lesson')
+    quiz = Quiz.objects.create(lesson=lesson, title='Quiz')
+    for n in range(questions):
+        question = Question.objects.create(quiz=quiz, text=f'Question {n}')
+        for c in range(choices):
+            Choice.objects.create(question=question, text=f'Choice {c}', is_correct=c == 0)
+    return quiz
+
+
+def pick(quiz, *positions):
+    # the POST data choosing the choice at ``positions[n]`` of question n
+    return {
+        f'question_{question.id}': str(question.choices.order_by('id')[position].id)
+        for question, position in zip(quiz.questions.order_by('id'), positions)
+    }
+
+
+def scores(quiz):
+    return dict(QuizSubmission.objects.filter(quiz=quiz).values_list('student__email', 'score'))
+
+
+def item_stats(quiz):
+    questions = {
+        question_id: (attempts, correct)
+        for question_id, attempts, correct in
+        QuestionStats.objects.filter(question__quiz=quiz)
+                             .values_list('question_id', 'attempts', 'correct')
+    }
+    picks = dict(ChoiceStats.objects.filter(choice__question__quiz=quiz, picks__gt=0)
+                                    .values_list('choice_id', 'picks'))
+    return questions, picks
+
+
+@override_settings(REGRADE_IN_BACKGROUND=False)
+class RegradeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.instructor = make_user('teacher@example.com', CustomUser.INSTRUCTOR)
+        self.quiz = make_quiz(self.instructor)
+        self.students = [make_user(f'student{n}@example.com') for n in range(2)]
+
+    def submit(self, student, *positions):
+        client = Client()
+        client.force_login(student)
+        response = client.post(reverse('quiz_detail', args=[self.quiz.id]), pick(self.quiz, *positions))
+        self.assertEqual(response.status_code, 200)
+
+    def make_second_choice_correct(self):
+        question = self.quiz.questions.order_by('id').first()
+        first, second = question.choices.order_by('id')[:2]
+        first.is_correct, second.is_correct = False, True
+        Choice.objects.bulk_update([first, second], ['is_correct'])
+
+    def test_regrade_rescores_against_the_new_key(self):
+        self.submit(self.students[0], 0, 0)
+        self.submit(self.students[1], 1, 0)
+        self.make_second_choice_correct()
+
+        self.assertEqual(grading.regrade_quiz(self.quiz), 2)
+        self.assertEqual(scores(self.quiz), {'student0@example.com': Decimal('50.00'),
+                                             'student1@example.com': Decimal('100.00')})
+        first_question = self.quiz.questions.order_by('id').first().id
+        questions, _ = item_stats(self.quiz)
+        self.assertEqual(questions[first_question], (2, 1))
+
+    def test_retake_during_a_regrade_keeps_its_own_score(self):
+        self.submit(self.students[0], 0, 0)
+        self.submit(self.students[1], 0, 0)
+        self.make_second_choice_correct()
+
+        # student1 retakes (both answers right under the new key) while the
+        # regrade works on student0's chunk
+        def retake(*args):
+            if not retaken:
+                retaken.append(True)
+                self.submit(self.students[1], 1, 0)
+            return original(*args)
+        retaken, original = [], grading.grade
+        with mock.patch.object(grading, 'REGRADE_BATCH_SIZE', 1), \
+                mock.patch.object(grading, 'grade', side_effect=retake):
+            grading.regrade_quiz(self.quiz)
+
+        self.assertEqual(scores(self.quiz)['student1@example.com'], Decimal('100.00'))
+        during = item_stats(self.quiz)
+        grading.rebuild_item_stats(self.quiz)
+        self.assertEqual(item_stats(self.quiz), during)
+
+    def test_counters_are_reconciled_once_per_regrade(self):
+        self.submit(self.students[0], 0, 0)
+        self.submit(self.students[1], 0, 0)
+        self.make_second_choice_correct()
+        with mock.patch.object(grading, 'REGRADE_BATCH_SIZE', 1), \
+                mock.patch.object(counters, 'quiz_regraded') as quiz_regraded:
+            self.assertEqual(grading.regrade_quiz(self.quiz), 2)
+        quiz_regraded.assert_called_once_with(self.quiz.lesson.module.course_id,
+                                              {student.id for student in self.students})
+
+    def test_rebuild_keeps_rows_and_matches_incremental_stats(self):
+        self.submit(self.students[0], 0, 1)
+        self.submit(self.students[1], 1, 1)
+        self.submit(self.students[0], 0, 0)  # retake
+        incremental = item_stats(self.quiz)
+        rows = set(QuestionStats.objects.values_list('pk', flat=True))
+
+        grading.rebuild_item_stats(self.quiz)
+        self.assertEqual(item_stats(self.quiz), incremental)
+        self.assertEqual(set(QuestionStats.objects.values_list('pk', flat=True)), rows)
+
+    def test_adding_a_question_regrades(self):
+        self.submit(self.students[0], 0, 0)
+        client = Client()
+        client.force_login(self.instructor)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.post(reverse('question_create', args=[self.quiz.id]), {
+                'text': 'Question 2', 'question_type': Question.SINGLE,
+                'choices-TOTAL_FORMS': '2', 'choices-INITIAL_FORMS': '0',
+                'choices-MIN_NUM_FORMS': '0', 'choices-MAX_NUM_FORMS': '1000',
+                'choices-0-text': 'Yes', 'choices-0-is_correct': 'on',
+                'choices-1-text': 'No',
+            })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(scores(self.quiz)['student0@example.com'], Decimal('66.67'))
+
+    def test_upserts_name_no_conflict_target_where_the_backend_refuses_one(self):
+        self.assertEqual(utils.conflict_target('student', 'quiz'), ['student', 'quiz'])
+        with mock.patch.object(connection.features, 'supports_update_conflicts_with_target', False), \
+                mock.patch.object(QuizSubmission.objects, 'bulk_create') as bulk_create:
+            grading.save_submission(self.students[0], self.quiz, Decimal('100.00'), {}, [])
+        self.assertIsNone(bulk_create.call_args.kwargs['unique_fields'])
+        self.assertTrue(bulk_create.call_args.kwargs['update_conflicts'])
+
+
+class ItemStatsRetakeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.instructor = make_user('teacher@example.com', CustomUser.INSTRUCTOR)
+        self.quiz = make_quiz(self.instructor, questions=1)
+        self.question = self.quiz.questions.get()
+        self.student = make_user('student@example.com')
+
+    def submit(self, position):
+        client = Client()
+        client.force_login(self.student)
+        response = client.post(reverse('quiz_detail', args=[self.quiz.id]), pick(self.quiz, position))
+        self.assertEqual(response.status_code, 200)
+
+    def move_key_to(self, position):
+        # an edit whose regrade has not run yet
+        for n, choice in enumerate(self.question.choices.order_by('id')):
+            choice.is_correct = n == position
+            choice.save()
+
+    def stats(self):
+        return item_stats(self.quiz)[0][self.question.id]
+
+    def test_retake_after_a_key_change_takes_back_what_was_counted(self):
+        self.submit(1)
+        self.assertEqual(self.stats(), (1, 0))
+        self.move_key_to(1)  # the first attempt is right now, but was counted wrong
+        self.submit(0)
+        self.assertEqual(self.stats(), (1, 0))
+        self.submit(1)
+        self.assertEqual(self.stats(), (1, 1))
+
+    def test_older_attempts_without_stored_correctness_never_go_below_zero(self):
+        self.submit(1)
+        QuizSubmission.objects.update(correct=None)
+        self.move_key_to(1)
+        self.submit(0)
+        self.assertEqual(self.stats(), (1, 0))
+
+    def test_rebuild_stores_what_it_counted(self):
+        self.submit(1)
+        self.move_key_to(1)
+        grading.rebuild_item_stats(self.quiz)
+        self.assertEqual(self.stats(), (1, 1))
+        self.assertEqual(grading.decode_choices(QuizSubmission.objects.get().correct), {self.question.id})
+        self.submit(0)
+        self.assertEqual(self.stats(), (1, 0))
+
+
+@override_settings(PROGRESS_FLUSH_INTERVAL=60)
+class ProgressFlushTests(TestCase):
+    def setUp(self):
+        progress._pending.clear()
+        self.addCleanup(progress._pending.clear)
+        patcher = mock.patch.object(progress, '_start_flusher')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        quiz = make_quiz(make_user('teacher@example.com', CustomUser.INSTRUCTOR), questions=0)
+        self.lesson = quiz.lesson
+        self.students = [make_user(f'student{n}@example.com') for n in range(2)]
+        for student in self.students:
+            Enrollment.objects.create(student=student, course=self.lesson.module.course)
+
+    def completed_lessons(self):
+        return dict(Enrollment.objects.values_list('student__email', 'completed_lessons'))
+
+    def test_heartbeats_coalesce_and_completions_count_once(self):
+        student = self.students[0]
+        progress.record(student.id, self.lesson.id)
+        progress.record(student.id, self.lesson.id, completed=True)
+        progress.record(student.id, self.lesson.id)
+        self.assertEqual(progress.flush(), 1)
+
+        row = Progress.objects.get()
+        self.assertIsNotNone(row.completed_at)
+        progress.record(student.id, self.lesson.id, completed=True)
+        progress.flush()
+        self.assertEqual(self.completed_lessons(),
+                         {'student0@example.com': 1, 'student1@example.com': 0})
+
+    def test_events_of_deleted_students_and_lessons_are_dropped(self):
+        progress.record(self.students[0].id, self.lesson.id, completed=True)
+        progress.record(self.students[1].id + 1000, self.lesson.id, completed=True)
+        progress.record(self.students[0].id, self.lesson.id + 1000)
+        self.assertEqual(progress.flush(), 1)
+        self.assertEqual(progress._pending, {})
+
+    def test_a_failing_row_is_dropped_and_the_others_written(self):
+        bad = self.students[1].id
+
+        def lessons_completed(counts):
+            if any(student_id == bad for student_id, _ in counts):
+                raise IntegrityError("constraint failed")
+            original(counts)
+        original = counters.lessons_completed
+        for student in self.students:
+            progress.record(student.id, self.lesson.id, completed=True)
+        with mock.patch.object(counters, 'lessons_completed', side_effect=lessons_completed):
+            self.assertEqual(progress.flush(), 1)
+
+        self.assertEqual(list(Progress.objects.values_list('student_id', flat=True)), [self.students[0].id])
+        self.assertEqual(progress._pending, {})
+        self.assertEqual(progress.flush(), 0)
+
+    def test_other_errors_keep_the_events_for_the_next_flush(self):
+        progress.record(self.students[0].id, self.lesson.id, completed=True)
+        with mock.patch.object(progress, '_write', side_effect=OperationalError("database is locked")):
+            with self.assertRaises(OperationalError):
+                progress.flush()
+        self.assertEqual(list(progress._pending), [(self.students[0].id, self.lesson.id)])
+        self.assertEqual(progress.flush(), 1)
+
+    def test_a_later_completion_keeps_the_first_completion_time(self):
+        student = self.students[0]
+        progress.record(student.id, self.lesson.id, completed=True)
+        progress.flush()
+        first = Progress.objects.get().completed_at
+        progress.record(student.id, self.lesson.id, completed=True)
+        progress.flush()
+        self.assertEqual(Progress.objects.get().completed_at, first)
+
+    def test_heartbeats_need_an_existing_lesson_and_an_enrollment(self):
+        client = Client()
+        client.force_login(self.students[0])
+        response = client.post(reverse('lesson_progress', args=[self.lesson.id + 1000]), {'event': 'started'})
+        self.assertEqual(response.status_code, 404)
+
+        Enrollment.objects.filter(student=self.students[0]).update(status=Enrollment.DROPPED)
+        outsider = make_user('outsider@example.com')
+        for student in [self.students[0], outsider]:
+            client.force_login(student)
+            response = client.post(reverse('lesson_progress', args=[self.lesson.id]), {'event': 'started'})
+            self.assertEqual(response.status_code, 403)
+        self.assertEqual(progress._pending, {})
+
+        client.force_login(self.students[1])
+        response = client.post(reverse('lesson_progress', args=[self.lesson.id]), {'event': 'started'})
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(list(progress._pending), [(self.students[1].id, self.lesson.id)])
+
+
+class CascadeCounterTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.quiz = make_quiz(make_user('teacher@example.com', CustomUser.INSTRUCTOR), questions=1)
+        self.course = self.quiz.lesson.module.course
+        self.students = [make_user(f'student{n}@example.com') for n in range(2)]
+        for student in self.students:
+            client = Client()
+            client.force_login(student)
+            client.post(reverse('enroll_course', args=[self.course.id]))
+            client.post(reverse('quiz_detail', args=[self.quiz.id]), pick(self.quiz, 0))
+
+    def counters(self):
+        stats = CourseStats.objects.get(course=self.course)
+        return (
+            sorted(Enrollment.objects.values_list('quizzes_taken', 'quiz_score_total')),
+            (stats.in_progress, stats.quiz_submissions, stats.quiz_score_total),
+        )
+
+    def test_setup(self):
+        self.assertEqual(self.counters(), ([(1, 100), (1, 100)], (2, 2, 200)))
+
+    def test_deleting_a_quiz_takes_its_attempts_off(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.quiz.delete()
+        self.assertEqual(self.counters(), ([(0, 0), (0, 0)], (2, 0, 0)))
+
+    def test_deleting_a_module_takes_its_attempts_off(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Module.objects.filter(pk=self.quiz.lesson.module_id).delete()
+        self.assertEqual(self.counters(), ([(0, 0), (0, 0)], (2, 0, 0)))
+
+    def test_deleting_a_module_recounts_lessons(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.quiz.lesson.module.delete()
+        self.assertEqual(list(Enrollment.objects.values_list('total_lessons', flat=True)), [0, 0])
+
+    def test_answer_key_moves_once_per_delete(self):
+        def version():
+            return Quiz.objects.get(pk=self.quiz.pk).key_version
+        question = self.quiz.questions.get()
+        before = version()
+        question.choices.order_by('id').last().delete()
+        self.assertEqual(version(), before + 1)
+        question.delete()  # and its two remaining choices
+        self.assertEqual(version(), before + 2)
+
+    def test_saving_a_stale_quiz_keeps_the_answer_key_version(self):
+        stale = Quiz.objects.get(pk=self.quiz.pk)
+        Choice.objects.filter(question__quiz=self.quiz).first().save()
+        moved = Quiz.objects.get(pk=self.quiz.pk).key_version
+        stale.title = 'Renamed'
+        stale.save()
+        self.assertEqual(Quiz.objects.values_list('title', 'key_version').get(pk=self.quiz.pk),
+                         ('Renamed', moved))
+
+    def test_deleting_a_comment_updates_its_thread(self):
+        thread = DiscussionThread.objects.create(lesson=self.quiz.lesson, created_by=self.students[0],
+                                                 title='Thread')
+        comments = [Comment.objects.create(thread=thread, user=self.students[0], body=str(n))
+                    for n in range(2)]
+        comments[0].delete()
+        thread.refresh_from_db()
+        self.assertEqual(thread.comment_count, 1)
+
+    def test_deleting_a_student_takes_them_off(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.students[0].delete()
+        self.assertEqual(self.counters(), ([(1, 100)], (1, 1, 100)))
+
+    def test_deleting_the_course_leaves_nothing_behind(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.course.delete()
+        self.assertFalse(CourseStats.objects.exists())
+        self.assertFalse(Enrollment.objects.exists())
+
+    def test_reconcile_stats_pages_through_every_row_by_key(self):
+        before = self.counters()
+        Enrollment.objects.update(quizzes_taken=0, quiz_score_total=0)
+        CourseStats.objects.all().delete()
+        with mock.patch.object(counters, 'RECOUNT_BATCH_SIZE', 1), \
+                CaptureQueriesContext(connection) as queries:
+            call_command('reconcile_stats', stdout=io.StringIO())
+        self.assertEqual(self.counters(), before)
+        self.assertFalse([q['sql'] for q in queries.captured_queries if 'OFFSET' in q['sql']])
+
+
+class BumpTests(TestCase):
+    def setUp(self):
+        self.course = Course.objects.create(title='Course', instructor=make_user('teacher@example.com',
+                                                                                 CustomUser.INSTRUCTOR))
+
+    def test_creates_then_adds(self):
+        counters._bump(CourseStats, {'course_id': self.course.id}, in_progress=1)
+        counters._bump(CourseStats, {'course_id': self.course.id}, in_progress=2)
+        self.assertEqual(CourseStats.objects.get().in_progress, 3)
+
+    def test_a_row_created_meanwhile_gets_the_delta(self):
+        atomic = transaction.atomic
+
+        def other_writer_first():
+            CourseStats.objects.create(course_id=self.course.id, in_progress=5)
+            return atomic()
+        with mock.patch.object(transaction, 'atomic', side_effect=other_writer_first):
+            counters._bump(CourseStats, {'course_id': self.course.id}, in_progress=1)
+        self.assertEqual(CourseStats.objects.get().in_progress, 6)
+
+    def test_a_constraint_violation_is_not_swallowed(self):
+        with self.assertRaises(IntegrityError):
+            counters._bump(CourseStats, {'course_id': self.course.id}, in_progress=-1)
+        self.assertFalse(CourseStats.objects.exists())
+
+
+class CursorTests(TestCase):
+    def test_round_trip(self):
+        token = utils.encode_cursor('m', '2025-01-01T00:00:00+00:00', 7)
+        self.assertNotIn('=', token)
+        self.assertEqual(utils.decode_cursor(token), ['m', '2025-01-01T00:00:00+00:00', 7])
+
+    def test_garbled_or_foreign_cursors_are_ignored(self):
+        for token in ['', 'not base64!', utils.encode_cursor('x'), 'e30']:  # e30 is "{}"
+            self.assertIsNone(views._keyset(token, 'm'), token)
+        self.assertIsNone(views._keyset(utils.encode_cursor('t', '2025-01-01T00:00:00', 1), 'm'))
+        self.assertIsNone(views._keyset(utils.encode_cursor('m', 'yesterday', 1), 'm'))
+        self.assertIsNone(views._keyset(utils.encode_cursor('m', '2025-01-01T00:00:00', True), 'm'))
+
+    @mock.patch.object(views, 'COMMENTS_PAGE_SIZE', 3)
+    def test_comment_pages_cover_every_comment_once_despite_ties(self):
+        student = make_user('student@example.com')
+        quiz = make_quiz(make_user('teacher@example.com', CustomUser.INSTRUCTOR), questions=0)
+        thread = DiscussionThread.objects.create(lesson=quiz.lesson, created_by=student, title='Thread')
+        comments = Comment.objects.bulk_create([Comment(thread=thread, user=student, body=str(n))
+                                                for n in range(8)])
+        # half of them share a timestamp
+        Comment.objects.filter(pk__in=[c.pk for c in comments[2:6]]).update(created_at=comments[2].created_at)
+        expected = list(Comment.objects.order_by('created_at', 'id').values_list('id', flat=True))
+
+        forward, after = [], None
+        while True:
+            page, _, newer = views._comment_page(thread, after=after)
+            forward += [c.id for c in page]
+            if not newer:
+                break
+            after = views._keyset(newer, 'm')
+        self.assertEqual(forward, expected)
+
+        backward, (page, older, _) = [], views._comment_page(thread, last=True)
+        while True:
+            backward = [c.id for c in page] + backward
+            if not older:
+                break
+            page, older, _ = views._comment_page(thread, before=views._keyset(older, 'm'))
+        self.assertEqual(backward, expected)
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        search.get_backend.cache_clear()
+        self.addCleanup(search.get_backend.cache_clear)
+        instructor = make_user('teacher@example.com', CustomUser.INSTRUCTOR)
+        self.student = make_user('student@example.com')
+
+        def course(title, **fields):
+            return Course.objects.create(title=title, instructor=instructor, **fields)
+        self.in_description = course('Snakes', description='All about python')
+        self.in_title = course('Python basics')
+        self.in_topic = course('Scripting', topic='Python')
+        self.in_module = course('Automation')
+        Module.objects.create(course=self.in_module, title='Python tricks')
+        # equal ranks, so that paging has ties to get through
+        self.ties = [course('Cooking', topic='Python') for _ in range(4)]
+        course('Gardening', description='Nothing to see')
+        search.get_backend().rebuild()
+
+    def pages(self, search_page, limit):
+        hits, after = [], None
+        while True:
+            page = search_page(limit, after)
+            hits += page
+            if len(page) < limit:
+                return hits
+            course_id, rank = page[-1]
+            after = (rank, course_id)
+
+    def test_bm25_ranks_title_over_topic_over_outline_over_description(self):
+        self.assertIsInstance(search.get_backend(), search.SQLiteFTSBackend)
+        ids = [course_id for course_id, _ in search.search_courses('python', 20)]
+        self.assertEqual(ids[0], self.in_title.id)
+        self.assertEqual(ids[-2:], [self.in_module.id, self.in_description.id])
+        self.assertEqual(sorted(ids[1:-2]), sorted(c.id for c in [self.in_topic, *self.ties]))
+
+    def test_keyset_pages_have_no_duplicates_or_gaps(self):
+        everything = search.search_courses('pyth', 20)
+        self.assertEqual(len(everything), 8)
+        for limit in (1, 2, 3):
+            paged = self.pages(lambda n, after: search.search_courses('pyth', n, after), limit)
+            self.assertEqual(paged, everything, limit)
+
+    @mock.patch.object(views, 'CATALOG_PAGE_SIZE', 3)
+    def test_the_search_feed_pages_through_every_match_once(self):
+        client = Client()
+        client.force_login(self.student)
+        seen, after = [], None
+        while True:
+            params = {'q': 'python', 'after': after} if after else {'q': 'python'}
+            data = client.get(reverse('course_search'), params).json()
+            seen += [result['id'] for result in data['results']]
+            after = data['next']
+            if not after:
+                break
+        self.assertEqual(seen, [course_id for course_id, _ in search.search_courses('python', 20)])
+
+    def test_search_cards_carry_the_same_controls_as_the_catalog(self):
+        Enrollment.objects.create(student=self.student, course=self.in_title, status=Enrollment.DROPPED)
+        Enrollment.objects.create(student=self.student, course=self.in_topic)
+
+        def cards(user, handler):
+            client = HANDLERS[handler][0]()
+            client.force_login(user)
+            get = client.get if handler == 'wsgi' else async_to_sync(client.get)
+            results = get(reverse('course_search'), {'q': 'python'}).json()['results']
+            return {result['id']: result for result in results}
+
+        for handler in HANDLERS:
+            student = cards(self.student, handler)
+            self.assertIn('Re-enroll', student[self.in_title.id]['html'])
+            self.assertIn('Continue', student[self.in_topic.id]['html'])
+            self.assertIn('Enroll', student[self.in_module.id]['html'])
+            self.assertIn('csrfmiddlewaretoken', student[self.in_module.id]['html'])
+            self.assertNotIn('Delete', student[self.in_module.id]['html'])
+            self.assertFalse(student[self.in_module.id]['can_edit'])
+
+            owner = cards(self.in_title.instructor, handler)[self.in_title.id]
+            self.assertTrue(owner['can_edit'])
+            self.assertIn(reverse('course_update', args=[self.in_title.id]), owner['html'])
+            self.assertIn(reverse('course_delete', args=[self.in_title.id]), owner['html'])
+
+    def test_like_backend_is_the_fallback_and_pages_by_id(self):
+        search.get_backend.cache_clear()
+        with mock.patch.object(connection, 'vendor', 'mysql'):
+            backend = search.get_backend()
+        self.assertIsInstance(backend, search.LikeSearchBackend)
+
+        matches = sorted(c.id for c in [self.in_description, self.in_title, self.in_topic,
+                                        self.in_module, *self.ties])
+        self.assertEqual(backend.search('python', 20), [(course_id, 0) for course_id in matches])
+        self.assertEqual(backend.search('python tricks', 20), [(self.in_module.id, 0)])
+        paged = self.pages(lambda n, after: backend.search('python', n, after), 3)
+        self.assertEqual([course_id for course_id, _ in paged], matches)
+
+
+class OrderingTests(TestCase):
+    def setUp(self):
+        self.instructor = make_user('teacher@example.com', CustomUser.INSTRUCTOR)
+        self.course = Course.objects.create(title='Course', instructor=self.instructor)
+        self.client.force_login(self.instructor)
+
+    def modules(self, *keys):
+        return [Module.objects.create(course=self.course, title=f'Module {n}', sort_order=key).id
+                for n, key in enumerate(keys)]
+
+    def post(self, order):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse('module_reorder', args=[self.course.id]),
+                                    json.dumps({'order': order}), content_type='application/json')
+
+    def stored(self):
+        return list(self.course.modules.order_by('sort_order', 'id').values_list('id', 'sort_order'))
+
+    def test_moving_one_item_rekeys_one_row(self):
+        current = [(n, n * ordering.GAP) for n in range(1, 6)]
+        for wanted in ([5, 1, 2, 3, 4], [1, 2, 4, 3, 5], [2, 3, 4, 5, 1]):
+            changes = ordering.plan(current, wanted)
+            self.assertEqual(len(changes), 1, wanted)
+            keys = {**dict(current), **changes}
+            self.assertEqual(sorted(wanted, key=keys.get), wanted)
+
+        ids = self.modules(ordering.GAP, 2 * ordering.GAP, 3 * ordering.GAP)
+        wanted = [ids[2], ids[0], ids[1]]
+        self.assertEqual(self.post(wanted).json(), {'changed': 1})
+        self.assertEqual([module_id for module_id, _ in self.stored()], wanted)
+
+    def test_equal_keys_are_spread_out(self):
+        for current in ([(1, 0), (2, 0), (3, 0)], [(1, 5), (2, 5), (3, 7)]):
+            for wanted in ([1, 2, 3], [3, 2, 1], [2, 1, 3]):
+                keys = {**dict(current), **ordering.plan(current, wanted)}
+                ordered = [keys[item_id] for item_id in wanted]
+                self.assertEqual(ordered, sorted(set(ordered)), (current, wanted))
+
+        ids = self.modules(0, 0, 0)
+        self.post(ids[::-1])
+        self.assertEqual([module_id for module_id, _ in self.stored()], ids[::-1])
+        self.assertEqual(len({key for _, key in self.stored()}), 3)
+
+    def test_an_exhausted_gap_renumbers_the_list(self):
+        current = [(1, 0), (2, 1), (3, 2)]
+        self.assertEqual(ordering.plan(current, [1, 3, 2]),
+                         {1: ordering.GAP, 3: 2 * ordering.GAP, 2: 3 * ordering.GAP})
+
+        ids = self.modules(0, 1, 2)
+        self.assertEqual(self.post([ids[0], ids[2], ids[1]]).json(), {'changed': 3})
+        self.assertEqual(self.stored(), [(ids[0], ordering.GAP), (ids[2], 2 * ordering.GAP),
+                                         (ids[1], 3 * ordering.GAP)])
+
+    def test_new_items_leave_room_before_the_first(self):
+        self.assertEqual(ordering.next_key(self.course.modules.all()), ordering.GAP)
+        ids = self.modules(ordering.GAP)
+        ids += self.modules(ordering.next_key(self.course.modules.all()))
+        self.assertEqual(self.post(ids[::-1]).json(), {'changed': 1})
+
+    def test_a_stale_order_is_a_conflict(self):
+        ids = self.modules(ordering.GAP, 2 * ordering.GAP, 3 * ordering.GAP)
+        before = self.stored()
+        for order in (ids[:2], [*ids, ids[0] + 1000], [ids[0], ids[0], ids[1], ids[2]], [ids[0], ids[1], ids[1]]):
+            response = self.post(order)
+            self.assertEqual(response.status_code, 409, order)
+            self.assertIn('error', response.json())
+        self.assertEqual(self.stored(), before)
+
+    def test_lessons_reorder_within_their_module(self):
+        module = Module.objects.create(course=self.course, title='Module')
+        ids = [Lesson.objects.create(module=module, title=f'Lesson {n}', sort_order=n * ordering.GAP).id
+               for n in range(1, 4)]
+        response = self.client.post(reverse('lesson_reorder', args=[module.id]),
+                                    json.dumps({'order': ids[::-1]}), content_type='application/json')
+        self.assertEqual(response.json(), {'changed': 2})
+        self.assertEqual(list(module.lessons.order_by('sort_order', 'id').values_list('id', flat=True)),
+                         ids[::-1])
+
+
+class ThreadEventsTests(TestCase):
+    @mock.patch.object(views, 'COMMENTS_PAGE_SIZE', 3)
+    def test_reconnect_replays_every_missed_comment(self):
+        student = make_user('student@example.com')
+        quiz = make_quiz(make_user('teacher@example.com', CustomUser.INSTRUCTOR), questions=0)
+        thread = DiscussionThread.objects.create(lesson=quiz.lesson, created_by=student, title='Thread')
+        comments = Comment.objects.bulk_create([Comment(thread=thread, user=student, body=str(n))
+                                                for n in range(8)])
+
+        async def replay():
+            stream = views._thread_stream(thread.id, since=comments[0].pk)
+            try:
+                # the retry hint, then one event per missed comment
+                return [await anext(stream) for _ in range(len(comments))]
+            finally:
+                await stream.aclose()
+        events = async_to_sync(replay)()
+        self.assertTrue(events[0].startswith('retry:'))
+        self.assertEqual([event.split('\n')[0] for event in events[1:]],
+                         [f'id: {comment.pk}' for comment in comments[1:]])
+
+
+class LessonRenderingTests(TestCase):
+    def setUp(self):
+        instructor = make_user('i@example.com', CustomUser.INSTRUCTOR)
+        course = Course.objects.create(title='Course', instructor=instructor)
+        self.module = Module.objects.create(course=course, title='Module')
+
+    def test_plain_text_bodies_are_escaped_paragraphs(self):
+        html = rendering.render_body('One <b>\n\n**Two**')
+        self.assertEqual(html, '<p>One &lt;b&gt;</p>\n\n<p>**Two**</p>')
+
+    def test_migration_backfills_existing_lessons(self):
+        lesson = Lesson.objects.create(module=self.module, title='Lesson', body='Hello there')
+        video = Lesson.objects.create(module=self.module, title='Video', content_type=Lesson.VIDEO,
+                                      content_url='https://youtu.be/abcdefgh')
+        # rows written before the rendered fields existed
+        Lesson.objects.update(body_html='', excerpt='', embed_url='')
+
+        migration = importlib.import_module('pal_learning_app.migrations.0012_lesson_rendering')
+        with mock.patch.object(migration, 'BATCH_SIZE', 1):
+            migration.backfill_rendering(django_apps, None)
+
+        lesson.refresh_from_db()
+        video.refresh_from_db()
+        self.assertIn('Hello there', lesson.body_html)
+        self.assertEqual(lesson.excerpt, 'Hello there')
+        self.assertEqual(video.embed_url, 'https://www.youtube.com/embed/abcdefgh')
+
+
+@override_settings(AUTHENTICATION_BACKENDS=['pal_learning_app.backends.CachedModelBackend'])
+class CachedAuthTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = make_user('s@example.com')
+        self.backend = backends.CachedModelBackend()
+
+    def test_snapshot_is_reused_until_the_user_is_saved(self):
+        self.backend.get_user(self.user.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.backend.get_user(self.user.pk).first_name, 's')
+
+        self.user.first_name = 'Sam'
+        self.user.save()
+        self.assertEqual(self.backend.get_user(self.user.pk).first_name, 'Sam')
+
+    def test_snapshot_hash_follows_a_new_password(self):
+        self.backend.get_user(self.user.pk)
+        snapshot_user = self.backend.get_user(self.user.pk)
+        old_hash = snapshot_user.get_session_auth_hash()
+
+        snapshot_user.set_password('new-pw')
+        self.assertNotEqual(snapshot_user.get_session_auth_hash(), old_hash)
+        snapshot_user.save(update_fields=['password'])
+        fresh = CustomUser.objects.get(pk=self.user.pk)
+        self.assertEqual(snapshot_user.get_session_auth_hash(), fresh.get_session_auth_hash())
+
+    def test_session_survives_a_password_change_on_the_request_user(self):
+        client = Client()
+        client.force_login(self.user)
+        client.get(reverse('home'))  # caches the snapshot
+
+        # what update_session_auth_hash() stores for the request user
+        user = self.backend.get_user(self.user.pk)
+        user.set_password('new-pw')
+        user.save()
+        session = client.session
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.save()
+
+        response = client.get(reverse('home'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.wsgi_request.user.pk, self.user.pk)
+
+    def test_deleted_user_is_forgotten(self):
+        self.backend.get_user(self.user.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.delete()
+        self.assertIsNone(self.backend.get_user(self.user.pk))
+
+
+class LoginTests(TestCase):
+    def setUp(self):
+        self.student = make_user('s@example.com')
+
+    def login(self, email, password):
+        return Client().post(reverse('login'), {'email': email, 'password': password})
+
+    def test_valid_password_signs_in(self):
+        response = self.login('s@example.com', 'pw')
+        self.assertRedirects(response, reverse('home'), fetch_redirect_response=False)
+
+    def test_failures_are_reported_to_listeners(self):
+        failed = []
+        def listener(sender, credentials, **kwargs):
+            failed.append(credentials['email'])
+        user_login_failed.connect(listener)
+        self.addCleanup(user_login_failed.disconnect, listener)
+
+        for email, password in [('s@example.com', 'wrong'), ('nobody@example.com', 'pw')]:
+            response = self.login(email, password)
+            self.assertRedirects(response, reverse('login'), fetch_redirect_response=False)
+        self.assertEqual(failed, ['s@example.com', 'nobody@example.com'])
+
+    def test_unapproved_instructor_cannot_sign_in(self):
+        make_user('i@example.com', CustomUser.INSTRUCTOR, is_approved=False)
+        response = self.login('i@example.com', 'pw')
+        self.assertRedirects(response, reverse('login'), fetch_redirect_response=False)
+
+    @override_settings(AUTHENTICATION_BACKENDS=['pal_learning_app.backends.CachedModelBackend'])
+    def test_configured_backend_is_used(self):
+        with mock.patch.object(backends.CachedModelBackend, 'aauthenticate',
+                               autospec=True, return_value=None) as aauthenticate:
+            self.login('s@example.com', 'pw')
+        aauthenticate.assert_called_once()
+
+    def test_outdated_hash_is_upgraded(self):
+        with override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.PBKDF2PasswordHasher',
+                                                 'django.contrib.auth.hashers.MD5PasswordHasher']):
+            CustomUser.objects.filter(pk=self.student.pk).update(password=make_password('pw', hasher='md5'))
+            self.login('s@example.com', 'pw')
+        self.student.refresh_from_db()
+        self.assertTrue(self.student.password.startswith('pbkdf2_sha256$'))
+
+    def test_busy_pool_asks_to_retry(self):
+        with mock.patch.object(hashing, 'acheck_password', side_effect=hashing.PoolBusy):
+            response = self.login('s@example.com', 'pw')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '5')
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.instructor = make_user('i@example.com', CustomUser.INSTRUCTOR)
+        self.course = Course.objects.create(title='=Course', instructor=self.instructor)
+        for n in range(5):
+            Enrollment.objects.create(student=make_user(f's{n}@example.com'), course=self.course)
+        self.url = reverse('course_export', args=[self.course.id, 'enrollments'])
+
+    def wsgi_get(self, data=None):
+        client = Client()
+        client.force_login(self.instructor)
+        response = client.get(self.url, data)
+        self.assertFalse(response.is_async)
+        return b''.join(response.streaming_content)
+
+    def asgi_get(self, data=None):
+        client = AsyncClient()
+        client.force_login(self.instructor)
+
+        async def read():
+            response = await client.get(self.url, data)
+            self.assertTrue(response.is_async)
+            return [chunk async for chunk in response.streaming_content]
+
+        # the sync row iterator would be read whole into a list first
+        with mock.patch.object(exports, 'iter_csv', side_effect=AssertionError("sync rows under ASGI")):
+            return async_to_sync(read)()
+
+    def test_csv_rows(self):
+        rows = list(csv.reader(io.StringIO(self.wsgi_get().decode())))
+        self.assertEqual(rows[0], exports.EXPORTS['enrollments'][0])
+        self.assertEqual(len(rows), 6)
+        # formula-looking text is defused
+        self.assertEqual({row[1] for row in rows[1:]}, {"'=Course"})
+
+    @mock.patch.object(exports, 'ROWS_PER_WRITE', 2)
+    def test_asgi_streams_the_same_csv_in_chunks(self):
+        chunks = self.asgi_get()
+        self.assertEqual(len(chunks), 4)  # the header, then 2 + 2 + 1 rows
+        self.assertEqual(b''.join(chunks), self.wsgi_get())
+
+    def test_asgi_gzip(self):
+        data = b''.join(self.asgi_get({'gzip': '1'}))
+        self.assertEqual(gzip.decompress(data), self.wsgi_get())
+        self.assertEqual(gzip.decompress(self.wsgi_get({'gzip': '1'})), self.wsgi_get())
+
+
+class MetricsCollectTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.dir = directory.name
+        self.enterContext(override_settings(METRICS_DIR=self.dir, METRICS_STALE_AFTER=60))
+
+    def write_worker(self, pid, requests, running, age=0):
+        series = metrics._empty()
+        series['pal_db_queries'][0] = requests
+        snap = {'series': [[['home', 'GET', '2xx'], series]],
+                'hashing': {'completed': requests, 'running': running}}
+        path = os.path.join(self.dir, f'metrics-{pid}.json')
+        with open(path, 'w') as fp:
+            json.dump(snap, fp)
+        moment = time.time() - age
+        os.utime(path, (moment, moment))
+        return path
+
+    def test_workers_are_reported_separately(self):
+        self.write_worker(1001, requests=3, running=1)
+        self.write_worker(1002, requests=5, running=0)
+        text = metrics.render()
+        self.assertIn('pal_db_queries_count{worker="1001",view="home",method="GET",status="2xx"} 3', text)
+        self.assertIn('pal_db_queries_count{worker="1002",view="home",method="GET",status="2xx"} 5', text)
+        self.assertIn('pal_password_hash_running{worker="1001"} 1', text)
+        self.assertIn(f'pal_password_hash_running{{worker="{os.getpid()}"}}', text)
+
+    def test_stale_workers_are_dropped(self):
+        stale = self.write_worker(1001, requests=3, running=2, age=120)
+        self.write_worker(1002, requests=5, running=0)
+        text = metrics.render()
+        self.assertNotIn('worker="1001"', text)
+        self.assertIn('worker="1002"', text)
+        self.assertFalse(os.path.exists(stale))
+
+    @override_settings(METRICS_TOKEN='s3cret')
+    def test_metrics_need_staff_or_the_token(self):
+        url = reverse('metrics')
+        client = Client(REMOTE_ADDR='127.0.0.1')
+        self.assertEqual(client.get(url).status_code, 404)
+        self.assertEqual(client.get(url, HTTP_AUTHORIZATION='Bearer wrong').status_code, 404)
+        self.assertEqual(client.get(url, HTTP_AUTHORIZATION='Bearer s3cret').status_code, 200)
+        client.force_login(make_user('staff@example.com', is_staff=True))
+        self.assertEqual(client.get(url).status_code, 200)
+        with override_settings(METRICS_TOKEN=None):
+            self.assertEqual(Client().get(url, HTTP_AUTHORIZATION='Bearer None').status_code, 404)
+
+
+class CourseImportExportTests(TestCase):
+    def setUp(self):
+        self.instructor = make_user('i@example.com', CustomUser.INSTRUCTOR)
+        self.quiz = make_quiz(self.instructor, questions=2, choices=3)
+        self.course = self.quiz.lesson.module.course
+        Lesson.objects.create(module=self.quiz.lesson.module, title='Reading', body='Some *text*.')
+
+    def tree(self, course):
+        # everything an export carries, without ids
+        records = list(course_io.iter_course_records([course.id]))
+        for record in records:
+            for key in ('ref', 'course', 'module', 'lesson', 'quiz', 'question'):
+                record.pop(key, None)
+        return records
+
+    def round_trip(self, fmt):
+        path = os.path.join(self.enterContext(tempfile.TemporaryDirectory()), f'course.{fmt}')
+        call_command('export_course', self.course.id, output=path, format=fmt, stderr=io.StringIO())
+        call_command('import_course', path, instructor=self.instructor.email, stdout=io.StringIO())
+        return Course.objects.exclude(pk=self.course.pk).get()
+
+    def test_jsonl_round_trip(self):
+        self.assertEqual(self.tree(self.round_trip('jsonl')), self.tree(self.course))
+
+    def test_json_round_trip(self):
+        copy = self.round_trip('json')
+        self.assertEqual(self.tree(copy), self.tree(self.course))
+        # bulk_create skips Lesson.save: the import renders the lesson itself
+        self.assertIn('text', copy.modules.get().lessons.get(title='Reading').body_html)
+
+    def test_records_split_across_reads(self):
+        data = io.StringIO()
+        course_io.write_records(course_io.iter_course_records([self.course.id]), data, 'json')
+        data.seek(0)
+        records = list(course_io.read_records(data, chunk_size=7))
+        self.assertEqual(records, list(course_io.iter_course_records([self.course.id])))
+
+    def test_bad_record_saves_nothing(self):
+        records = list(course_io.iter_course_records([self.course.id]))
+        records[-1]['question'] = 'missing'
+        with self.assertRaisesMessage(course_io.CourseImportError, "unknown question 'missing'"):
+            course_io.import_course_records(records, self.instructor)
+        self.assertEqual(Course.objects.count(), 1)
+
+    def test_clone(self):
+        copy = Course.objects.get(pk=course_io.clone_course(self.course))
+        self.assertEqual(copy.title, 'Copy of Course')
+        self.assertEqual(self.tree(copy)[1:], self.tree(self.course)[1:])
+
+    def test_clone_where_bulk_inserts_return_no_ids(self):
+        with mock.patch.object(type(connection.features), 'can_return_rows_from_bulk_insert', False):
+            copy = Course.objects.get(pk=course_io.clone_course(self.course))
+        self.assertEqual(self.tree(copy)[1:], self.tree(self.course)[1:])
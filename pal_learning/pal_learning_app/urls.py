@@ -10,18 +10,24 @@ urlpatterns = [
     # main
     path('',       views.home,   name='home'),
     path('about/', views.about,  name='about'),
+    path('metrics', views.metrics_view, name='metrics'),
 
     # course flows
     path('courses/',                          views.course_list,    name='course_list'),
+    path('courses/search/',                   views.course_search,  name='course_search'),
     path('courses/<int:course_id>/',          views.course_detail,  name='course_detail'),
     path('courses/create/',                   views.course_create,  name='course_create'),
     path('courses/<int:course_id>/edit/',     views.course_update,  name='course_update'),
     path('courses/<int:course_id>/delete/',   views.course_delete,  name='course_delete'),
+    path('courses/<int:course_id>/duplicate/', views.course_duplicate, name='course_duplicate'),
+    path('courses/<int:course_id>/stats/',    views.course_stats,   name='course_stats'),
+    path('courses/<int:course_id>/export/<slug:kind>/', views.course_export, name='course_export'),
 
     # module flows
     path('courses/<int:course_id>/modules/create/',views.module_create,name='module_create'),
     path('courses/<int:course_id>/modules/<int:module_id>/edit/',views.module_edit,name='module_edit'),
     path('courses/<int:course_id>/modules/<int:module_id>/delete/',views.module_delete,name='module_delete'),
+    path('courses/<int:course_id>/modules/reorder/',views.module_reorder,name='module_reorder'),
     path('modules/<int:module_id>/',views.module_detail,name='module_detail'),
     
     
@@ -30,12 +36,16 @@ urlpatterns = [
     path('modules/<int:module_id>/lessons/create/',views.lesson_create,name='lesson_create'),
     path('lessons/<int:lesson_id>/edit/',views.lesson_edit,name='lesson_edit'),
     path('lessons/<int:lesson_id>/delete/',views.lesson_delete,name='lesson_delete'),
+    path('modules/<int:module_id>/lessons/reorder/',views.lesson_reorder,name='lesson_reorder'),
+    path('lessons/<int:lesson_id>/progress/',views.lesson_progress,name='lesson_progress'),
+    path('lessons/<int:lesson_id>/threads/',views.lesson_threads,name='lesson_threads'),
     path('lessons/<int:lesson_id>/',views.lesson_detail,name='lesson_detail'),    
     # quiz flows
     path('lessons/<int:lesson_id>/quiz/create/',views.quiz_create,name='quiz_create'),
     path('quizzes/<int:quiz_id>/edit/',views.quiz_edit,name='quiz_edit'),
     path('quizzes/<int:quiz_id>/delete/',views.quiz_delete,name='quiz_delete'),
     path('quizzes/<int:quiz_id>/',views.quiz_detail,name='quiz_detail'),
+    path('quizzes/<int:quiz_id>/stats/',views.quiz_stats,name='quiz_stats'),
    # question flows
     path('quizzes/<int:quiz_id>/questions/create/',views.question_create,name='question_create'),
     path('questions/<int:question_id>/edit/',views.question_edit,name='question_edit'),
@@ -43,4 +53,23 @@ urlpatterns = [
     # enroll
     path('courses/<int:course_id>/enroll/',views.enroll_course,name='enroll_course'),
     path('courses/<int:course_id>/drop/',views.drop_course,name='drop_course'),    
+    # discussions
+    path('threads/<int:thread_id>/',views.thread_detail,name='thread_detail'),
+    path('threads/<int:thread_id>/events/',views.thread_events,name='thread_events'),
+]
+
+# the same routes for the ASGI handler, with the student read views swapped
+# for their async twins (see middleware.asgi_urlconf_middleware)
+ASYNC_VIEWS = {
+    views.course_list:   views.acourse_list,
+    views.course_search: views.acourse_search,
+    views.course_detail: views.acourse_detail,
+    views.module_detail: views.amodule_detail,
+    views.lesson_detail: views.alesson_detail,
+    views.quiz_detail:   views.aquiz_detail,
+}
+
+asgi_urlpatterns = [
+    path(str(p.pattern), ASYNC_VIEWS.get(p.callback, p.callback), name=p.name)
+    for p in urlpatterns
 ]
@@ -1,6 +1,51 @@
+import base64
+import binascii
+import json
+
+from django.db import connection
+
 from .models import CustomUser
 
 def is_instructor_or_admin(user):
     return user.is_authenticated and (
         user.is_superuser or user.role == CustomUser.INSTRUCTOR
     )
+
+
+def encode_cursor(*values):
+    # opaque, url-safe token for a keyset position
+    raw = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    # returns the list of values, or None for a missing/garbled cursor
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json.loads(raw)
+    except (binascii.Error, ValueError):
+        return None
+    return values if isinstance(values, list) else None
+
+
+def conflict_target(*fields):
+    # unique_fields for a bulk_create upsert; MySQL upserts on whichever
+    # unique key clashes and refuses an explicit conflict target
+    if connection.features.supports_update_conflicts_with_target:
+        return list(fields)
+    return None
+
+
+def query_budget(get=None, post=None):
+    # most SQL queries a GET or a POST to the view may run, whatever the data
+    # size; only the methods given are budgeted, and the tests in tests.py
+    # enforce each of them
+    def decorator(view):
+        view.query_budget = {
+            method: queries for method, queries in (('GET', get), ('POST', post))
+            if queries is not None
+        }
+        return view
+    return decorator
@@ -1,40 +1,76 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib import messages
-from django.contrib.auth import authenticate, login, logout
+from django.contrib.auth import aauthenticate, alogin, logout
 from django.contrib.auth.decorators import login_required, user_passes_test
-from django.shortcuts import render, redirect, get_object_or_404
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.db.models import F, Prefetch, Q, aprefetch_related_objects, prefetch_related_objects
+from django.http import (
+    Http404, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, HttpResponseNotAllowed,
+    JsonResponse, StreamingHttpResponse,
+)
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
+from django.template.loader import render_to_string
 from django.urls import reverse
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+from django.utils.dateparse import parse_datetime
+from django.utils.text import Truncator
+
+from .models import CustomUser, Course, Module, Lesson,Quiz,Question,Choice,Enrollment,CourseDailyEnrollment,CourseStats,DiscussionThread,Comment
+from .forms import CourseForm,ModuleForm,LessonForm,QuizForm,QuestionForm, ChoiceFormSet, ThreadForm, CommentForm
+from .grading import (
+    correct_questions, get_answer_key, grade, previous_attempt,
+    save_submission, schedule_regrade, selected_choices,
+)
+from .item_analysis import lock_question_stats, record_attempt
+from .outline import aget_outline_or_404, get_outline_or_404
+from . import counters, course_io, exports, hashing, metrics, ordering, progress, pubsub
+from .search import search_courses
+from .utils import decode_cursor, encode_cursor, is_instructor_or_admin, query_budget
+
+from datetime import timedelta
+import asyncio
+import json
+import random
+def _sign_in_busy(request, template):
+    # the hashing pool is saturated: say so instead of queueing forever
+    messages.error(request, "We’re handling a lot of sign-ins right now. Please try again in a moment.")
+    response = render(request, template, status=503)
+    response['Retry-After'] = '5'
+    return response
 
-from .models import CustomUser, Course, Module, Lesson,Quiz,QuizSubmission,Question,Enrollment
-from .forms import CourseForm,ModuleForm,LessonForm,QuizForm,QuestionForm, ChoiceFormSet
-from .utils import is_instructor_or_admin
 
-from urllib.parse import urlparse, parse_qs
-import random
-def signup_view(request):
+@query_budget(0, post=10)
+async def signup_view(request):
     if request.method == "POST":
-        errors = CustomUser.objects.user_validator(request.POST)
+        errors = await sync_to_async(CustomUser.objects.user_validator)(request.POST)
         if errors:
             for msg in errors.values():
                 messages.error(request, msg)
             return redirect('signup')
 
-        email   = request.POST['email']
-        password = request.POST['password']
-        user = CustomUser.objects.create_user(
-            email=email,
-            password=password,
+        user = CustomUser.objects.build_user(
+            email=request.POST['email'],
             first_name=request.POST['first_name'],
             last_name=request.POST['last_name'],
             address=request.POST['address'],
             role=request.POST.get('role', CustomUser.STUDENT)
         )
-        login(request, user)
+        try:
+            user.password = await hashing.amake_password(request.POST['password'])
+        except hashing.PoolBusy:
+            return _sign_in_busy(request, 'signup.html')
+        await user.asave()
+        await alogin(request, user)
         return redirect('home')
 
     return render(request, 'signup.html')
 
 
-def login_view(request):
+@query_budget(0, post=9)
+async def login_view(request):
     if request.method == "POST":
         errors = CustomUser.objects.login_validator(request.POST)
         if errors:
@@ -42,13 +78,16 @@ def login_view(request):
                 messages.error(request, msg)
             return redirect('login')
 
-        user = authenticate(
-            request,
-            username=request.POST['email'],
-            password=request.POST['password']
-        )
-        if user:
-            login(request, user)
+        try:
+            # the backend checks the password on the bounded hashing pool
+            user = await aauthenticate(
+                request, email=request.POST['email'], password=request.POST['password']
+            )
+        except hashing.PoolBusy:
+            return _sign_in_busy(request, 'login.html')
+
+        if user is not None:
+            await alogin(request, user)
             # If the user is staff/superuser, send them to the Django admin:
             if user.is_staff or user.is_superuser:
                 return redirect(reverse('admin:index'))
@@ -61,11 +100,13 @@ def login_view(request):
     return render(request, 'login.html')
 
 
+@query_budget(4)
 def logout_view(request):
     logout(request)
     return redirect('login')
 
 
+@query_budget(3)
 @login_required
 def home(request):
     user = request.user
@@ -74,7 +115,7 @@ def home(request):
         # only grab in-progress enrollments
         enrollments = (
             user.enrollments
-                .select_related('course')
+                .select_related('course__instructor')
                 .filter(status=Enrollment.IN_PROGRESS)
         )
         context = {
@@ -83,7 +124,7 @@ def home(request):
         }
     else:
         # instructors/admins see their own courses
-        courses_taught = user.courses_taught.all()
+        courses_taught = user.courses_taught.select_related('instructor')
         context = {
             'is_student':      False,
             'courses_taught':  courses_taught,
@@ -92,93 +133,331 @@ def home(request):
     return render(request, 'home.html', context)
 
 
-@login_required
-def course_list(request):
-    q = request.GET.get('q', '').strip()
-    courses = Course.objects.all()
-    if q:
-        courses = (
-            courses.filter(title__icontains=q)
-                   .union(courses.filter(topic__icontains=q))
+CATALOG_PAGE_SIZE = 24
+
+
+def _keyset(token, kind):
+    # (sort value, id) from a cursor of the given kind, else None; search
+    # cursors ('s') carry a rank, every other kind a timestamp
+    cursor = decode_cursor(token)
+    if not cursor or len(cursor) != 3 or cursor[0] != kind:
+        return None
+    if not isinstance(cursor[2], int) or isinstance(cursor[2], bool):
+        return None
+    if kind != 's':
+        moment = parse_datetime(cursor[1]) if isinstance(cursor[1], str) else None
+        return (moment, cursor[2]) if moment else None
+    return (cursor[1], cursor[2]) if isinstance(cursor[1], (int, float)) else None
+
+
+def _search_page(by_id, hits):
+    page_hits = hits[:CATALOG_PAGE_SIZE]
+    page = [by_id[course_id] for course_id, _ in page_hits if course_id in by_id]
+    next_cursor = None
+    if len(hits) > CATALOG_PAGE_SIZE:
+        course_id, rank = page_hits[-1]
+        next_cursor = encode_cursor('s', rank, course_id)
+    return page, next_cursor
+
+
+def _browse(courses, after):
+    # browsing is keyed on (created_at, id), newest first
+    keyset = _keyset(after, 'c')
+    if keyset:
+        created_at, course_id = keyset
+        courses = courses.filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=course_id)
         )
+    return courses.order_by('-created_at', '-id')[:CATALOG_PAGE_SIZE + 1]
 
-    for course in courses:
-        # Active enrollment?
-        course.is_enrolled = Enrollment.objects.filter(
-            student=request.user,
-            course=course,
-            status=Enrollment.IN_PROGRESS
-        ).exists()
-        # Dropped previously?
-        course.is_dropped = Enrollment.objects.filter(
-            student=request.user,
-            course=course,
-            status=Enrollment.DROPPED
-        ).exists()
 
+def _browse_page(page):
+    next_cursor = None
+    if len(page) > CATALOG_PAGE_SIZE:
+        page = page[:CATALOG_PAGE_SIZE]
+        next_cursor = encode_cursor('c', page[-1].created_at.isoformat(), page[-1].pk)
+    return page, next_cursor
+
+
+def _catalog(user):
+    return Course.objects.select_related('instructor').with_enrollment_status(user)
+
+
+def _catalog_page(user, q, after=None):
+    """One page of the catalog plus the cursor of the next page (or None)."""
+    if q:
+        # search results are keyed on (rank, id), best match first
+        hits = search_courses(q, CATALOG_PAGE_SIZE + 1, _keyset(after, 's'))
+        by_id = _catalog(user).in_bulk([course_id for course_id, _ in hits[:CATALOG_PAGE_SIZE]])
+        return _search_page(by_id, hits)
+    return _browse_page(list(_browse(_catalog(user), after)))
+
+
+async def _acatalog_page(user, q, after=None):
+    """Async version of _catalog_page()."""
+    if q:
+        # the search backends run raw SQL, which has no async flavour
+        hits = await sync_to_async(search_courses)(q, CATALOG_PAGE_SIZE + 1, _keyset(after, 's'))
+        by_id = await _catalog(user).ain_bulk([course_id for course_id, _ in hits[:CATALOG_PAGE_SIZE]])
+        return _search_page(by_id, hits)
+    return _browse_page([course async for course in _browse(_catalog(user), after)])
+
+
+async def _auser(request):
+    # resolve the user without blocking the event loop and pin it, so that
+    # templates and context processors never load it synchronously
+    request.user = await request.auser()
+    return request.user
+
+
+# The student-facing read views come in pairs: the plain view is routed under
+# WSGI, its async twin (same name, "a" prefix) under ASGI. See
+# urls.asgi_urlpatterns and middleware.asgi_urlconf_middleware.
+
+def _course_list_page(request, courses, next_cursor):
     return render(request, 'course_list.html', {
-        'courses': courses,
-        'query':   q,
+        'courses':     courses,
+        'query':       request.GET.get('q', '').strip(),
+        'next_cursor': next_cursor,
     })
 
 
+@query_budget(4)
 @login_required
-def course_detail(request, course_id):
-    course  = get_object_or_404(Course, pk=course_id)
-    modules = course.modules.all()
+def course_list(request):
+    q = request.GET.get('q', '').strip()
+    courses, next_cursor = _catalog_page(request.user, q, request.GET.get('after'))
+    return _course_list_page(request, courses, next_cursor)
+
+
+@query_budget(4)
+@login_required
+async def acourse_list(request):
+    user = await _auser(request)
+    q = request.GET.get('q', '').strip()
+    courses, next_cursor = await _acatalog_page(user, q, request.GET.get('after'))
+    return _course_list_page(request, courses, next_cursor)
+
+
+def _search_results(request, courses, next_cursor):
+    # JSON feed for the catalog's search-as-you-type box; 'html' is the same
+    # card, controls included, that the catalog page renders
+    results = [
+        {
+            'id':                course.id,
+            'title':             course.title,
+            'topic':             course.topic,
+            'difficulty':        course.get_difficulty_display(),
+            'instructor':        course.instructor.first_name,
+            'description':       Truncator(course.description).words(20),
+            'enrollment_status': course.enrollment_status,
+            'url':               reverse('course_detail', args=[course.id]),
+            'can_edit':          request.user.is_superuser or course.instructor_id == request.user.id,
+            'html':              render_to_string('course_list_item.html', {'course': course}, request),
+        }
+        for course in courses
+    ]
+    return JsonResponse({'results': results, 'next': next_cursor})
+
+
+@query_budget(4)
+@login_required
+def course_search(request):
+    q = request.GET.get('q', '').strip()
+    return _search_results(request, *_catalog_page(request.user, q, request.GET.get('after')))
+
+
+@query_budget(4)
+@login_required
+async def acourse_search(request):
+    user = await _auser(request)
+    q = request.GET.get('q', '').strip()
+    return _search_results(request, *await _acatalog_page(user, q, request.GET.get('after')))
 
-    enrollment = None
+
+def _enrollment_status(user, course_id):
     # only students can enroll/drop
-    if request.user.role == CustomUser.STUDENT:
-        enrollment = Enrollment.objects.filter(
-            student=request.user,
-            course=course
-        ).first()
+    if user.role != CustomUser.STUDENT:
+        return None
+    return Enrollment.objects.filter(student=user, course_id=course_id).values_list('status', flat=True)
+
 
+def _course_detail_page(request, course, enrollment_status):
     return render(request, 'course_detail.html', {
-        'course'     : course,
-        'modules'    : modules,
-        'enrollment' : enrollment,
+        'course'            : course,
+        'modules'           : course.modules,
+        'enrollment_status' : enrollment_status,
     })
 
 
+@query_budget(6)
 @login_required
-def module_detail(request, module_id):
-    module = get_object_or_404(Module, pk=module_id)
-    lessons = module.lessons.all()
+def course_detail(request, course_id):
+    course = get_outline_or_404(course_id)
+    status = _enrollment_status(request.user, course_id)
+    return _course_detail_page(request, course, status.first() if status is not None else None)
+
+
+@query_budget(6)
+@login_required
+async def acourse_detail(request, course_id):
+    user = await _auser(request)
+    course = await aget_outline_or_404(course_id)
+    status = _enrollment_status(user, course_id)
+    return _course_detail_page(request, course, await status.afirst() if status is not None else None)
+
+
+STATS_HISTORY_DAYS = 30
+
+
+@query_budget(4)
+@login_required
+@user_passes_test(is_instructor_or_admin)
+def course_stats(request, course_id):
+    course = get_object_or_404(Course.objects.select_related('stats'), pk=course_id)
+    if not request.user.is_superuser and course.instructor_id != request.user.id:
+        messages.error(request, "You don’t have permission to view these statistics.")
+        return redirect('course_detail', course_id=course_id)
+
+    # everything comes from the rollup tables, never from Enrollment itself
+    stats = getattr(course, 'stats', None) or CourseStats(course=course)
+    today = timezone.localdate()
+    start = today - timedelta(days=STATS_HISTORY_DAYS - 1)
+    rows = {
+        row.day: row
+        for row in CourseDailyEnrollment.objects.filter(course=course, day__gte=start)
+    }
+    history = []
+    for offset in range(STATS_HISTORY_DAYS):
+        day = start + timedelta(days=offset)
+        row = rows.get(day)
+        history.append({
+            'day': day,
+            'enrollments': row.enrollments if row else 0,
+            'drops': row.drops if row else 0,
+        })
+    peak = max([1] + [max(h['enrollments'], h['drops']) for h in history])
+
+    return render(request, 'course_stats.html', {
+        'course': course,
+        'stats': stats,
+        'history': history,
+        'peak': peak,
+    })
+
+
+@query_budget(4)
+@login_required
+@user_passes_test(is_instructor_or_admin)
+def course_export(request, course_id, kind):
+    if kind not in exports.EXPORTS:
+        raise Http404
+    course = get_object_or_404(Course.objects.only('id', 'instructor_id'), pk=course_id)
+    if not request.user.is_superuser and course.instructor_id != request.user.id:
+        messages.error(request, "You don’t have permission to export this course.")
+        return redirect('course_detail', course_id=course_id)
+    return exports.export_response(
+        request, kind, [course.id],
+        compress=request.GET.get('gzip') == '1',
+        name=f"course-{course.id}-{kind}",
+    )
+
+
+def _module_course_id(module_id):
+    return Module.objects.filter(pk=module_id).values_list('course_id', flat=True)
+
+
+def _module_detail_page(request, course, module_id):
+    module = course.module(module_id)
+    if module is None:
+        raise Http404("No module matches the given query.")
     return render(request, 'module_detail.html', {
+        'course': course,
         'module': module,
-        'lessons': lessons,
+        'lessons': module.lessons,
     })
 
 
+@query_budget(6)
 @login_required
-def lesson_detail(request, lesson_id):
-    lesson = get_object_or_404(Lesson, pk=lesson_id)
+def module_detail(request, module_id):
+    course = get_outline_or_404(_module_course_id(module_id).first())
+    return _module_detail_page(request, course, module_id)
 
-    embed_url = None
-    if lesson.content_type == 'video' and lesson.content_url:
-        parsed = urlparse(lesson.content_url)
-        # Case A: standard YouTube watch?v=ID
-        if 'youtube.com' in parsed.netloc:
-            q = parse_qs(parsed.query)
-            vid = q.get('v', [None])[0]
-            if vid:
-                embed_url = f'https://www.youtube.com/embed/{vid}'
-        # Case B: youtu.be short link
-        elif 'youtu.be' in parsed.netloc:
-            vid = parsed.path.lstrip('/')
-            embed_url = f'https://www.youtube.com/embed/{vid}'
 
+@query_budget(6)
+@login_required
+async def amodule_detail(request, module_id):
+    await _auser(request)
+    course = await aget_outline_or_404(await _module_course_id(module_id).afirst())
+    return _module_detail_page(request, course, module_id)
+
+
+# rendered at save time: the page only prints stored fields
+LESSON_PAGE = Lesson.objects.annotate(course_id=F('module__course_id')).defer('body', 'excerpt')
+
+
+def _lesson_detail_page(request, lesson, course):
     return render(request, 'lesson_detail.html', {
         'lesson': lesson,
-        'embed_url': embed_url,
+        'course': course,
+        'module': course.module(lesson.module_id),
     })
 
+
+@query_budget(6)
+@login_required
+def lesson_detail(request, lesson_id):
+    lesson = get_object_or_404(LESSON_PAGE, pk=lesson_id)
+    return _lesson_detail_page(request, lesson, get_outline_or_404(lesson.course_id))
+
+
+@query_budget(6)
+@login_required
+async def alesson_detail(request, lesson_id):
+    await _auser(request)
+    lesson = await aget_object_or_404(LESSON_PAGE, pk=lesson_id)
+    return _lesson_detail_page(request, lesson, await aget_outline_or_404(lesson.course_id))
+
+@query_budget(post=11)
+@login_required
+def lesson_progress(request, lesson_id):
+    # heartbeat from an open lesson page; buffered, never written inline
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    event = request.POST.get('event')
+    if event not in ('started', 'completed'):
+        return HttpResponseBadRequest("Unknown progress event.")
+
+    lesson = get_object_or_404(Lesson.objects.only('module_id'), pk=lesson_id)
+    if request.user.role == CustomUser.STUDENT:
+        enrolled = (
+            Enrollment.objects.filter(student=request.user, course__modules=lesson.module_id)
+                              .exclude(status=Enrollment.DROPPED)
+                              .exists()
+        )
+        if not enrolled:
+            return HttpResponseForbidden("You are not enrolled in this course.")
+        progress.record(request.user.id, lesson.id, completed=(event == 'completed'))
+    return HttpResponse(status=204)
+
+@query_budget(0)
 def about(request):
     return render(request, 'about.html')
 
 
+@query_budget(0)
+def metrics_view(request):
+    # not by client address: behind a local proxy every request comes from it
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    sent = request.headers.get('Authorization', '')
+    allowed = bool(token) and constant_time_compare(sent, f'Bearer {token}')
+    if not allowed and not request.user.is_staff:
+        raise Http404
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@query_budget(2, post=3)
 @login_required
 @user_passes_test(is_instructor_or_admin)
 def course_create(request):
@@ -197,6 +476,7 @@ def course_create(request):
     return render(request, 'course_form.html', {'form': form})
 
 
+@query_budget(4, post=6)
 @login_required
 @user_passes_test(is_instructor_or_admin)
 def course_update(request, course_id):
@@ -221,6 +501,7 @@ def course_update(request, course_id):
     })
 
 
+@query_budget(post=28)
 @login_required
 @user_passes_test(is_instructor_or_admin)
 def course_delete(request, course_id):
@@ -236,7 +517,27 @@ def course_delete(request, course_id):
     course.delete()
     messages.success(request, "Course deleted successfully.")
     return redirect('course_list')
+
+
+@query_budget(post=18)
+@login_required
+@user_passes_test(is_instructor_or_admin)
+def course_duplicate(request, course_id):
+    if request.method != 'POST':
+        return redirect('course_detail', course_id=course_id)
+
+    course = get_object_or_404(Course.objects.select_related('instructor'), pk=course_id)
+    if not request.user.is_superuser and course.instructor != request.user:
+        messages.error(request, "You don’t have permission to duplicate this course.")
+        return redirect('course_detail', course_id=course_id)
+
+    # admins copy on behalf of the course's instructor
+    owner = request.user if request.user.role == CustomUser.INSTRUCTOR else course.instructor
+    new_id = course_io.clone_course(course, owner)
+    messages.success(request, "Course duplicated. Rename it for the new term below.")
+    return redirect('course_update', course_id=new_id)
     
+@query_budget(5, post=5)
 @login_required
 @user_passes_test(is_instructor_or_admin)
 def module_create(request, course_id):
@@ -255,7 +556,7 @@ def module_create(request, course_id):
             messages.success(request, "Module created successfully.")
             return redirect('course_detail', course_id=course_id)
     else:
-        form = ModuleForm()
+        form = ModuleForm(initial={'sort_order': ordering.next_key(course.modules.all())})
 
     return render(request, 'module_form.html', {
         'form': form,
@@ -263,6 +564,7 @@ def module_create(request, course_id):
     })
 
 
+@query_budget(5, post=6)
 @login_required
 @user_passes_test(is_instructor_or_admin)
 def module_edit(request, course_id, module_id):
@@ -289,6 +591,7 @@ def module_edit(request, course_id, module_id):
     })
 
 
+@query_budget(post=23)
 @login_required
 @user_passes_test(is_instructor_or_admin)
 def module_delete(request, course_id, module_id):
@@ -307,6 +610,42 @@ def module_delete(request, course_id, module_id):
     messages.success(request, "Module deleted.")
     return redirect('course_detail', course_id=course_id)
 
+
+def _submitted_order(request):
+    # {"order": [id, id, ...]} in the new display order
+    try:
+        order = json.loads(request.body)['order']
+    except (ValueError, KeyError, TypeError):
+        return None
+    if not isinstance(order, list) or not all(type(item) is int for item in order):
+        return None
+    return order
+
+
+def _reorder(request, reorder, parent):
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    order = _submitted_order(request)
+    if order is None:
+        return HttpResponseBadRequest("Expected a JSON body with an \"order\" list of ids.")
+    try:
+        changed = reorder(parent, order)
+    except ordering.OrderConflict as exc:
+        # someone added or removed an item meanwhile: the page must reload
+        return JsonResponse({'error': str(exc)}, status=409)
+    return JsonResponse({'changed': changed})
+
+
+@query_budget(post=8)
+@login_required
+@user_passes_test(is_instructor_or_admin)
+def module_reorder(request, course_id):
+    course = get_object_or_404(Course, pk=course_id)
+    if not request.user.is_superuser and course.instructor_id != request.user.id:
+        return JsonResponse({'error': "You don’t have permission to reorder these modules."}, status=403)
+    return _reorder(request, ordering.reorder_modules, course)
+
+@query_budget(6, post=7)
 @login_required
 @user_passes_test(is_instructor_or_admin)
 def lesson_create(request, module_id):
@@ -325,13 +664,14 @@ def lesson_create(request, module_id):
             messages.success(request, "Lesson created successfully.")
             return redirect('module_detail', module_id=module_id)
     else:
-        form = LessonForm()
+        form = LessonForm(initial={'sort_order': ordering.next_key(module.lessons.all())})
 
     return render(request, 'lesson_form.html', {
         'form': form,
         'module': module,
     })
     
+@query_budget(6, post=7)
 @login_required
 @user_passes_test(is_instructor_or_admin)
 def lesson_edit(request, lesson_id):
@@ -357,6 +697,7 @@ def lesson_edit(request, lesson_id):
     })
 
 
+@query_budget(post=26)
 @login_required
 @user_passes_test(is_instructor_or_admin)
 def lesson_delete(request, lesson_id):
@@ -376,6 +717,17 @@ def lesson_delete(request, lesson_id):
     messages.success(request, "Lesson deleted.")
     return redirect('module_detail', module_id=module_id)
 
+
+@query_budget(post=8)
+@login_required
+@user_passes_test(is_instructor_or_admin)
+def lesson_reorder(request, module_id):
+    module = get_object_or_404(Module.objects.select_related('course'), pk=module_id)
+    if not request.user.is_superuser and module.course.instructor_id != request.user.id:
+        return JsonResponse({'error': "You don’t have permission to reorder these lessons."}, status=403)
+    return _reorder(request, ordering.reorder_lessons, module)
+
+@query_budget(6, post=7)
 @login_required
 @user_passes_test(is_instructor_or_admin)
 def quiz_create(request, lesson_id):
@@ -401,6 +753,7 @@ def quiz_create(request, lesson_id):
         'lesson': lesson,
     })
 
+@query_budget(7, post=8)
 @login_required
 @user_passes_test(is_instructor_or_admin)
 def quiz_edit(request, quiz_id):
@@ -425,6 +778,7 @@ def quiz_edit(request, quiz_id):
     })
 
 
+@query_budget(post=17)
 @login_required
 @user_passes_test(is_instructor_or_admin)
 def quiz_delete(request, quiz_id):
@@ -445,52 +799,24 @@ def quiz_delete(request, quiz_id):
 
 
 
-@login_required
-def quiz_detail(request, quiz_id):
-    quiz = get_object_or_404(Quiz, pk=quiz_id)
-    user = request.user
-    course = quiz.lesson.module.course
-    is_instructor = user.is_superuser or course.instructor == user
+QUIZ_PAGE = Quiz.objects.select_related('lesson__module__course')
 
-    # Instructor sees static overview
-    if is_instructor:
-        return render(request, 'quiz_detail.html', {
-            'quiz': quiz,
-            'is_instructor': True,
-        })
 
-    # STUDENT FLOW
-    if request.method == 'POST':
-        # grading logic unchanged…
-        total = quiz.questions.count()
-        correct_count = 0
-        for question in quiz.questions.all():
-            selected_ids = set(map(int, request.POST.getlist(f'question_{question.id}')))
-            correct_ids  = set(question.choices.filter(is_correct=True)
-                                             .values_list('id', flat=True))
-            if question.question_type == Question.SINGLE:
-                if len(selected_ids) == 1 and selected_ids <= correct_ids:
-                    correct_count += 1
-            else:
-                if selected_ids == correct_ids:
-                    correct_count += 1
-
-        score = round((correct_count / total) * 100, 2) if total else 0
-        QuizSubmission.objects.update_or_create(
-            student=user,
-            quiz=quiz,
-            defaults={'score': score}
-        )
-        return render(request, 'quiz_detail.html', {
-            'quiz': quiz,
-            'is_instructor': False,
-            'submitted': True,
-            'score': score,
-            'total': total,
-        })
+def _is_quiz_instructor(user, quiz):
+    return user.is_superuser or quiz.lesson.module.course.instructor_id == user.id
+
 
-    # GET: prepare shuffled questions & choices
-    questions = list(quiz.questions.prefetch_related('choices').all())
+def _quiz_overview(request, quiz):
+    # Instructor sees static overview; the template renders synchronously,
+    # so everything it reads is loaded up front
+    return render(request, 'quiz_detail.html', {
+        'quiz': quiz,
+        'is_instructor': True,
+    })
+
+
+def _quiz_form(request, quiz, questions):
+    # shuffled questions & choices for the student to answer
     for q in questions:
         choices = list(q.choices.all())
         random.shuffle(choices)
@@ -502,6 +828,95 @@ def quiz_detail(request, quiz_id):
         'submitted': False,
         'questions': questions,
     })
+
+
+@query_budget(5, post=16)
+@login_required
+def quiz_detail(request, quiz_id):
+    quiz = get_object_or_404(QUIZ_PAGE, pk=quiz_id)
+    if _is_quiz_instructor(request.user, quiz):
+        prefetch_related_objects([quiz], 'questions__choices')
+        return _quiz_overview(request, quiz)
+    if request.method == 'POST':
+        return _submit_quiz(request, request.user, quiz, quiz.lesson.module.course)
+    return _quiz_form(request, quiz, list(quiz.questions.prefetch_related('choices')))
+
+
+@query_budget(5, post=16)
+@login_required
+async def aquiz_detail(request, quiz_id):
+    user = await _auser(request)
+    quiz = await aget_object_or_404(QUIZ_PAGE, pk=quiz_id)
+    if _is_quiz_instructor(user, quiz):
+        await aprefetch_related_objects([quiz], 'questions__choices')
+        return _quiz_overview(request, quiz)
+    if request.method == 'POST':
+        return await sync_to_async(_submit_quiz)(request, user, quiz, quiz.lesson.module.course)
+    return _quiz_form(request, quiz, [q async for q in quiz.questions.prefetch_related('choices')])
+
+
+def _submit_quiz(request, user, quiz, course):
+    # grade against the cached answer key: no per-question queries
+    answer_key = get_answer_key(quiz)
+    selections = selected_choices(answer_key, request.POST)
+    correct_count, score = grade(answer_key, selections)
+    choice_ids = set().union(*selections.values())
+    attempt = (correct_questions(answer_key, selections), choice_ids, score)
+
+    with transaction.atomic():
+        # a retake replaces the stored attempt in the item statistics
+        lock_question_stats(list(answer_key))
+        previous = previous_attempt(user, quiz, answer_key)
+        save_submission(user, quiz, score, selections, attempt[0])
+        record_attempt(answer_key, attempt, previous)
+        counters.quiz_attempt_recorded(
+            user, course.id, score, previous[2] if previous else None
+        )
+    return render(request, 'quiz_detail.html', {
+        'quiz': quiz,
+        'is_instructor': False,
+        'submitted': True,
+        'score': score,
+        'total': len(answer_key),
+    })
+
+@query_budget(5)
+@login_required
+@user_passes_test(is_instructor_or_admin)
+def quiz_stats(request, quiz_id):
+    quiz = get_object_or_404(
+        Quiz.objects.select_related('lesson__module__course'),
+        pk=quiz_id
+    )
+    course = quiz.lesson.module.course
+    if not request.user.is_superuser and course.instructor_id != request.user.id:
+        messages.error(request, "You don’t have permission to view these statistics.")
+        return redirect('quiz_detail', quiz_id=quiz_id)
+
+    # reads only the running aggregates, never the submissions themselves
+    questions = list(
+        quiz.questions.select_related('stats')
+                      .prefetch_related(Prefetch(
+                          'choices', queryset=Choice.objects.select_related('stats')
+                      ))
+                      .order_by('id')
+    )
+    for question in questions:
+        stats = getattr(question, 'stats', None)
+        question.attempts = stats.attempts if stats else 0
+        question.difficulty = stats.difficulty if stats else None
+        question.discrimination = stats.discrimination if stats else None
+        for choice in question.choices.all():
+            picks = choice.stats.picks if hasattr(choice, 'stats') else 0
+            choice.picks = picks
+            choice.pick_rate = picks / question.attempts if question.attempts else None
+
+    return render(request, 'quiz_stats.html', {
+        'quiz': quiz,
+        'questions': questions,
+    })
+
+@query_budget(7, post=13)
 @login_required
 @user_passes_test(is_instructor_or_admin)
 def question_create(request, quiz_id):
@@ -521,6 +936,8 @@ def question_create(request, quiz_id):
             formset = ChoiceFormSet(request.POST, instance=question)
             if formset.is_valid():
                 formset.save()
+                # a new question changes every score out of the total
+                schedule_regrade(quiz.id)
                 messages.success(request, "Question and choices saved.")
                 return redirect('quiz_detail', quiz_id=quiz_id)
         else:
@@ -535,6 +952,7 @@ def question_create(request, quiz_id):
         'formset': formset,
     })
     
+@query_budget(9, post=15)
 @login_required
 @user_passes_test(is_instructor_or_admin)
 def question_edit(request, question_id):
@@ -551,6 +969,8 @@ def question_edit(request, question_id):
         if q_form.is_valid() and formset.is_valid():
             q_form.save()
             formset.save()
+            # the answer key may have changed: rescore earlier attempts
+            schedule_regrade(quiz.id)
             messages.success(request, "Question updated.")
             return redirect('quiz_detail', quiz_id=quiz.id)
     else:
@@ -565,6 +985,7 @@ def question_edit(request, question_id):
     })
 
 
+@query_budget(post=14)
 @login_required
 @user_passes_test(is_instructor_or_admin)
 def question_delete(request, question_id):
@@ -580,9 +1001,11 @@ def question_delete(request, question_id):
         return redirect('quiz_detail', quiz_id=quiz.id)
 
     question.delete()
+    schedule_regrade(quiz.id)
     messages.success(request, "Question deleted.")
     return redirect('quiz_detail', quiz_id=quiz.id)
 
+@query_budget(post=15)
 @login_required
 def enroll_course(request, course_id):
     course = get_object_or_404(Course, pk=course_id)
@@ -592,23 +1015,31 @@ def enroll_course(request, course_id):
         messages.error(request, "Only students can enroll in courses.")
         return redirect('course_detail', course_id=course_id)
 
-    # Fetch or create the enrollment record
-    enrollment, created = Enrollment.objects.get_or_create(
-        student=request.user,
-        course=course,
-        defaults={'status': Enrollment.IN_PROGRESS}
-    )
+    # Fetch or create the enrollment record; the row lock keeps the
+    # course stats rollup in step with concurrent enroll/drop clicks
+    with transaction.atomic():
+        enrollment, created = Enrollment.objects.select_for_update().get_or_create(
+            student=request.user,
+            course=course,
+            defaults={'status': Enrollment.IN_PROGRESS}
+        )
 
-    if not created:
-        # if it existed, reset status to in_progress
-        enrollment.status = Enrollment.IN_PROGRESS
-        enrollment.save()
-        messages.success(request, f"You’ve re-enrolled in “{course.title}”.")
-    else:
-        messages.success(request, f"You’ve been enrolled in “{course.title}”!")
+        if created:
+            # start the dashboard counters from what the student already did
+            counters.recount_enrollments([enrollment])
+            counters.enrollment_status_changed(course.id, None, Enrollment.IN_PROGRESS)
+            messages.success(request, f"You’ve been enrolled in “{course.title}”!")
+        else:
+            # if it existed, reset status to in_progress
+            old_status = enrollment.status
+            enrollment.status = Enrollment.IN_PROGRESS
+            enrollment.save(update_fields=['status'])
+            counters.enrollment_status_changed(course.id, old_status, Enrollment.IN_PROGRESS)
+            messages.success(request, f"You’ve re-enrolled in “{course.title}”.")
 
     return redirect('course_detail', course_id=course_id)
 
+@query_budget(post=9)
 @login_required
 def drop_course(request, course_id):
     # only POSTs allowed
@@ -616,20 +1047,200 @@ def drop_course(request, course_id):
         return redirect('course_detail', course_id=course_id)
 
     course = get_object_or_404(Course, pk=course_id)
-    enrollment = Enrollment.objects.filter(
-        student=request.user,
-        course=course,
-        status=Enrollment.IN_PROGRESS
-    ).first()
-
-    if not enrollment:
-        messages.error(request, "You’re not currently enrolled in that course.")
-        return redirect('course_detail', course_id=course_id)
+    with transaction.atomic():
+        enrollment = Enrollment.objects.select_for_update().filter(
+            student=request.user,
+            course=course,
+            status=Enrollment.IN_PROGRESS
+        ).first()
 
-    # mark dropped
-    enrollment.status = Enrollment.DROPPED
-    enrollment.save()
+        if not enrollment:
+            messages.error(request, "You’re not currently enrolled in that course.")
+            return redirect('course_detail', course_id=course_id)
+
+        # mark dropped
+        enrollment.status = Enrollment.DROPPED
+        enrollment.save(update_fields=['status'])
+        counters.enrollment_status_changed(course.id, Enrollment.IN_PROGRESS, Enrollment.DROPPED)
 
     messages.success(request, f"You’ve dropped “{course.title}”.")
     return redirect('course_list')
 
+
+THREADS_PAGE_SIZE = 20
+COMMENTS_PAGE_SIZE = 50
+
+
+@query_budget(4, post=8)
+@login_required
+def lesson_threads(request, lesson_id):
+    lesson = get_object_or_404(Lesson, pk=lesson_id)
+
+    if request.method == 'POST':
+        thread_form = ThreadForm(request.POST)
+        comment_form = CommentForm(request.POST)
+        if thread_form.is_valid() and comment_form.is_valid():
+            with transaction.atomic():
+                thread = thread_form.save(commit=False)
+                thread.lesson = lesson
+                thread.created_by = request.user
+                thread.save()
+                comment = comment_form.save(commit=False)
+                comment.thread = thread
+                comment.user = request.user
+                comment.save()
+            return redirect('thread_detail', thread_id=thread.id)
+    else:
+        thread_form = ThreadForm()
+        comment_form = CommentForm()
+
+    # most recently active first, keyed on (last_activity_at, id)
+    threads = lesson.threads.select_related('created_by')
+    keyset = _keyset(request.GET.get('after'), 't')
+    if keyset:
+        last_activity_at, thread_id = keyset
+        threads = threads.filter(
+            Q(last_activity_at__lt=last_activity_at)
+            | Q(last_activity_at=last_activity_at, id__lt=thread_id)
+        )
+    threads = list(threads.order_by('-last_activity_at', '-id')[:THREADS_PAGE_SIZE + 1])
+    next_cursor = None
+    if len(threads) > THREADS_PAGE_SIZE:
+        threads = threads[:THREADS_PAGE_SIZE]
+        next_cursor = encode_cursor('t', threads[-1].last_activity_at.isoformat(), threads[-1].pk)
+
+    return render(request, 'lesson_threads.html', {
+        'lesson':       lesson,
+        'threads':      threads,
+        'next_cursor':  next_cursor,
+        'thread_form':  thread_form,
+        'comment_form': comment_form,
+    })
+
+
+def _comment_cursor(comment):
+    return encode_cursor('m', comment.created_at.isoformat(), comment.pk)
+
+
+def _comment_page(thread, after=None, before=None, last=False):
+    """
+    One page of comments in (created_at, id) order, walking forward from
+    ``after``, backward from ``before`` or back from the newest comment
+    when ``last`` is set. Returns (comments, older cursor, newer cursor).
+    """
+    comments = thread.comments.select_related('user')
+    if after:
+        created_at, comment_id = after
+        comments = comments.filter(
+            Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=comment_id)
+        )
+    elif before:
+        created_at, comment_id = before
+        comments = comments.filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=comment_id)
+        )
+
+    backward = bool(before) or last
+    if backward:
+        page = list(comments.order_by('-created_at', '-id')[:COMMENTS_PAGE_SIZE + 1])
+        has_older, has_newer = len(page) > COMMENTS_PAGE_SIZE, bool(before)
+        page = page[:COMMENTS_PAGE_SIZE][::-1]
+    else:
+        page = list(comments.order_by('created_at', 'id')[:COMMENTS_PAGE_SIZE + 1])
+        has_older, has_newer = bool(after), len(page) > COMMENTS_PAGE_SIZE
+        page = page[:COMMENTS_PAGE_SIZE]
+
+    older = _comment_cursor(page[0]) if page and has_older else None
+    newer = _comment_cursor(page[-1]) if page and has_newer else None
+    return page, older, newer
+
+
+@query_budget(4, post=5)
+@login_required
+def thread_detail(request, thread_id):
+    thread = get_object_or_404(
+        DiscussionThread.objects.select_related('lesson', 'created_by'),
+        pk=thread_id
+    )
+
+    if request.method == 'POST':
+        form = CommentForm(request.POST)
+        if form.is_valid():
+            comment = form.save(commit=False)
+            comment.thread = thread
+            comment.user = request.user
+            comment.save()
+            url = reverse('thread_detail', args=[thread.id])
+            return redirect(f'{url}?last=1#comment-{comment.id}')
+    else:
+        form = CommentForm()
+
+    comments, older, newer = _comment_page(
+        thread,
+        after=_keyset(request.GET.get('after'), 'm'),
+        before=_keyset(request.GET.get('before'), 'm'),
+        last=bool(request.GET.get('last')),
+    )
+    return render(request, 'thread_detail.html', {
+        'thread':       thread,
+        'comments':     comments,
+        'older_cursor': older,
+        'newer_cursor': newer,
+        'form':         form,
+    })
+
+
+SSE_KEEPALIVE = 15
+SSE_RETRY_MS = 5000
+
+
+def _sse(message):
+    return f"id: {message['id']}\ndata: {json.dumps(message)}\n\n"
+
+
+async def _thread_stream(thread_id, since):
+    with pubsub.get_broker().subscribe(pubsub.thread_channel(thread_id)) as queue:
+        yield f'retry: {SSE_RETRY_MS}\n\n'
+        # subscribed first, so nothing committed after these queries is
+        # missed; a page at a time, however long the client was away
+        while since is not None:
+            missed = [
+                comment async for comment in
+                Comment.objects.filter(thread_id=thread_id, id__gt=since)
+                               .select_related('user')
+                               .order_by('id')[:COMMENTS_PAGE_SIZE]
+            ]
+            for comment in missed:
+                since = comment.pk
+                yield _sse(pubsub.comment_message(comment))
+            if len(missed) < COMMENTS_PAGE_SIZE:
+                break
+        while True:
+            try:
+                message = await asyncio.wait_for(queue.get(), SSE_KEEPALIVE)
+            except asyncio.TimeoutError:
+                # keeps proxies from closing an idle stream
+                yield ': keepalive\n\n'
+                continue
+            if since is not None and message['id'] <= since:
+                continue
+            yield _sse(message)
+
+
+@query_budget(2)
+@login_required
+async def thread_events(request, thread_id):
+    # server-sent events carrying the new comments of one thread
+    if not isinstance(request, ASGIRequest):
+        # a WSGI worker would be tied up for as long as the page stays open
+        return HttpResponse(status=204)
+    if not await DiscussionThread.objects.filter(pk=thread_id).aexists():
+        raise Http404("No thread matches the given query.")
+
+    since = request.headers.get('Last-Event-ID') or request.GET.get('since')
+    since = int(since) if since and since.isdigit() else None
+    return StreamingHttpResponse(
+        _thread_stream(thread_id, since),
+        content_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )